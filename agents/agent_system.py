@@ -1,143 +1,206 @@
-import json
+import asyncio
+import logging
 import os
-import sys
-import signal
 import time
-from contextlib import contextmanager
-from .models import WorkflowState, AnalysisContext
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from .models import WorkflowState, AnalysisContext, AgentResponse, Severity
 from .security_agent import SecurityAgent
 from .quality_agent import QualityAgent
 from .logic_agent import LogicAgent
 from .context_agent import ContextAgent
 from .decision_agent import DecisionAgent
+from .llm_cache import llm_cache
+from .metrics import AGENT_LATENCY, LLM_TOKENS, model_label
+from .background import background_jobs
+from .static_analysis import prefilter_snippets
+from .tools import create_http_clients, shared_http_clients
 
+logger = logging.getLogger(__name__)
 
-class TimeoutException(Exception):
-    """Custom exception for timeouts."""
-    pass
-
-
-@contextmanager
-def time_limit(seconds):
-    """Context manager to enforce a time limit on execution."""
-    if sys.platform == "win32":
-        # Windows fallback: manual timing
-        start = time.time()
-        yield
-        if time.time() - start > seconds:
-            raise TimeoutException("Timed out!")
-    else:
-        def signal_handler(signum, frame):
-            raise TimeoutException("Timed out!")
-        signal.signal(signal.SIGALRM, signal_handler)
-        signal.alarm(seconds)
-        try:
-            yield
-        finally:
-            signal.alarm(0)
+# Upper bound for one pull request analysis
+ANALYSIS_TIMEOUT_SECONDS = 120
 
 
 class AgentSystem:
     def __init__(self, provider: str = "gemini", device: str = "cpu"):  # fixed constructor typo
         self.provider = provider
         self.device = device
-        self.agents = {
-            "security": SecurityAgent(provider),
-            "quality": QualityAgent(provider),
-            "logic": LogicAgent(provider),
-            "context": ContextAgent(provider, device=device),
-            "decision": DecisionAgent(provider)
-        }
-
-    def analyze_pull_request(self, context: AnalysisContext):
-        """Run PR analysis manually with detailed logging."""
-        print("Starting workflow analysis...")
-        print(f"Code snippets: {len(context.code_snippets)}")
+        # One keep-alive pool for all agents so TLS sessions are reused across LLM calls
+        self.http_client, self.http_async_client = create_http_clients()
+        with shared_http_clients(self.http_client, self.http_async_client):
+            self.agents = {
+                "security": SecurityAgent(provider),
+                "quality": QualityAgent(provider),
+                "logic": LogicAgent(provider),
+                "context": ContextAgent(provider, device=device),
+                "decision": DecisionAgent(provider)
+            }
+
+    async def analyze_pull_request(self, context: AnalysisContext):
+        """Run PR analysis with the independent agents executing concurrently."""
+        logger.info("Starting analysis of %s PR %s (%d snippets)",
+                    context.repo_name, context.pr_id, len(context.code_snippets))
 
         state = WorkflowState(context=context)
-        print("Initial state created")
 
         try:
-            with time_limit(120):
-                # --- Security Agent ---
-                print("\n--- Executing Security Agent ---")
-                security_response = self.agents["security"].analyze(state)
-                state.security_results = security_response.results
-                print(f"Security issues found: {len(state.security_results)}")
-
-                # --- Quality Agent ---
-                print("\n--- Executing Quality Agent ---")
-                quality_response = self.agents["quality"].analyze(state)
-                state.quality_results = quality_response.results
-                print(f"Quality issues found: {len(state.quality_results)}")
-
-                # --- Logic Agent ---
-                print("\n--- Executing Logic Agent ---")
-                logic_response = self.agents["logic"].analyze(state)
-                state.logic_results = logic_response.results
-                print(f"Logic issues found: {len(state.logic_results)}")
-
-                # --- Context Agent ---
-                print("\n--- Executing Context Agent ---")
-                context_result = self.agents["context"].enrich_context(state)
-                state.enriched_context = context_result
-                print("Context enriched")
-
-                # --- Decision Agent ---
-                print("\n--- Executing Decision Agent ---")
-                decision_result = self.agents["decision"].make_decision(state)
-                state.decision = decision_result
-                print(f"Final decision: {state.decision.get('decision', 'UNKNOWN')}")
-
-                return {
-                    "security_issues": state.security_results,
-                    "quality_issues": state.quality_results,
-                    "logic_issues": state.logic_results,
-                    "decision": state.decision,
-                    "context": state.enriched_context,
-                    "errors": {
-                        "security": security_response.errors,
-                        "quality": quality_response.errors,
-                        "logic": logic_response.errors
-                    }
+            # The decision does not depend on context enrichment, so it runs on a
+            # background worker and callers poll for it by job id.
+            context_job_id = background_jobs.submit(self._timed_call, "context", self.agents["context"].enrich_context, state)
+            state.enriched_context = {"status": "pending", "job_id": context_job_id}
+
+            # Security, quality and logic only read the snippets, so they run at once.
+            logger.debug("Executing security, quality and logic agents")
+            quality_task = asyncio.create_task(self._timed("quality", self.agents["quality"].aanalyze(state)))
+            logic_task = asyncio.create_task(self._timed("logic", self.agents["logic"].aanalyze(state)))
+
+            def on_security_issue(vulnerability):
+                # A critical finding means BLOCK whatever else is found,
+                # so stop paying for the remaining quality/logic calls.
+                if vulnerability.severity is Severity.CRITICAL:
+                    for task in (quality_task, logic_task):
+                        task.cancel()
+
+            security_response, quality_response, logic_response = await asyncio.wait_for(
+                asyncio.gather(
+                    self._timed("security", self._run_security(context, on_security_issue)),
+                    self._skip_if_cancelled(quality_task),
+                    self._skip_if_cancelled(logic_task)
+                ),
+                timeout=ANALYSIS_TIMEOUT_SECONDS
+            )
+
+            state.security_results = security_response.results
+            state.quality_results = quality_response.results
+            state.logic_results = logic_response.results
+            logger.debug("Issues found: %d security, %d quality, %d logic",
+                         len(state.security_results), len(state.quality_results), len(state.logic_results))
+
+            # --- Decision Agent ---
+            decision_result = self._timed_call("decision", self.agents["decision"].make_decision, state)
+            state.decision = decision_result
+            logger.info("Analysis of %s PR %s finished: %s",
+                        context.repo_name, context.pr_id, state.decision.get("decision", "UNKNOWN"))
+
+            return {
+                "security_issues": state.security_results,
+                "quality_issues": state.quality_results,
+                "logic_issues": state.logic_results,
+                "decision": state.decision,
+                "context": state.enriched_context,
+                "errors": {
+                    "security": security_response.errors,
+                    "quality": quality_response.errors,
+                    "logic": logic_response.errors
                 }
+            }
 
-        except TimeoutException:
-            print("Workflow error: Timed out after 2 minutes")
-            return {"error": "Analysis timed out after 2 minutes"}
+        except asyncio.TimeoutError:
+            logger.error("Analysis timed out after %s seconds", ANALYSIS_TIMEOUT_SECONDS)
+            return {"error": f"Analysis timed out after {ANALYSIS_TIMEOUT_SECONDS} seconds"}
         except Exception as e:
-            print(f"Workflow error: {str(e)}")
+            logger.exception("Analysis failed: %s", e)
             return {"error": str(e)}
 
+    def _metric_labels(self, name: str) -> tuple:
+        return name, self.provider, model_label(getattr(self.agents[name], "llm", None))
+
+    async def _timed(self, name: str, awaitable):
+        """Await an agent call, recording its latency unless it fails or is cancelled."""
+        start = time.perf_counter()
+        result = await awaitable
+        AGENT_LATENCY.observe(time.perf_counter() - start, *self._metric_labels(name))
+        return result
+
+    def _timed_call(self, name: str, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        AGENT_LATENCY.observe(time.perf_counter() - start, *self._metric_labels(name))
+        return result
+
+    async def _run_security(self, context: AnalysisContext, on_result) -> AgentResponse:
+        """Pre-scan snippets with ruff/bandit and send only the risky ones to the SecurityAgent."""
+        needs_llm, clean, findings = await prefilter_snippets(context.code_snippets)
+        logger.debug("Static pre-scan: %d snippets need LLM review, %d clean", len(needs_llm), len(clean))
+
+        if clean and not needs_llm:
+            return AgentResponse(success=True, metadata={"skipped_clean_files": len(clean)})
+
+        security_context = context.model_copy(update={
+            "code_snippets": needs_llm,
+            "agent_memory": {**context.agent_memory, "static_findings": findings}
+        })
+        return await self.agents["security"].aanalyze(
+            WorkflowState(context=security_context), on_result=on_result
+        )
+
+    @staticmethod
+    async def _skip_if_cancelled(task: asyncio.Task) -> AgentResponse:
+        """Await an agent task, turning an early-BLOCK cancellation into an empty response."""
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            return AgentResponse(
+                success=False,
+                errors=["Skipped: critical security issue found"],
+                metadata={"skipped": True}
+            )
+
+    def analyze_pull_request_sync(self, context: AnalysisContext):
+        """Blocking wrapper around analyze_pull_request, safe to call from any thread."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.analyze_pull_request(context))
+
+        # Called from inside a running event loop: use a private loop on a helper thread
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self.analyze_pull_request(context)).result()
+
+    async def aclose(self):
+        """Flush buffered context memory and close the shared HTTP connection pools."""
+        self.agents["context"].flush()
+        self.http_client.close()
+        await self.http_async_client.aclose()
+
+    @staticmethod
+    def get_context_job(job_id: str):
+        """Return the state of a queued context enrichment / feedback job, or None if unknown."""
+        return background_jobs.status(job_id)
+
     def get_agent_status(self):
         return {
             "provider": self.provider,
-            "agents": {name: "active" for name in self.agents.keys()}
+            "agents": {name: "active" for name in self.agents.keys()},
+            "llm_cache": llm_cache.stats(),
+            "latency": AGENT_LATENCY.snapshot(),
+            "tokens": LLM_TOKENS.snapshot()
         }
 
-    def record_feedback(self, pr_id: str, feedback: dict) -> bool:
-        """Record developer feedback to improve agents."""
-        try:
-            os.makedirs("feedback", exist_ok=True)
-            feedback_file = f"feedback/{pr_id}.json"
-            with open(feedback_file, "w") as f:
-                json.dump(feedback, f)
-
-            if feedback.get("accepted_issues"):
-                self.agents["context"].update_severity(
-                    context_key=feedback["pr_context"],
-                    issue_ids=feedback["accepted_issues"],
-                    severity_adjust=-1
-                )
-
-            if feedback.get("rejected_issues"):
-                self.agents["context"].update_severity(
-                    context_key=feedback["pr_context"],
-                    issue_ids=feedback["rejected_issues"],
-                    severity_adjust=1
-                )
-
-            return True
-        except Exception as e:
-            print(f"Feedback recording failed: {str(e)}")
-            return False
+    def record_feedback(self, pr_id: str, feedback: dict) -> str:
+        """Queue developer feedback for recording and return the background job id."""
+        return background_jobs.submit(self._write_feedback, pr_id, feedback)
+
+    def _write_feedback(self, pr_id: str, feedback: dict):
+        """Persist feedback and adjust remembered severities (runs on a background worker)."""
+        os.makedirs("feedback", exist_ok=True)
+        feedback_file = f"feedback/{pr_id}.json"
+        with open(feedback_file, "wb") as f:
+            f.write(orjson.dumps(feedback, option=orjson.OPT_SERIALIZE_NUMPY))
+
+        if feedback.get("accepted_issues"):
+            self.agents["context"].update_severity(
+                context_key=feedback["pr_context"],
+                issue_ids=feedback["accepted_issues"],
+                severity_adjust=-1
+            )
+
+        if feedback.get("rejected_issues"):
+            self.agents["context"].update_severity(
+                context_key=feedback["pr_context"],
+                issue_ids=feedback["rejected_issues"],
+                severity_adjust=1
+            )
@@ -0,0 +1,73 @@
+import uuid
+import queue
+import logging
+import threading
+from typing import Optional
+
+from .llm_cache import LRUDict
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundJobs:
+    """Small worker-thread pool for work kept off the analysis critical path.
+
+    Job states are kept in a bounded LRU so clients can poll for results
+    after the analysis that queued them has returned.
+    """
+
+    def __init__(self, workers: int = 2, max_jobs: int = 1024):
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._jobs = LRUDict(maxsize=max_jobs)
+        self._done = threading.Condition()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"patchpilot-jobs-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            job_id, func, args, kwargs = self._queue.get()
+            try:
+                state = {"status": "completed", "result": func(*args, **kwargs)}
+            except Exception as e:
+                logger.error(f"Background job {job_id} failed: {str(e)}")
+                state = {"status": "failed", "error": str(e)}
+            with self._done:
+                self._jobs[job_id] = state
+                self._done.notify_all()
+            self._queue.task_done()
+
+    def submit(self, func, *args, **kwargs) -> str:
+        """Queue ``func(*args, **kwargs)`` and return its job id immediately."""
+        self._ensure_started()
+        job_id = str(uuid.uuid4())
+        self._jobs[job_id] = {"status": "pending"}
+        self._queue.put((job_id, func, args, kwargs))
+        return job_id
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """Return the job state, or None for unknown (or evicted) jobs."""
+        state = self._jobs.get(job_id)
+        return dict(state, job_id=job_id) if state is not None else None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[dict]:
+        """Block until the job has finished (or the timeout expires) and return its state."""
+        with self._done:
+            self._done.wait_for(
+                lambda: (self._jobs.get(job_id) or {}).get("status") != "pending",
+                timeout=timeout
+            )
+        return self.status(job_id)
+
+
+# Process-wide job queue shared by every AgentSystem instance
+background_jobs = BackgroundJobs()
@@ -1,16 +1,21 @@
-import json
 import os
 import logging
+import threading
+import time
+from functools import cached_property, lru_cache
+from typing import Optional
 import numpy as np
-from onnxruntime import InferenceSession
+import orjson
+from onnxruntime import ExecutionMode, GraphOptimizationLevel, InferenceSession, SessionOptions
 from transformers import AutoTokenizer
 from huggingface_hub import hf_hub_download
+from huggingface_hub.errors import EntryNotFoundError
 
 from .models import AnalysisContext, AgentResponse, WorkflowState
 from .tools import get_llm, hash_content
+from .llm_cache import LRUDict
 
 from langchain_core.prompts import ChatPromptTemplate
-from langchain.memory import VectorStoreRetrieverMemory
 from langchain_chroma import Chroma
 from langchain_core.embeddings import Embeddings
 
@@ -20,29 +25,79 @@ import chromadb
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Number of buffered memory writes that triggers a flush to the vector store
+WRITE_BATCH_SIZE = 32
+# History records kept per context key
+MAX_HISTORY_RECORDS = 20
+
+# Dynamic INT8 export (see DOCUMENTATION.md); FP32 is the fallback
+QUANTIZED_MODEL_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+FP32_MODEL_FILE = "onnx/model.onnx"
+
 
 class ONNXEmbeddings(Embeddings):
     """Custom embedding class using ONNX runtime for CPU efficiency."""
 
-    def __init__(self, model_repo="sentence-transformers/all-MiniLM-L6-v2"):
+    def __init__(self, model_repo="sentence-transformers/all-MiniLM-L6-v2", device: str = "cpu",
+                 batch_size: int = 32, quantized: bool = True, output_index: int = 0,
+                 dim: Optional[int] = None, cache_size: int = 4096):
         self.model_repo = model_repo
-        self.model_path = self._download_model()
-        self.session = InferenceSession(self.model_path, providers=["CPUExecutionProvider"])
+        self.batch_size = batch_size
+        # PR snippets repeat across runs; key vectors by content hash
+        self._cache = LRUDict(maxsize=cache_size)
+        # Early-exit layer output and Matryoshka truncation; only meaningful for
+        # models trained for it (e.g. nomic-embed-text-v1.5), so off by default
+        self.dim = dim
+        # INT8 kernels only pay off on CPU; CUDA keeps the FP32 export
+        self.model_path = self._download_model(quantized and device == "cpu")
+
+        providers = ["CPUExecutionProvider"]
+        if device == "cuda":
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = self._create_session(device, providers)
 
         # Load tokenizer for preprocessing
         self.tokenizer = AutoTokenizer.from_pretrained(model_repo)
         self.input_names = [inp.name for inp in self.session.get_inputs()]
+        self.output_names = [self.session.get_outputs()[output_index].name]
 
-    def _download_model(self) -> str:
+    def _download_model(self, quantized: bool = True) -> str:
+        """Download the ONNX export, preferring the INT8 build when the repo ships one."""
         logger.info("Downloading ONNX embedding model if not present...")
-        path = hf_hub_download(
-            repo_id=self.model_repo,
-            filename="onnx/model.onnx",
-            local_dir="onnx_model",
-            local_dir_use_symlinks=False
-        )
-        logger.info(f"Model downloaded to: {path}")
-        return path
+        filenames = [QUANTIZED_MODEL_FILE, FP32_MODEL_FILE] if quantized else [FP32_MODEL_FILE]
+        for filename in filenames:
+            try:
+                path = hf_hub_download(
+                    repo_id=self.model_repo,
+                    filename=filename,
+                    local_dir="onnx_model",
+                    local_dir_use_symlinks=False
+                )
+            except EntryNotFoundError:
+                if filename == filenames[-1]:
+                    raise
+                logger.info(f"{filename} not available for {self.model_repo}, falling back")
+                continue
+            logger.info(f"Model downloaded to: {path}")
+            return path
+
+    def _create_session(self, device: str, providers: list) -> InferenceSession:
+        """Create a fully optimized ORT session, reusing the fused graph from a previous run."""
+        options = SessionOptions()
+        options.graph_optimization_level = GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = int(os.environ.get("OMP_NUM_THREADS", os.cpu_count() or 1))
+        options.enable_mem_pattern = True
+        options.enable_cpu_mem_arena = True
+
+        # Fused graphs are provider specific, so keep one per device
+        stem = os.path.splitext(self.model_path)[0]
+        optimized_path = f"{stem}.opt.{device}.onnx"
+        if os.path.exists(optimized_path):
+            return InferenceSession(optimized_path, sess_options=options, providers=providers)
+
+        options.optimized_model_filepath = optimized_path
+        return InferenceSession(self.model_path, sess_options=options, providers=providers)
 
     def _preprocess(self, texts):
         """Tokenize input text for ONNX model."""
@@ -53,58 +108,81 @@ class ONNXEmbeddings(Embeddings):
             return_tensors="np"
         )
 
+    def _embed_batch(self, texts):
+        """Embed several texts with one ONNX forward pass.
+
+        Mean-pools over real tokens and L2-normalizes, matching how
+        sentence-transformers produces MiniLM sentence embeddings.
+        """
+        inputs = self._preprocess(texts)
+        ort_inputs = {name: inputs[name] for name in self.input_names if name in inputs}
+
+        token_embeddings = self.session.run(self.output_names, ort_inputs)[0]  # (batch, seq_len, hidden_dim)
+        # Padding tokens must not contribute to the sentence embedding
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.dim:
+            embeddings = embeddings[:, :self.dim]
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return (embeddings / np.clip(norms, 1e-12, None)).tolist()
+
     def embed_documents(self, texts):
-        """Embed a list of documents."""
-        return [self.embed_query(text) for text in texts]
+        """Embed a list of documents, batch_size texts per forward pass.
+
+        Previously seen texts come from the cache; the rest are grouped by
+        length so each batch pads to a similar sequence length. Results are
+        returned in the original order.
+        """
+        keys = [hash_content(text) for text in texts]
+        embeddings = [self._cache.get(key) for key in keys]
+        misses = sorted((i for i, embedding in enumerate(embeddings) if embedding is None),
+                        key=lambda i: len(texts[i]))
+        for start in range(0, len(misses), self.batch_size):
+            batch = misses[start:start + self.batch_size]
+            for index, embedding in zip(batch, self._embed_batch([texts[i] for i in batch])):
+                embeddings[index] = embedding
+                self._cache[keys[index]] = embedding
+        return embeddings
 
     def embed_query(self, text):
         """Embed a single query text."""
-        inputs = self._preprocess([text])
-        ort_inputs = {name: inputs[name] for name in self.input_names if name in inputs}
+        return self.embed_documents([text])[0]
 
-        outputs = self.session.run(None, ort_inputs)
-        embeddings = outputs[0][0]  # (1, hidden_dim)
-        return embeddings.tolist()
 
+class LazyEmbeddings(Embeddings):
+    """Defers loading an embedding model until the first text is embedded."""
 
-class ContextAgent:
-    def __init__(self, provider: str = "gemini", device: str = "cpu"):
-        if provider not in ["gemini", "openai", "anthropic"]:
-            raise ValueError(f"Unsupported provider: {provider}")
+    def __init__(self, factory):
+        self._factory = factory
 
-        self.llm = get_llm("context", provider)
+    @cached_property
+    def model(self) -> Embeddings:
+        return self._factory()
 
-        try:
-            # Initialize ONNX embeddings
-            self.embedding = ONNXEmbeddings()
+    def embed_documents(self, texts):
+        return self.model.embed_documents(texts)
 
-            # Create persistent directory if not exists
-            persist_dir = "memory_store"
-            os.makedirs(persist_dir, exist_ok=True)
+    def embed_query(self, text):
+        return self.model.embed_query(text)
 
-            # Initialize Chroma client with new API
-            client = chromadb.PersistentClient(path=persist_dir)
 
-            # Initialize vector store
-            self.vector_store = Chroma(
-                client=client,
-                collection_name="context_memory",
-                embedding_function=self.embedding,
-            )
+@lru_cache(maxsize=None)
+def _get_embedder(model_repo: str, device: str) -> ONNXEmbeddings:
+    """Process-wide embedding model, loaded once per (model, device)."""
+    return ONNXEmbeddings(model_repo, device=device)
 
-        except Exception as e:
-            raise RuntimeError(f"Failed to initialize embedding model: {str(e)}")
 
-        # Memory retriever
-        self.memory = VectorStoreRetrieverMemory(
-            retriever=self.vector_store.as_retriever(search_kwargs={"k": 3})
-        )
+@lru_cache(maxsize=None)
+def _get_chroma_client(persist_dir: str):
+    """Process-wide Chroma client for a persistence directory."""
+    os.makedirs(persist_dir, exist_ok=True)
+    return chromadb.PersistentClient(path=persist_dir)
 
-        # Prompt template
-        self.prompt = ChatPromptTemplate.from_messages([
-            (
-                "system",
-                """You are a context manager. Analyze historical data:
+
+CONTEXT_PROMPT = ChatPromptTemplate.from_messages([
+    (
+        "system",
+        """You are a context manager. Analyze historical data:
 
 Developer Profile:
 - Name: {author}
@@ -119,20 +197,56 @@ Current PR Context:
 Historical Context: {history}
 
 Adjust severity for recurring issues and identify patterns."""
-            ),
-            ("human", "Enrich context for PR: {pr_id}")
-        ])
+    ),
+    ("human", "Enrich context for PR: {pr_id}")
+])
+
+
+class ContextAgent:
+    embedding_model = "sentence-transformers/all-MiniLM-L6-v2"
+    persist_dir = "memory_store"
+
+    def __init__(self, provider: str = "gemini", device: str = "cpu"):
+        if provider not in ["gemini", "openai", "anthropic"]:
+            raise ValueError(f"Unsupported provider: {provider}")
+
+        self.llm = get_llm("context", provider)
+        self.device = device
+        self._pending_writes = []
+        self._write_lock = threading.Lock()
+
+        # Prompt template
+        self.prompt = CONTEXT_PROMPT
+
+    # Embeddings and the vector store are only loaded when memory is first used;
+    # reads such as load_history open the store without loading the model
+    @cached_property
+    def embedding(self) -> ONNXEmbeddings:
+        try:
+            return _get_embedder(self.embedding_model, self.device)
+        except Exception as e:
+            raise RuntimeError(f"Failed to initialize embedding model: {str(e)}")
+
+    @cached_property
+    def vector_store(self) -> Chroma:
+        return Chroma(
+            client=_get_chroma_client(self.persist_dir),
+            collection_name="context_memory",
+            embedding_function=LazyEmbeddings(lambda: self.embedding),
+        )
 
     def enrich_context(self, state: WorkflowState) -> dict:
         logger.info("Enriching context...")
         context = state.context
+        snippets = context.code_snippets
 
         return {
             "repo": context.repo_name,
             "pr_id": context.pr_id,
             "author": context.author,
-            "files_analyzed": len(context.code_snippets),
-            "languages": list(set(s.language for s in context.code_snippets))
+            "files_analyzed": len(snippets),
+            # dict.fromkeys dedupes in first-seen order, so the output is stable
+            "languages": list(dict.fromkeys([s.language for s in snippets]))
         }
 
     def update_severity(self, context_key: str, issue_ids: list, severity_adjust: int):
@@ -140,52 +254,95 @@ Adjust severity for recurring issues and identify patterns."""
             raise ValueError("issue_ids must be a non-empty list")
 
         try:
-            history = self.memory.load_memory_variables({"prompt": context_key})
+            history = self.load_history(context_key)
             updated_history = []
+            ids = set(issue_ids)
 
             for record in history:
                 if isinstance(record, str):
                     try:
-                        record = json.loads(record)
-                    except json.JSONDecodeError as e:
+                        record = orjson.loads(record)
+                    except orjson.JSONDecodeError as e:
                         logger.error(f"Invalid JSON in memory record: {str(e)}")
                         continue
 
                 for issue in record.get("issues", []):
-                    if issue.get("id") in issue_ids:
-                        current_sev = issue.get("severity", 2)
-                        issue["severity"] = max(1, min(4, current_sev + severity_adjust))
+                    if issue.get("id") in ids:
+                        severity = issue.get("severity", 2) + severity_adjust
+                        issue["severity"] = 1 if severity < 1 else 4 if severity > 4 else severity
 
                 updated_history.append(record)
 
-            self.memory.save_context(
-                {"input": context_key},
-                {"output": json.dumps(updated_history)}
-            )
-
-            self.vector_store.persist()
-
-            if not os.path.exists("memory_store"):
-                raise RuntimeError("Failed to persist memory store")
+            self._queue_write(context_key, orjson.dumps(updated_history[-MAX_HISTORY_RECORDS:]).decode())
 
         except Exception as e:
             logger.error(f"Failed to update severity for context '{context_key}': {str(e)}")
             raise
 
+    def load_history(self, context_key: str) -> list:
+        """Return the latest stored history records for a context key.
+
+        Looks the key up by metadata rather than by similarity search, and
+        sees writes that are still buffered.
+        """
+        with self._write_lock:
+            for key, output, _ in reversed(self._pending_writes):
+                if key == context_key:
+                    return orjson.loads(output)
+
+        stored = self.vector_store.get(where={"context_key": context_key}, include=["documents", "metadatas"])
+        if not stored["documents"]:
+            return []
+
+        latest = max(
+            zip(stored["documents"], stored["metadatas"]),
+            key=lambda item: item[1].get("updated_at", 0)
+        )[0]
+        output = latest.split("\noutput: ", 1)[-1]
+        try:
+            return orjson.loads(output)
+        except orjson.JSONDecodeError as e:
+            logger.error(f"Invalid JSON in memory record: {str(e)}")
+            return []
+
+    def _queue_write(self, context_key: str, output: str):
+        """Buffer a memory record, writing the batch once WRITE_BATCH_SIZE is reached.
+
+        PersistentClient persists on every write, so batching saves one
+        embedding pass and one SQLite commit per record. A crash loses at
+        most the unflushed records.
+        """
+        with self._write_lock:
+            self._pending_writes.append((context_key, output, time.time()))
+            if len(self._pending_writes) < WRITE_BATCH_SIZE:
+                return
+            batch, self._pending_writes = self._pending_writes, []
+        self._write_batch(batch)
+
+    def _write_batch(self, batch: list):
+        self.vector_store.add_texts(
+            [f"input: {key}\noutput: {output}" for key, output, _ in batch],
+            metadatas=[{"context_key": key, "updated_at": updated_at} for key, _, updated_at in batch]
+        )
+
+    def flush(self):
+        """Write any buffered memory records to the vector store."""
+        with self._write_lock:
+            batch, self._pending_writes = self._pending_writes, []
+        if batch:
+            self._write_batch(batch)
+
     def _analyze_commit_history(self, history: list) -> str:
-        patterns = {
-            "security_fixes": sum(
-                1 for c in history
-                if "fix" in c.get("message", "").lower() and "security" in c.get("message", "").lower()
-            ),
-            "bug_fixes": sum(
-                1 for c in history
-                if "fix" in c.get("message", "").lower() and "bug" in c.get("message", "").lower()
-            ),
-            "features": sum(
-                1 for c in history
-                if "feat" in c.get("message", "").lower() or "feature" in c.get("message", "").lower()
-            )
-        }
+        patterns = {"security_fixes": 0, "bug_fixes": 0, "features": 0}
+
+        # Lowercase once and use substring checks: faster than a regex or
+        # numpy string ops at every history size we have measured
+        for commit in history:
+            message = commit.get("message", "").lower()
+            if "fix" in message:
+                patterns["security_fixes"] += "security" in message
+                patterns["bug_fixes"] += "bug" in message
+            # "feat" also covers "feature"
+            patterns["features"] += "feat" in message
 
         return "\n".join([f"{k}: {v} occurrences" for k, v in patterns.items()])
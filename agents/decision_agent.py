@@ -1,16 +1,35 @@
-import json
-from .models import WorkflowState
+from collections import Counter
+from typing import NamedTuple
+import orjson
+from .models import Severity, WorkflowState
 from .tools import get_llm
 from langchain_core.prompts import ChatPromptTemplate
 
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-class DecisionAgent:
-    def __init__(self, provider: str = "gemini"):
-        self.llm = get_llm("decision", provider)
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a decision agent. Evaluate:
+class DecisionRule(NamedTuple):
+    decision: str
+    risk_level: str
+    summary: str  # formatted with the critical/high counts
+    recommendation: str
+
+
+_BLOCK_CRITICAL = DecisionRule("BLOCK", "critical", "{critical} critical security issues found",
+                               "Fix critical issues immediately")
+
+# (critical > 0, high > 0) -> rule
+DECISION_TABLE = {
+    (True, True): _BLOCK_CRITICAL,
+    (True, False): _BLOCK_CRITICAL,
+    (False, True): DecisionRule("REQUEST_CHANGES", "high", "{high} high severity issues found",
+                                "Address high severity issues"),
+    (False, False): DecisionRule("APPROVE", "low", "No critical issues found", "No action required"),
+}
+
+
+DECISION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a decision agent. Evaluate:
 
 Security Issues: {security_issues}
 Quality Issues: {quality_issues}
@@ -26,58 +45,46 @@ Generate remediation plan:
 - Auto-fix trivial issues
 - Suggest fixes for complex issues
 - Block merge if critical"""),
-            ("human", "Decide for PR: {pr_id}")
-        ])
+    ("human", "Decide for PR: {pr_id}")
+])
+
+
+class DecisionAgent:
+    def __init__(self, provider: str = "gemini"):
+        self.llm = get_llm("decision", provider)
+        self.prompt = DECISION_PROMPT
 
     def make_decision(self, state: WorkflowState) -> dict:
         """Make a decision based on security and quality analysis results."""
-        print("Making decision based on analysis results...")
-
-        # Count issues by severity
-        critical = sum(1 for i in state.security_results if i.severity == "critical")
-        high = sum(1 for i in state.security_results if i.severity == "high")
+        # Count issues by severity in a single pass
+        severity_counts = Counter(i.severity for i in state.security_results)
+        critical = severity_counts[Severity.CRITICAL]
+        high = severity_counts[Severity.HIGH]
         total_issues = len(state.security_results) + len(state.quality_results)
 
-        # Decision logic
-        if critical > 0:
-            return {
-                "decision": "BLOCK",
-                "risk_level": "critical",
-                "summary": f"{critical} critical security issues found",
-                "recommendations": ["Fix critical issues immediately"],
-                "total_issues": total_issues
-            }
-        elif high > 0:
-            return {
-                "decision": "REQUEST_CHANGES",
-                "risk_level": "high",
-                "summary": f"{high} high severity issues found",
-                "recommendations": ["Address high severity issues"],
-                "total_issues": total_issues
-            }
-        else:
-            return {
-                "decision": "APPROVE",
-                "risk_level": "low",
-                "summary": "No critical issues found",
-                "recommendations": ["No action required"],
-                "total_issues": total_issues
-            }
+        rule = DECISION_TABLE[(critical > 0, high > 0)]
+        return {
+            "decision": rule.decision,
+            "risk_level": rule.risk_level,
+            "summary": rule.summary.format(critical=critical, high=high),
+            "recommendations": [rule.recommendation],
+            "total_issues": total_issues
+        }
 
     def _parse_response(self, response: str) -> dict:
         """Parse LLM response into structured data."""
-        try:
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0]
-                return json.loads(json_str)
-            elif "{" in response:
-                return json.loads(response)
-            else:
-                raise ValueError("No valid JSON found")
-        except (json.JSONDecodeError, ValueError):
-            return {
-                "decision": "BLOCK" if "critical" in response.lower() else "REQUEST_CHANGES",
-                "summary": response[:200],
-                "auto_fix_issues": [],
-                "critical_issues": []
-            }
+        # The outermost braces bound the JSON whether or not it is fenced
+        start = response.find("{")
+        end = response.rfind("}")
+        if start != -1 and end > start:
+            try:
+                return orjson.loads(response[start:end + 1])
+            except orjson.JSONDecodeError:
+                pass
+
+        return {
+            "decision": "BLOCK" if "critical" in response.lower() else "REQUEST_CHANGES",
+            "summary": response[:200],
+            "auto_fix_issues": [],
+            "critical_issues": []
+        }
@@ -1,16 +1,231 @@
-from github import Github, GithubException
+from github import Auth, Github, GithubException, InputGitTreeElement
 import base64
-import re
 import os
-from typing import Dict, List, Optional, Tuple
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import difflib
 from datetime import datetime
+import time
+import heapq
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import httpx
+import orjson
+from unidiff import PatchSet
+from unidiff.errors import UnidiffParseError
+
+from .llm_cache import LRUDict
+from .rate_limiter import retry_after_from_headers
+from .tools import HTTP2_AVAILABLE, HTTP_LIMITS, HTTP_TIMEOUT
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Upper bound on simultaneous GitHub API requests from one integration
+MAX_PARALLEL_REQUESTS = 8
+# Largest page size the REST API allows
+PER_PAGE = 100
+# Changed files returned by a single compare response
+COMPARE_FILE_LIMIT = 300
+
+# Rate-limited async requests are retried this many times, waiting for
+# Retry-After / X-RateLimit-Reset or backing off exponentially from
+# RATE_LIMIT_BACKOFF seconds; waits longer than MAX_RATE_LIMIT_WAIT are not
+# worth holding a request open for, so the error is returned instead
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF = 1.0
+MAX_RATE_LIMIT_WAIT = 60.0
+# Below this many remaining requests, pace requests over the rest of the window
+LOW_RATE_LIMIT_REMAINING = 100
+
+GITHUB_API_URL = "https://api.github.com"
+DIFF_MEDIA_TYPE = "application/vnd.github.diff"
+DIFF_CHUNK_SIZE = 64 * 1024
+
+# Repeated reads within one analysis are served in-process. Keys include the
+# token so one caller never sees content fetched with another's credentials.
+FILE_CONTENT_CACHE = LRUDict(maxsize=1024, ttl=300)
+REPOSITORY_INFO_CACHE = LRUDict(maxsize=256, ttl=600)
+# PyGithub objects from earlier reads, with what was derived from them. Their
+# update() is a conditional GET (If-None-Match with the stored ETag), and a
+# 304 answer does not count against the primary rate limit.
+CONDITIONAL_CACHE = LRUDict(maxsize=1024)
+
+# One round trip for the PR metadata, files, reviews and comments that the
+# REST path fetches with a request per resource (and per page)
+PR_OVERVIEW_QUERY = """
+query($owner: String!, $name: String!, $number: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      title
+      state
+      author { login }
+      baseRefName
+      headRefName
+      baseRefOid
+      headRefOid
+      files(first: 100) { nodes { path additions deletions changeType } }
+      reviews(first: 100) { nodes { author { login } state body submittedAt } }
+      comments(first: 100) { nodes { author { login } body createdAt } }
+    }
+  }
+}
+"""
+
+# Connections of a pull request that get_pr_details pages through, with the
+# node fields requested for each
+PR_CONNECTIONS = {
+    "files": "path additions deletions changeType",
+    "commits": "commit { oid message url author { name date } }",
+    "reviews": "databaseId author { login } state body submittedAt comments { totalCount }"
+}
+
+PR_DETAILS_FIELDS = """
+      databaseId number title body state url
+      createdAt updatedAt closedAt mergedAt merged
+      mergeCommit { oid }
+      author { login }
+      assignees(first: 100) { nodes { login } }
+      reviewRequests(first: 100) { nodes { requestedReviewer { ... on User { login } } } }
+      labels(first: 100) { nodes { name } }
+      milestone { title }
+      baseRefName headRefName baseRefOid headRefOid
+      mergeable mergeStateStatus
+      comments { totalCount }
+      additions deletions changedFiles
+      %s
+""" % "\n      ".join(
+    f"{name}(first: 100) {{ totalCount pageInfo {{ hasNextPage endCursor }} nodes {{ {fields} }} }}"
+    for name, fields in PR_CONNECTIONS.items()
+)
+
+PR_DETAILS_QUERY = """
+query($owner: String!, $name: String!, $number: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {%s    }
+  }
+}
+""" % PR_DETAILS_FIELDS
+
+# Pull requests fetched per aliased GraphQL query by aget_many_pr_details
+MAX_PRS_PER_QUERY = 50
+
+PR_BATCH_QUERY = """
+query($owner: String!, $name: String!) {
+  repository(owner: $owner, name: $name) {
+%s  }
+}
+"""
+
+PR_CONNECTION_PAGE_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $after: String!) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      %s(first: 100, after: $after) { pageInfo { hasNextPage endCursor } nodes { %s } }
+    }
+  }
+}
+"""
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """GraphQL ISO-8601 timestamps as the datetimes PyGithub returns"""
+    return datetime.fromisoformat(value) if value else None
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """Transport wrapper that keeps the async client within GitHub's rate limits.
+
+    Caps concurrent requests, paces them from the X-RateLimit-* headers once
+    the remaining budget runs low, and retries 403/429 rate-limit responses.
+    All requests wait out a pause, since the limit is shared by the token.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, max_concurrency: int = MAX_PARALLEL_REQUESTS):
+        self._transport = transport
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Monotonic time before which the next request may not start
+        self._not_before = 0.0
+        self._interval = 0.0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            async with self._semaphore:
+                await self._wait_turn()
+                response = await self._transport.handle_async_request(request)
+            delay = self._observe(response, attempt)
+            if delay is None or delay > MAX_RATE_LIMIT_WAIT or attempt == RATE_LIMIT_RETRIES:
+                return response
+            logger.warning(f"GitHub rate limit hit, retrying in {delay:.1f}s")
+            await response.aclose()
+            self._not_before = max(self._not_before, time.monotonic() + delay)
+        return response
+
+    async def _wait_turn(self):
+        now = time.monotonic()
+        start = max(now, self._not_before)
+        self._not_before = start + self._interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def _observe(self, response: httpx.Response, attempt: int) -> Optional[float]:
+        """Update pacing from the response, returning the retry delay if it was rate limited"""
+        headers = response.headers
+        remaining = headers.get("x-ratelimit-remaining")
+        reset = headers.get("x-ratelimit-reset")
+        if remaining is not None and reset is not None:
+            window = max(float(reset) - time.time(), 0.0)
+            remaining = int(remaining)
+            self._interval = window / max(remaining, 1) if remaining < LOW_RATE_LIMIT_REMAINING else 0.0
+
+        # 403 is also used for permission errors; only these headers mark a rate limit
+        rate_limited = response.status_code == 429 or (
+            response.status_code == 403 and ("retry-after" in headers or remaining == 0)
+        )
+        if not rate_limited:
+            return None
+        retry_after = retry_after_from_headers(headers)
+        return retry_after if retry_after is not None else RATE_LIMIT_BACKOFF * 2 ** attempt
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def _api_headers(token: str) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {token}",
+        "Accept": "application/vnd.github+json",
+        # Request bodies are encoded with orjson and sent as content=
+        "Content-Type": "application/json",
+        "X-GitHub-Api-Version": "2022-11-28"
+    }
+
+
+@lru_cache(maxsize=None)
+def _get_http_client(token: str) -> httpx.Client:
+    """Process-wide keep-alive httpx client per token for the sync raw REST calls."""
+    return httpx.Client(
+        base_url=GITHUB_API_URL,
+        headers=_api_headers(token),
+        limits=HTTP_LIMITS,
+        timeout=HTTP_TIMEOUT,
+        http2=HTTP2_AVAILABLE
+    )
+
+
+# Threads for the async wrappers of PyGithub-only methods (acreate_branch, ...)
+_BLOCKING_CALLS = ThreadPoolExecutor(max_workers=MAX_PARALLEL_REQUESTS, thread_name_prefix="github")
+
+
+@lru_cache(maxsize=None)
+def _get_client(token: str) -> Github:
+    """Process-wide PyGithub client per token, so its connection pool stays warm."""
+    # per_page=100 cuts the round trips for paginated reads (PR files, commits, reviews)
+    return Github(auth=Auth.Token(token), per_page=PER_PAGE, pool_size=MAX_PARALLEL_REQUESTS)
+
 
 class GitHubIntegration:
     def __init__(self, token: str = None):
@@ -21,11 +236,30 @@ class GitHubIntegration:
                 raise ValueError("GitHub token not found. Please set GITHUB_TOKEN or GH_TOKEN environment variable, or pass token directly.")
         
         self.token = token
-        self.client = Github(token)
+        self.client = _get_client(token)
+        self._async_client = None
         self.rate_limit_remaining = None
         self.rate_limit_reset = None
         self._update_rate_limit_info()
 
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """Keep-alive client for the async REST/GraphQL methods, created on first use"""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                base_url=GITHUB_API_URL,
+                headers=_api_headers(self.token),
+                timeout=HTTP_TIMEOUT,
+                transport=RateLimitedTransport(httpx.AsyncHTTPTransport(limits=HTTP_LIMITS, http2=HTTP2_AVAILABLE))
+            )
+        return self._async_client
+
+    async def aclose(self):
+        """Close the async client's connections"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
     def _update_rate_limit_info(self):
         """Update rate limit information"""
         try:
@@ -36,16 +270,83 @@ class GitHubIntegration:
         except GithubException as e:
             logger.warning(f"Could not get rate limit info: {e}")
 
+    def _parallel(self, *calls):
+        """Run (func, *args) calls on a thread pool and return their results in order.
+
+        The requests are I/O bound, so threads overlap their round trips.
+        Concurrency is capped because GitHub's secondary rate limits
+        penalise bursts of simultaneous requests.
+        """
+        if not calls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(calls), MAX_PARALLEL_REQUESTS)) as executor:
+            futures = [executor.submit(*call) for call in calls]
+            return [future.result() for future in futures]
+
+    async def _in_thread(self, func, *args):
+        """Run a blocking PyGithub call without stalling the event loop.
+
+        The shared pool is capped like _parallel, so gathering many of these
+        stays within GitHub's secondary rate limits.
+        """
+        return await asyncio.get_running_loop().run_in_executor(_BLOCKING_CALLS, func, *args)
+
+    @staticmethod
+    def _compare_files(repo, base_sha: str, head_sha: str) -> List:
+        """Files changed between two commits, with patches, from a single compare request"""
+        return repo.compare(base_sha, head_sha).files
+
+    def _repo(self, repo_name: str):
+        """Repository handle for building API calls on.
+
+        Lazy, so it costs no GET /repos/{owner}/{repo}; the few callers that
+        read repository attributes load them on first access.
+        """
+        return self.client.get_repo(repo_name, lazy=True)
+
+    @staticmethod
+    def _page_calls(paginated, total_count: int) -> List[Tuple]:
+        """_parallel calls fetching every page of a PaginatedList whose length is known"""
+        return [(paginated.get_page, page) for page in range(-(-total_count // PER_PAGE))]
+
     def get_pr_details(self, repo_name: str, pr_id: int) -> Optional[Dict]:
-        """Get comprehensive PR details including files, commits, and metadata"""
+        """Get comprehensive PR details including files, commits, and metadata.
+
+        Callers that only need the diff text should use get_pr_diff (or
+        astream_pr_diff), which is a single request with no pagination.
+        """
         try:
             print(f"GitHub API Rate Limit: {self.rate_limit_remaining}/{self.rate_limit_reset}")
-            repo = self.client.get_repo(repo_name)
-            pr = repo.get_pull(pr_id)
+            key = ("pull", self.token, repo_name, pr_id)
+            cached = CONDITIONAL_CACHE.get(key)
+            if cached is not None:
+                pr, pr_details = cached
+                # New commits, reviews and comments all bump the PR's ETag
+                if not pr.update():
+                    return pr_details
+            else:
+                pr = self._repo(repo_name).get_pull(pr_id)
+
+            # The PR reports how many files and commits it has, so all of their
+            # pages are fetched at once; reviews page serially alongside them.
+            # Up to COMPARE_FILE_LIMIT files come back from one compare request.
+            compared = 0 < pr.changed_files <= COMPARE_FILE_LIMIT
+            if compared:
+                file_calls = [(self._compare_files, self._repo(repo_name), pr.base.sha, pr.head.sha)]
+            else:
+                file_calls = self._page_calls(pr.get_files(), pr.changed_files)
+            commit_calls = self._page_calls(pr.get_commits(), pr.commits)
+            pr_reviews, *pages = self._parallel((list, pr.get_reviews()), *file_calls, *commit_calls)
+            pr_files = [file for page in pages[:len(file_calls)] for file in page]
+            pr_commits = [commit for page in pages[len(file_calls):] for commit in page]
+            if compared and len(pr_files) != pr.changed_files:
+                # The compare disagrees with the PR (e.g. the base was rewritten), so read the PR's own list
+                pr_files = [file for page in self._parallel(*self._page_calls(pr.get_files(), pr.changed_files))
+                            for file in page]
             
             # Get PR files
             files = []
-            for file in pr.get_files():
+            for file in pr_files:
                 file_info = {
                     'filename': file.filename,
                     'status': file.status,  # added, modified, removed, renamed
@@ -61,7 +362,7 @@ class GitHubIntegration:
             
             # Get commits
             commits = []
-            for commit in pr.get_commits():
+            for commit in pr_commits:
                 commit_info = {
                     'sha': commit.sha,
                     'message': commit.commit.message,
@@ -73,7 +374,7 @@ class GitHubIntegration:
             
             # Get reviews
             reviews = []
-            for review in pr.get_reviews():
+            for review in pr_reviews:
                 review_info = {
                     'id': review.id,
                     'user': review.user.login,
@@ -120,19 +421,237 @@ class GitHubIntegration:
                 'patch_url': pr.patch_url
             }
             
+            CONDITIONAL_CACHE[key] = (pr, pr_details)
             return pr_details
             
         except GithubException as e:
             logger.error(f"Error getting PR details: {e}")
             return None
 
+    async def _graphql(self, query: str, variables: Dict, partial: bool = False) -> Dict:
+        """POST a GraphQL query, returning its data or raising httpx.HTTPError / ValueError
+
+        With ``partial``, errors are tolerated as long as some data came back
+        (e.g. one missing PR in a batch leaves only its alias null).
+        """
+        response = await self.async_client.post(
+            "/graphql", content=orjson.dumps({"query": query, "variables": variables})
+        )
+        response.raise_for_status()
+        payload = orjson.loads(response.content)
+        if payload.get("errors") and not (partial and payload.get("data")):
+            raise ValueError(payload["errors"])
+        return payload["data"]
+
+    async def _apaginate(self, variables: Dict, connection: str, page: Dict) -> List[Dict]:
+        """All nodes of a pull request connection, following cursors from its first page"""
+        nodes = list(page["nodes"])
+        # Each page's cursor comes from the previous one, so pages of one
+        # connection are sequential; different connections run concurrently
+        while page["pageInfo"]["hasNextPage"]:
+            data = await self._graphql(
+                PR_CONNECTION_PAGE_QUERY % (connection, PR_CONNECTIONS[connection]),
+                {**variables, "after": page["pageInfo"]["endCursor"]}
+            )
+            page = data["repository"]["pullRequest"][connection]
+            nodes.extend(page["nodes"])
+        return nodes
+
+    async def aget_pr_details(self, repo_name: str, pr_id: int) -> Optional[Dict]:
+        """Async get_pr_details: one GraphQL query plus a query per extra page of files/commits/reviews"""
+        owner, name = repo_name.split("/", 1)
+        variables = {"owner": owner, "name": name, "number": pr_id}
+        try:
+            pr = (await self._graphql(PR_DETAILS_QUERY, variables))["repository"]["pullRequest"]
+            return await self._pr_details(repo_name, variables, pr)
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Error getting PR details: {e}")
+            return None
+
+    async def aget_many_pr_details(self, repo_name: str, pr_ids: List[int]) -> List[Optional[Dict]]:
+        """aget_pr_details for many PRs, MAX_PRS_PER_QUERY per aliased GraphQL query
+
+        Results follow the order of pr_ids; PRs that could not be read are None.
+        """
+        owner, name = repo_name.split("/", 1)
+
+        async def fetch_chunk(chunk):
+            query = PR_BATCH_QUERY % "".join(
+                f"    pr{i}: pullRequest(number: {int(pr_id)}) {{{PR_DETAILS_FIELDS}    }}\n"
+                for i, pr_id in enumerate(chunk)
+            )
+            try:
+                data = await self._graphql(query, {"owner": owner, "name": name}, partial=True)
+            except (httpx.HTTPError, ValueError) as e:
+                logger.error(f"Error getting PR details: {e}")
+                return [None] * len(chunk)
+            # A partial response can null out the whole repository, not just one PR
+            repository = data.get("repository") or {}
+            return await asyncio.gather(*(
+                self._pr_details(repo_name, {"owner": owner, "name": name, "number": int(pr_id)}, repository.get(f"pr{i}"))
+                for i, pr_id in enumerate(chunk)
+            ))
+
+        chunks = await asyncio.gather(*(
+            fetch_chunk(pr_ids[start:start + MAX_PRS_PER_QUERY])
+            for start in range(0, len(pr_ids), MAX_PRS_PER_QUERY)
+        ))
+        return [details for chunk in chunks for details in chunk]
+
+    async def _pr_details(self, repo_name: str, variables: Dict, pr: Optional[Dict]) -> Optional[Dict]:
+        """get_pr_details-shaped dict for a GraphQL pull request, fetching any further connection pages"""
+        if pr is None:
+            return None
+        try:
+            files, commits, reviews = await asyncio.gather(*(
+                self._apaginate(variables, connection, pr[connection]) for connection in PR_CONNECTIONS
+            ))
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Error getting PR details: {e}")
+            return None
+
+        head_sha = pr['headRefOid']
+        return {
+            'id': pr['databaseId'],
+            'number': pr['number'],
+            'title': pr['title'],
+            'body': pr['body'],
+            'state': 'open' if pr['state'] == 'OPEN' else 'closed',
+            'created_at': _parse_timestamp(pr['createdAt']),
+            'updated_at': _parse_timestamp(pr['updatedAt']),
+            'closed_at': _parse_timestamp(pr['closedAt']),
+            'merged_at': _parse_timestamp(pr['mergedAt']),
+            'merge_commit_sha': (pr['mergeCommit'] or {}).get('oid'),
+            'author': (pr['author'] or {}).get('login'),
+            'assignees': [a['login'] for a in pr['assignees']['nodes']],
+            # Team review requests have no login
+            'reviewers': [
+                r['requestedReviewer']['login']
+                for r in pr['reviewRequests']['nodes'] if (r['requestedReviewer'] or {}).get('login')
+            ],
+            'labels': [label['name'] for label in pr['labels']['nodes']],
+            'milestone': (pr['milestone'] or {}).get('title'),
+            'base_branch': pr['baseRefName'],
+            'head_branch': pr['headRefName'],
+            'base_sha': pr['baseRefOid'],
+            'head_sha': head_sha,
+            'mergeable': {'MERGEABLE': True, 'CONFLICTING': False}.get(pr['mergeable']),
+            'mergeable_state': pr['mergeStateStatus'].lower(),
+            'merged': pr['merged'],
+            'comments': pr['comments']['totalCount'],
+            'review_comments': sum(r['comments']['totalCount'] for r in reviews),
+            'commits': pr['commits']['totalCount'],
+            'additions': pr['additions'],
+            'deletions': pr['deletions'],
+            'changed_files': pr['changedFiles'],
+            'files': [
+                {
+                    'filename': f['path'],
+                    'status': 'removed' if f['changeType'] == 'DELETED' else f['changeType'].lower(),
+                    'additions': f['additions'],
+                    'deletions': f['deletions'],
+                    'changes': f['additions'] + f['deletions'],
+                    # GraphQL does not expose per-file patches
+                    'patch': None,
+                    'blob_url': f"https://github.com/{repo_name}/blob/{head_sha}/{f['path']}",
+                    'raw_url': f"https://github.com/{repo_name}/raw/{head_sha}/{f['path']}",
+                    'contents_url': f"{GITHUB_API_URL}/repos/{repo_name}/contents/{f['path']}?ref={head_sha}"
+                }
+                for f in files
+            ],
+            'commits_data': [
+                {
+                    'sha': c['commit']['oid'],
+                    'message': c['commit']['message'],
+                    'author': c['commit']['author']['name'],
+                    'date': _parse_timestamp(c['commit']['author']['date']),
+                    'url': c['commit']['url']
+                }
+                for c in commits
+            ],
+            'reviews': [
+                {
+                    'id': r['databaseId'],
+                    'user': (r['author'] or {}).get('login'),
+                    'state': r['state'],
+                    'body': r['body'],
+                    'submitted_at': _parse_timestamp(r['submittedAt'])
+                }
+                for r in reviews
+            ],
+            'html_url': pr['url'],
+            'diff_url': f"{pr['url']}.diff",
+            'patch_url': f"{pr['url']}.patch"
+        }
+
+    async def aget_pr_overview(self, repo_name: str, pr_id: int) -> Optional[Dict]:
+        """Get PR metadata, files, reviews and comments with a single GraphQL query"""
+        owner, name = repo_name.split("/", 1)
+        try:
+            data = await self._graphql(PR_OVERVIEW_QUERY, {"owner": owner, "name": name, "number": pr_id})
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Error getting PR overview: {e}")
+            return None
+
+        pr = data["repository"]["pullRequest"]
+        return {
+            'number': pr_id,
+            'title': pr['title'],
+            'state': pr['state'].lower(),
+            'author': (pr['author'] or {}).get('login'),
+            'base_branch': pr['baseRefName'],
+            'head_branch': pr['headRefName'],
+            'base_sha': pr['baseRefOid'],
+            'head_sha': pr['headRefOid'],
+            'files': [
+                {
+                    'filename': f['path'],
+                    'status': 'removed' if f['changeType'] == 'DELETED' else f['changeType'].lower(),
+                    'additions': f['additions'],
+                    'deletions': f['deletions'],
+                    'changes': f['additions'] + f['deletions']
+                }
+                for f in pr['files']['nodes']
+            ],
+            'reviews': [
+                {
+                    'user': (r['author'] or {}).get('login'),
+                    'state': r['state'],
+                    'body': r['body'],
+                    'submitted_at': r['submittedAt']
+                }
+                for r in pr['reviews']['nodes']
+            ],
+            'comments': [
+                {
+                    'author': (c['author'] or {}).get('login'),
+                    'body': c['body'],
+                    'created_at': c['createdAt']
+                }
+                for c in pr['comments']['nodes']
+            ]
+        }
+
     def get_file_content(self, repo_name: str, file_path: str, ref: str = None) -> Optional[str]:
         """Get file content from repository with proper 404 handling"""
+        key = (self.token, repo_name, file_path, ref)
+        cached = FILE_CONTENT_CACHE.get(key)
+        if cached is not None:
+            return cached
         try:
-            repo = self.client.get_repo(repo_name)
+            file = CONDITIONAL_CACHE.get(("file",) + key)
+            if file is None:
+                repo = self._repo(repo_name)
             try:
-                file = repo.get_contents(file_path, ref=ref)
-                return file.decoded_content.decode('utf-8')
+                if file is not None:
+                    # Refreshes the file in place unless GitHub answers 304
+                    file.update()
+                else:
+                    file = repo.get_contents(file_path, ref=ref)
+                    CONDITIONAL_CACHE[("file",) + key] = file
+                content = file.decoded_content.decode('utf-8')
+                FILE_CONTENT_CACHE[key] = content
+                return content
             except GithubException as e:
                 if e.status == 404:
                     logger.warning(f"File not found: {file_path}@{ref if ref else 'default'}")
@@ -147,10 +666,15 @@ class GitHubIntegration:
             logger.error(f"Unexpected error getting file content: {e}")
             return None
 
+    def get_file_contents(self, repo_name: str, file_paths: List[str], ref: str = None) -> Dict[str, Optional[str]]:
+        """Get several files' contents concurrently, mapping each path to its content or None"""
+        contents = self._parallel(*((self.get_file_content, repo_name, path, ref) for path in file_paths))
+        return dict(zip(file_paths, contents))
+
     def get_file_history(self, repo_name: str, file_path: str, limit: int = 10) -> List[Dict]:
         """Get commit history for a specific file"""
         try:
-            repo = self.client.get_repo(repo_name)
+            repo = self._repo(repo_name)
             commits = repo.get_commits(path=file_path)
             
             history = []
@@ -175,16 +699,30 @@ class GitHubIntegration:
 
     def analyze_pr_changes(self, repo_name: str, pr_id: int) -> Dict:
         """Analyze PR changes and provide insights"""
-        pr_details = self.get_pr_details(repo_name, pr_id)
-        if not pr_details:
+        # Only the PR totals and per-file stats are needed, so skip the commit,
+        # review and patch data get_pr_details pages through
+        try:
+            pr = self._repo(repo_name).get_pull(pr_id)
+            files = [
+                {
+                    'filename': file.filename,
+                    'status': file.status,
+                    'additions': file.additions,
+                    'deletions': file.deletions,
+                    'changes': file.changes
+                }
+                for file in pr.get_files()
+            ]
+        except GithubException as e:
+            logger.error(f"Error getting PR changes: {e}")
             return {}
         
         analysis = {
             'summary': {
-                'total_files': pr_details['changed_files'],
-                'total_additions': pr_details['additions'],
-                'total_deletions': pr_details['deletions'],
-                'total_commits': pr_details['commits']
+                'total_files': pr.changed_files,
+                'total_additions': pr.additions,
+                'total_deletions': pr.deletions,
+                'total_commits': pr.commits
             },
             'files_by_type': {},
             'large_files': [],
@@ -193,35 +731,40 @@ class GitHubIntegration:
         }
         
         # Analyze files
-        for file_info in pr_details['files']:
-            # Group by file extension
-            ext = file_info['filename'].split('.')[-1] if '.' in file_info['filename'] else 'no_extension'
-            if ext not in analysis['files_by_type']:
-                analysis['files_by_type'][ext] = {'count': 0, 'additions': 0, 'deletions': 0}
-            
-            analysis['files_by_type'][ext]['count'] += 1
-            analysis['files_by_type'][ext]['additions'] += file_info['additions']
-            analysis['files_by_type'][ext]['deletions'] += file_info['deletions']
+        files_by_type = analysis['files_by_type']
+        large_files = analysis['large_files']
+        potential_issues = analysis['potential_issues']
+        for file_info in files:
+            filename = file_info['filename']
+            changes = file_info['changes']
+
+            # Group by file extension; dots in directory names are not one
+            _, dot, ext = filename.rpartition('/')[2].rpartition('.')
+            if not dot:
+                ext = 'no_extension'
+            stats = files_by_type.get(ext)
+            if stats is None:
+                stats = files_by_type[ext] = {'count': 0, 'additions': 0, 'deletions': 0}
+            stats['count'] += 1
+            stats['additions'] += file_info['additions']
+            stats['deletions'] += file_info['deletions']
             
             # Identify large files (>500 lines changed)
-            if file_info['changes'] > 500:
-                analysis['large_files'].append({
-                    'filename': file_info['filename'],
-                    'changes': file_info['changes']
-                })
+            if changes > 500:
+                large_files.append({'filename': filename, 'changes': changes})
             
             # Check for potential issues
             if file_info['status'] == 'removed':
-                analysis['potential_issues'].append(f"File deleted: {file_info['filename']}")
+                potential_issues.append(f"File deleted: {filename}")
             
-            if file_info['filename'].endswith('.py') and file_info['changes'] > 200:
-                analysis['potential_issues'].append(f"Large Python file change: {file_info['filename']}")
+            if changes > 200 and filename.endswith('.py'):
+                potential_issues.append(f"Large Python file change: {filename}")
         
         # Calculate complexity score
         complexity_score = 0
-        complexity_score += pr_details['changed_files'] * 2
-        complexity_score += pr_details['additions'] * 0.1
-        complexity_score += pr_details['deletions'] * 0.1
+        complexity_score += pr.changed_files * 2
+        complexity_score += pr.additions * 0.1
+        complexity_score += pr.deletions * 0.1
         complexity_score += len(analysis['large_files']) * 10
         
         analysis['complexity_score'] = round(complexity_score, 2)
@@ -231,13 +774,10 @@ class GitHubIntegration:
     def get_pr_diff(self, repo_name: str, pr_id: int) -> Optional[str]:
         """Get full diff for PR"""
         try:
-            repo = self.client.get_repo(repo_name)
-            pr = repo.get_pull(pr_id)
-            
-            # Get diff via API
-            diff_url = pr.diff_url
-            import requests
-            response = requests.get(diff_url, headers={'Authorization': f'token {self.token}'})
+            # The pulls endpoint serves the diff itself, so no PR lookup or redirect first
+            response = _get_http_client(self.token).get(
+                f"/repos/{repo_name}/pulls/{pr_id}", headers={'Accept': DIFF_MEDIA_TYPE}
+            )
             
             if response.status_code == 200:
                 return response.text
@@ -249,10 +789,28 @@ class GitHubIntegration:
             logger.error(f"Error getting PR diff: {e}")
             return None
 
+    async def astream_pr_diff(self, repo_name: str, pr_id: int) -> AsyncIterator[bytes]:
+        """Yield the PR diff in chunks as it downloads instead of buffering all of it"""
+        async with self.async_client.stream(
+            "GET", f"/repos/{repo_name}/pulls/{pr_id}", headers={"Accept": DIFF_MEDIA_TYPE}
+        ) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(DIFF_CHUNK_SIZE):
+                yield chunk
+
+    async def aget_pr_diff(self, repo_name: str, pr_id: int) -> Optional[str]:
+        """Async get_pr_diff, collected from astream_pr_diff"""
+        try:
+            chunks = [chunk async for chunk in self.astream_pr_diff(repo_name, pr_id)]
+        except httpx.HTTPError as e:
+            logger.error(f"Error getting PR diff: {e}")
+            return None
+        return b"".join(chunks).decode('utf-8', errors='replace')
+
     def post_comment(self, repo_name: str, pr_id: int, comment: str) -> bool:
         """Post a review comment to a GitHub Pull Request"""
         try:
-            repo = self.client.get_repo(repo_name)
+            repo = self._repo(repo_name)
             pr = repo.get_pull(pr_id)
             pr.create_issue_comment(comment)
             logger.info(f"Posted comment to PR #{pr_id}")
@@ -261,10 +819,23 @@ class GitHubIntegration:
             logger.error(f"Error posting comment: {e}")
             return False
 
+    async def apost_comment(self, repo_name: str, pr_id: int, comment: str) -> bool:
+        """Async post_comment over the shared keep-alive connection"""
+        try:
+            response = await self.async_client.post(
+                f"/repos/{repo_name}/issues/{pr_id}/comments", content=orjson.dumps({"body": comment})
+            )
+            response.raise_for_status()
+            logger.info(f"Posted comment to PR #{pr_id}")
+            return True
+        except httpx.HTTPError as e:
+            logger.error(f"Error posting comment: {e}")
+            return False
+
     def post_line_comment(self, repo_name: str, pr_id: int, filename: str, line: int, comment: str) -> bool:
         """Post a comment on a specific line in a PR"""
         try:
-            repo = self.client.get_repo(repo_name)
+            repo = self._repo(repo_name)
             pr = repo.get_pull(pr_id)
             
             # Create a review comment on specific line
@@ -280,10 +851,14 @@ class GitHubIntegration:
             logger.error(f"Error posting line comment: {e}")
             return False
 
+    async def apost_line_comment(self, repo_name: str, pr_id: int, filename: str, line: int, comment: str) -> bool:
+        """Async post_line_comment, run on the blocking-call thread pool"""
+        return await self._in_thread(self.post_line_comment, repo_name, pr_id, filename, line, comment)
+
     def create_branch(self, repo_name: str, base: str, branch: str) -> bool:
         """Create a new branch from base"""
         try:
-            repo = self.client.get_repo(repo_name)
+            repo = self._repo(repo_name)
             source = repo.get_branch(base)
             repo.create_git_ref(ref=f"refs/heads/{branch}", sha=source.commit.sha)
             logger.info(f"Created branch {branch} from {base}")
@@ -292,61 +867,206 @@ class GitHubIntegration:
             logger.error(f"Error creating branch: {e}")
             return False
 
+    async def acreate_branch(self, repo_name: str, base: str, branch: str) -> bool:
+        """Async create_branch, run on the blocking-call thread pool"""
+        return await self._in_thread(self.create_branch, repo_name, base, branch)
+
     def commit_patches(self, repo_name: str, branch: str, patches: List[Dict]) -> bool:
-        """Commit patches to the branch"""
+        """Commit patches to the branch as a single commit via the Git Data API"""
         try:
-            repo = self.client.get_repo(repo_name)
-            
-            for patch in patches:
+            repo = self._repo(repo_name)
+            ref = repo.get_git_ref(f"heads/{branch}")
+            base_commit = repo.get_git_commit(ref.object.sha)
+            # Keep executable bits etc. of files that already exist
+            modes = self._existing_modes(repo, base_commit.tree.sha, [patch["file"] for patch in patches])
+
+            # Read every file up front, concurrently
+            contents = self._parallel(*((self._patched_content, repo, branch, patch) for patch in patches))
+
+            elements = []
+            for patch, content in zip(patches, contents):
                 file_path = patch["file"]
-                patch_content = patch.get("patch", "")
-                message = patch.get("fix_description", f"Apply patch to {file_path}")
-                
-                try:
-                    # Get current file content
-                    file = repo.get_contents(file_path, ref=branch)
-                    current_content = file.decoded_content.decode('utf-8')
-                    
-                    # Apply patch
-                    if patch_content:
-                        updated_content = self._apply_patch(current_content, patch_content)
-                    else:
-                        updated_content = patch.get("content", current_content)
-                    
-                    # Update file
-                    repo.update_file(
-                        path=file_path,
-                        message=message,
-                        content=updated_content,
-                        sha=file.sha,
-                        branch=branch
-                    )
-                    logger.info(f"Applied patch to {file_path}")
-                    
-                except GithubException as e:
-                    if e.status == 404:
-                        # File doesn't exist, create it
-                        repo.create_file(
-                            path=file_path,
-                            message=message,
-                            content=patch.get("content", ""),
-                            branch=branch
-                        )
-                        logger.info(f"Created new file {file_path}")
-                    else:
-                        logger.error(f"Error updating {file_path}: {e}")
-                        return False
-            
+                if content is None:
+                    return False
+                # Blob content is sent inline with the tree, so no per-file blob requests
+                elements.append(InputGitTreeElement(
+                    path=file_path,
+                    mode=modes.get(file_path, "100644"),
+                    type="blob",
+                    content=content
+                ))
+
+            if not elements:
+                return True
+
+            tree = repo.create_git_tree(elements, base_tree=base_commit.tree)
+            commit = repo.create_git_commit(self._patch_commit_message(patches), tree, [base_commit])
+            ref.edit(commit.sha)
+            self._cache_committed(repo_name, branch, patches, contents)
+            logger.info(f"Committed {len(elements)} patched files to {branch} in {commit.sha[:7]}")
             return True
-            
+
         except GithubException as e:
             logger.error(f"Error committing patches: {e}")
             return False
 
+    async def acommit_patches(self, repo_name: str, branch: str, patches: List[Dict]) -> bool:
+        """Async commit_patches: concurrent reads, then one tree, one commit and one ref update"""
+        if not patches:
+            return True
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_REQUESTS)
+        client = self.async_client
+
+        async def read(patch):
+            async with semaphore:
+                response = await client.get(
+                    f"/repos/{repo_name}/contents/{patch['file']}",
+                    params={"ref": branch},
+                    headers={"Accept": "application/vnd.github.raw+json"}
+                )
+            if response.status_code == 404:
+                # File doesn't exist, create it
+                return patch.get("content", "")
+            response.raise_for_status()
+            return self._new_content(patch, response.text)
+
+        try:
+            response = await client.get(f"/repos/{repo_name}/git/ref/heads/{branch}")
+            response.raise_for_status()
+            base_sha = orjson.loads(response.content)["object"]["sha"]
+            response = await client.get(f"/repos/{repo_name}/git/commits/{base_sha}")
+            response.raise_for_status()
+            base_tree = orjson.loads(response.content)["tree"]["sha"]
+
+            # Keep executable bits etc. of files that already exist
+            modes, *contents = await asyncio.gather(
+                self._aexisting_modes(repo_name, base_tree, [patch["file"] for patch in patches]),
+                *(read(patch) for patch in patches)
+            )
+
+            response = await client.post(f"/repos/{repo_name}/git/trees", content=orjson.dumps({
+                "base_tree": base_tree,
+                "tree": [
+                    {"path": patch["file"], "mode": modes.get(patch["file"], "100644"), "type": "blob",
+                     "content": content}
+                    for patch, content in zip(patches, contents)
+                ]
+            }))
+            response.raise_for_status()
+            response = await client.post(f"/repos/{repo_name}/git/commits", content=orjson.dumps({
+                "message": self._patch_commit_message(patches),
+                "tree": orjson.loads(response.content)["sha"],
+                "parents": [base_sha]
+            }))
+            response.raise_for_status()
+            commit_sha = orjson.loads(response.content)["sha"]
+            response = await client.patch(
+                f"/repos/{repo_name}/git/refs/heads/{branch}", content=orjson.dumps({"sha": commit_sha})
+            )
+            response.raise_for_status()
+            self._cache_committed(repo_name, branch, patches, contents)
+            logger.info(f"Committed {len(patches)} patched files to {branch} in {commit_sha[:7]}")
+            return True
+
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Error committing patches: {e}")
+            return False
+
+    @staticmethod
+    def _existing_modes(repo, tree_sha: str, paths: List[str]) -> Dict[str, str]:
+        """Git modes of the paths that already exist, listing only the directories leading to them
+
+        A recursive listing of a large repository is truncated, and a file
+        missing from it would lose its mode; single directories are not.
+        """
+        listings = {}
+
+        def listing(directory):
+            if directory not in listings:
+                sha = tree_sha
+                if directory:
+                    parent, _, name = directory.rpartition("/")
+                    entry = listing(parent).get(name)
+                    sha = entry.sha if entry is not None and entry.type == "tree" else None
+                listings[directory] = {e.path: e for e in repo.get_git_tree(sha).tree} if sha else {}
+            return listings[directory]
+
+        modes = {}
+        for path in paths:
+            directory, _, name = path.rpartition("/")
+            entry = listing(directory).get(name)
+            if entry is not None:
+                modes[path] = entry.mode
+        return modes
+
+    async def _aexisting_modes(self, repo_name: str, tree_sha: str, paths: List[str]) -> Dict[str, str]:
+        """Async _existing_modes over the REST tree endpoint"""
+        listings = {}
+
+        async def listing(directory):
+            if directory not in listings:
+                sha = tree_sha
+                if directory:
+                    parent, _, name = directory.rpartition("/")
+                    entry = (await listing(parent)).get(name)
+                    sha = entry["sha"] if entry is not None and entry["type"] == "tree" else None
+                entries = {}
+                if sha:
+                    response = await self.async_client.get(f"/repos/{repo_name}/git/trees/{sha}")
+                    response.raise_for_status()
+                    entries = {e["path"]: e for e in orjson.loads(response.content)["tree"]}
+                listings[directory] = entries
+            return listings[directory]
+
+        modes = {}
+        for path in paths:
+            directory, _, name = path.rpartition("/")
+            entry = (await listing(directory)).get(name)
+            if entry is not None:
+                modes[path] = entry["mode"]
+        return modes
+
+    def _cache_committed(self, repo_name: str, branch: str, patches: List[Dict], contents: List[str]):
+        """Write committed contents through to the file cache so branch reads aren't stale"""
+        for patch, content in zip(patches, contents):
+            FILE_CONTENT_CACHE[(self.token, repo_name, patch["file"], branch)] = content
+
+    def _patched_content(self, repo, branch: str, patch: Dict) -> Optional[str]:
+        """New content for a patched file, or None if the current file could not be read"""
+        file_path = patch["file"]
+        try:
+            file = repo.get_contents(file_path, ref=branch)
+            current_content = file.decoded_content.decode('utf-8')
+        except GithubException as e:
+            if e.status == 404:
+                # File doesn't exist, create it
+                return patch.get("content", "")
+            logger.error(f"Error updating {file_path}: {e}")
+            return None
+
+        try:
+            return self._new_content(patch, current_content)
+        except ValueError as e:
+            logger.error(f"Error applying patch to {file_path}: {e}")
+            return None
+
+    def _new_content(self, patch: Dict, current_content: str) -> str:
+        patch_content = patch.get("patch", "")
+        if patch_content:
+            return self._apply_patch(current_content, patch_content)
+        return patch.get("content", current_content)
+
+    @staticmethod
+    def _patch_commit_message(patches: List[Dict]) -> str:
+        descriptions = [p.get("fix_description", f"Apply patch to {p['file']}") for p in patches]
+        if len(descriptions) == 1:
+            return descriptions[0]
+        return f"Apply {len(descriptions)} patches\n\n" + "\n".join(f"- {d}" for d in descriptions)
+
     def create_pr(self, repo_name: str, base: str, branch: str, title: str, body: str) -> Optional[int]:
         """Create a Pull Request with the patch branch"""
         try:
-            repo = self.client.get_repo(repo_name)
+            repo = self._repo(repo_name)
             pr = repo.create_pull(title=title, body=body, base=base, head=branch)
             logger.info(f"Created PR #{pr.number}: {title}")
             return pr.number
@@ -354,10 +1074,14 @@ class GitHubIntegration:
             logger.error(f"Error creating PR: {e}")
             return None
 
+    async def acreate_pr(self, repo_name: str, base: str, branch: str, title: str, body: str) -> Optional[int]:
+        """Async create_pr, run on the blocking-call thread pool"""
+        return await self._in_thread(self.create_pr, repo_name, base, branch, title, body)
+
     def block_merge(self, repo_name: str, pr_id: int, reason: str) -> bool:
         """Post a blocking review on PR"""
         try:
-            repo = self.client.get_repo(repo_name)
+            repo = self._repo(repo_name)
             pr = repo.get_pull(pr_id)
             pr.create_review(
                 body=reason,
@@ -369,10 +1093,24 @@ class GitHubIntegration:
             logger.error(f"Error blocking merge: {e}")
             return False
 
+    async def ablock_merge(self, repo_name: str, pr_id: int, reason: str) -> bool:
+        """Async block_merge over the shared keep-alive connection"""
+        try:
+            response = await self.async_client.post(
+                f"/repos/{repo_name}/pulls/{pr_id}/reviews",
+                content=orjson.dumps({"body": reason, "event": "REQUEST_CHANGES"})
+            )
+            response.raise_for_status()
+            logger.info(f"Blocked merge for PR #{pr_id}")
+            return True
+        except httpx.HTTPError as e:
+            logger.error(f"Error blocking merge: {e}")
+            return False
+
     def approve_pr(self, repo_name: str, pr_id: int, comment: str = "") -> bool:
         """Approve a PR"""
         try:
-            repo = self.client.get_repo(repo_name)
+            repo = self._repo(repo_name)
             pr = repo.get_pull(pr_id)
             pr.create_review(
                 body=comment,
@@ -384,10 +1122,14 @@ class GitHubIntegration:
             logger.error(f"Error approving PR: {e}")
             return False
 
+    async def aapprove_pr(self, repo_name: str, pr_id: int, comment: str = "") -> bool:
+        """Async approve_pr, run on the blocking-call thread pool"""
+        return await self._in_thread(self.approve_pr, repo_name, pr_id, comment)
+
     def merge_pr(self, repo_name: str, pr_id: int, merge_method: str = "merge") -> bool:
         """Merge a PR"""
         try:
-            repo = self.client.get_repo(repo_name)
+            repo = self._repo(repo_name)
             pr = repo.get_pull(pr_id)
             
             if merge_method == "squash":
@@ -403,10 +1145,14 @@ class GitHubIntegration:
             logger.error(f"Error merging PR: {e}")
             return False
 
+    async def amerge_pr(self, repo_name: str, pr_id: int, merge_method: str = "merge") -> bool:
+        """Async merge_pr, run on the blocking-call thread pool"""
+        return await self._in_thread(self.merge_pr, repo_name, pr_id, merge_method)
+
     def close_pr(self, repo_name: str, pr_id: int) -> bool:
         """Close a PR without merging"""
         try:
-            repo = self.client.get_repo(repo_name)
+            repo = self._repo(repo_name)
             pr = repo.get_pull(pr_id)
             pr.edit(state="closed")
             logger.info(f"Closed PR #{pr_id}")
@@ -415,16 +1161,26 @@ class GitHubIntegration:
             logger.error(f"Error closing PR: {e}")
             return False
 
+    async def aclose_pr(self, repo_name: str, pr_id: int) -> bool:
+        """Async close_pr, run on the blocking-call thread pool"""
+        return await self._in_thread(self.close_pr, repo_name, pr_id)
+
     def get_pr_comments(self, repo_name: str, pr_id: int) -> List[Dict]:
         """Get all comments on a PR"""
         try:
-            repo = self.client.get_repo(repo_name)
+            repo = self._repo(repo_name)
             pr = repo.get_pull(pr_id)
+
+            # Both kinds of comment are counted on the PR, so every page of both
+            # lists is fetched at once
+            issue_calls = self._page_calls(pr.get_issue_comments(), pr.comments)
+            review_calls = self._page_calls(pr.get_review_comments(), pr.review_comments)
+            pages = self._parallel(*issue_calls, *review_calls)
             
-            comments = []
+            issue_comments = []
             
             # Get issue comments
-            for comment in pr.get_issue_comments():
+            for comment in (c for page in pages[:len(issue_calls)] for c in page):
                 comment_data = {
                     'id': comment.id,
                     'type': 'issue_comment',
@@ -433,10 +1189,12 @@ class GitHubIntegration:
                     'created_at': comment.created_at,
                     'updated_at': comment.updated_at
                 }
-                comments.append(comment_data)
+                issue_comments.append(comment_data)
+            
+            review_comments = []
             
             # Get review comments
-            for comment in pr.get_review_comments():
+            for comment in (c for page in pages[len(issue_calls):] for c in page):
                 comment_data = {
                     'id': comment.id,
                     'type': 'review_comment',
@@ -447,9 +1205,10 @@ class GitHubIntegration:
                     'created_at': comment.created_at,
                     'updated_at': comment.updated_at
                 }
-                comments.append(comment_data)
+                review_comments.append(comment_data)
             
-            return sorted(comments, key=lambda x: x['created_at'])
+            # GitHub lists both oldest first, so a merge keeps them in order
+            return list(heapq.merge(issue_comments, review_comments, key=lambda x: x['created_at']))
             
         except GithubException as e:
             logger.error(f"Error getting PR comments: {e}")
@@ -484,8 +1243,19 @@ class GitHubIntegration:
 
     def get_repository_info(self, repo_name: str) -> Optional[Dict]:
         """Get comprehensive repository information"""
+        key = (self.token, repo_name)
+        cached = REPOSITORY_INFO_CACHE.get(key)
+        if cached is not None:
+            return cached
         try:
-            repo = self.client.get_repo(repo_name)
+            cached = CONDITIONAL_CACHE.get(("repo",) + key)
+            if cached is not None:
+                repo, repo_info = cached
+                if not repo.update():
+                    REPOSITORY_INFO_CACHE[key] = repo_info
+                    return repo_info
+            else:
+                repo = self._repo(repo_name)
             
             repo_info = {
                 'name': repo.name,
@@ -511,6 +1281,8 @@ class GitHubIntegration:
                 'html_url': repo.html_url
             }
             
+            REPOSITORY_INFO_CACHE[key] = repo_info
+            CONDITIONAL_CACHE[("repo",) + key] = (repo, repo_info)
             return repo_info
             
         except GithubException as e:
@@ -520,69 +1292,41 @@ class GitHubIntegration:
     def _apply_patch(self, original_content: str, patch: str) -> str:
         """
         Apply a unified diff patch to content
+
+        Raises ValueError when the patch has no hunks to apply, so a bad
+        patch is never committed as an unchanged file.
         """
         if not patch:
             return original_content
-        
+
+        patch = patch.rstrip(chr(10)) + "\n"
+        if patch.startswith("@@"):
+            # GitHub's per-file patches are bare hunks; unidiff needs file headers
+            patch = f"--- a/file\n+++ b/file\n{patch}"
         try:
-            # Parse the patch
-            lines = patch.split('\n')
-            original_lines = original_content.split('\n')
-            
-            # Simple patch application - this is a basic implementation
-            # For production use, consider using a proper diff library
-            
-            result_lines = []
-            i = 0
-            patch_line = 0
-            
-            while patch_line < len(lines):
-                line = lines[patch_line]
-                
-                if line.startswith('@@'):
-                    # Parse hunk header
-                    match = re.match(r'@@ -(\d+),?(\d*) \+(\d+),?(\d*) @@', line)
-                    if match:
-                        old_start = int(match.group(1)) - 1  # Convert to 0-based
-                        new_start = int(match.group(3)) - 1  # Convert to 0-based
-                        
-                        # Copy lines before the hunk
-                        while i < old_start:
-                            if i < len(original_lines):
-                                result_lines.append(original_lines[i])
-                            i += 1
-                
-                elif line.startswith('-'):
-                    # Line to be removed - skip it
-                    i += 1
-                    
-                elif line.startswith('+'):
-                    # Line to be added
-                    result_lines.append(line[1:])
-                    
-                elif line.startswith(' '):
-                    # Context line - keep it
-                    if i < len(original_lines):
-                        result_lines.append(original_lines[i])
-                        i += 1
-                
-                patch_line += 1
-            
-            # Add remaining lines
-            while i < len(original_lines):
-                result_lines.append(original_lines[i])
-                i += 1
-            
-            return '\n'.join(result_lines)
-            
-        except Exception as e:
-            logger.error(f"Error applying patch: {e}")
-            return original_content
+            hunks = PatchSet(patch)[0]
+        except (UnidiffParseError, IndexError) as e:
+            raise ValueError(f"Could not parse patch: {e}") from e
+        if not len(hunks):
+            raise ValueError("Patch contains no hunks")
+
+        lines = original_content.split('\n')
+        # Apply bottom-up so each hunk's source line numbers are still valid
+        for hunk in reversed(hunks):
+            # "-N,0" means insert after line N rather than replace from it
+            start = hunk.source_start if hunk.source_length == 0 else hunk.source_start - 1
+            lines[start:start + hunk.source_length] = [
+                line.value[:-1] if line.value.endswith('\n') else line.value
+                for line in hunk
+                if line.is_added or line.is_context
+            ]
+
+        return '\n'.join(lines)
 
     def create_issue(self, repo_name: str, title: str, body: str, labels: List[str] = None, assignees: List[str] = None) -> Optional[int]:
         """Create a new issue"""
         try:
-            repo = self.client.get_repo(repo_name)
+            repo = self._repo(repo_name)
             
             issue = repo.create_issue(
                 title=title,
@@ -598,10 +1342,14 @@ class GitHubIntegration:
             logger.error(f"Error creating issue: {e}")
             return None
 
+    async def acreate_issue(self, repo_name: str, title: str, body: str, labels: List[str] = None, assignees: List[str] = None) -> Optional[int]:
+        """Async create_issue, run on the blocking-call thread pool"""
+        return await self._in_thread(self.create_issue, repo_name, title, body, labels, assignees)
+
     def get_workflows(self, repo_name: str) -> List[Dict]:
         """Get GitHub Actions workflows"""
         try:
-            repo = self.client.get_repo(repo_name)
+            repo = self._repo(repo_name)
             workflows = repo.get_workflows()
             
             workflow_list = []
@@ -626,7 +1374,7 @@ class GitHubIntegration:
     def get_workflow_runs(self, repo_name: str, workflow_id: int = None) -> List[Dict]:
         """Get workflow runs"""
         try:
-            repo = self.client.get_repo(repo_name)
+            repo = self._repo(repo_name)
             
             if workflow_id:
                 workflow = repo.get_workflow(workflow_id)
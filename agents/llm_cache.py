@@ -0,0 +1,170 @@
+import os
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import orjson
+
+from .tools import hash_content
+
+logger = logging.getLogger(__name__)
+
+# Directory for a persistent diskcache.Cache backend; unset keeps the cache in memory
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR")
+
+
+class LRUDict:
+    """Bounded in-memory mapping that evicts the least recently used entry.
+
+    With ``ttl`` set, entries also expire that many seconds after being set.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            expires, value = self._data[key]
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LLMCache:
+    """Deterministic LLM response cache keyed by a hash of the request payload.
+
+    The backend can be any mapping exposing ``get`` and ``__setitem__``
+    (the default bounded dict, ``diskcache.Cache``, ...).
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else LRUDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(payload: dict) -> str:
+        data = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS, default=str)
+        return hashlib.sha256(data).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        self.backend[key] = value
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+
+def snippet_cache_key(prompt_version: str, llm, snippet, extra: Any = None) -> Optional[str]:
+    """Build the cache key for one snippet analyzed with a given prompt version.
+
+    ``extra`` is any other per-file input the prompt includes (e.g. static
+    analysis findings), so answers given without it are not reused with it.
+
+    Returns None when the model can't be identified (e.g. a stub LLM),
+    in which case the response must not be cached.
+    """
+    model = getattr(llm, "model", None) or getattr(llm, "model_name", None)
+    if not isinstance(model, str):
+        return None
+
+    payload = {
+        "prompt": prompt_version,
+        "model": model,
+        "temperature": getattr(llm, "temperature", None),
+        "file": snippet.file_path,
+        "content": hash_content(snippet.content)
+    }
+    if extra is not None:
+        payload["extra"] = extra
+    return LLMCache.make_key(payload)
+
+
+def lookup_snippets(cache: LLMCache, prompt_version: str, llm, snippets, extras: Optional[dict] = None) -> tuple:
+    """Split snippets into (cached, pending).
+
+    ``cached`` maps file paths to the results stored for them; ``pending``
+    holds the snippets that still need an LLM call, in their original order.
+    ``extras`` maps file paths to the ``extra`` part of their cache keys.
+    """
+    extras = extras or {}
+    cached, pending = {}, []
+    for snippet in snippets:
+        key = snippet_cache_key(prompt_version, llm, snippet, extras.get(snippet.file_path)) if snippet else None
+        value = cache.get(key) if key else None
+        if value is None:
+            pending.append(snippet)
+        else:
+            cached[snippet.file_path] = value
+    return cached, pending
+
+
+def store_snippets(cache: LLMCache, prompt_version: str, llm, snippets, results: list,
+                   extras: Optional[dict] = None):
+    """Cache a batch's results (dicts with a "file" field) under each snippet's key.
+
+    A file with no results is stored as an empty list. If any result names a
+    file outside the batch it can't be attributed, so nothing is stored.
+    """
+    by_file = {snippet.file_path: [] for snippet in snippets}
+    for result in results:
+        if result.get("file") not in by_file:
+            return
+        by_file[result["file"]].append(result)
+
+    extras = extras or {}
+    for snippet in snippets:
+        key = snippet_cache_key(prompt_version, llm, snippet, extras.get(snippet.file_path))
+        if key:
+            cache.set(key, by_file[snippet.file_path])
+
+
+def _default_backend():
+    if LLM_CACHE_DIR:
+        try:
+            import diskcache
+            return diskcache.Cache(LLM_CACHE_DIR)
+        except ImportError:
+            logger.warning("LLM_CACHE_DIR is set but diskcache is not installed; caching in memory")
+    return LRUDict()
+
+
+# Process-wide cache shared by every agent instance
+llm_cache = LLMCache(_default_backend())
@@ -0,0 +1,54 @@
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Optional
+
+import orjson
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry).decode()
+
+
+def configure_logging(level: int = logging.INFO, json_format: bool = False) -> logging.handlers.QueueListener:
+    """Route all logging through a queue so handler I/O happens on a background thread.
+
+    The root logger's existing handlers (or a stderr handler if there are
+    none) are moved behind a QueueListener; the root logger itself only
+    enqueues records, which never blocks the asyncio event loop.
+    Safe to call more than once.
+    """
+    global _listener
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _listener is not None:
+        return _listener
+
+    handlers = root.handlers[:] or [logging.StreamHandler()]
+    if json_format:
+        for handler in handlers:
+            handler.setFormatter(JSONFormatter())
+    for handler in handlers:
+        root.removeHandler(handler)
+
+    log_queue = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
@@ -1,25 +1,24 @@
+import re
+from typing import Optional
+
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
 
 from .models import WorkflowState, AnalysisContext, AgentResponse
-from .tools import get_llm, parse_code_blocks, FreeLLMProvider
-
-
-class LogicAgent:
-    def __init__(self, provider: str = "gemini", llm=None):
-        if llm is not None:
-            self.llm = llm
-        else:
-            self.llm_provider = FreeLLMProvider(provider)
-            self.llm = self.llm_provider.get_llm("logic")
+from .llm_cache import llm_cache, lookup_snippets, store_snippets
+from .metrics import TokenUsageCallback, model_label
+from .rate_limiter import get_rate_limiter
+from .tools import (
+    parse_code_blocks, estimate_tokens, batch_snippets, filter_snippets, format_snippet_batch, gather_bounded,
+    copy_results, dedupe_snippets, FreeLLMProvider, LONG_SNIPPET_TOKENS, MAX_CONCURRENT_BATCHES
+)
 
-        self.parser = StrOutputParser()
 
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("user", """You are a logic analysis expert. Analyze this code for logical issues:
+LOGIC_PROMPT = ChatPromptTemplate.from_messages([
+    ("user", """You are a logic analysis expert. Analyze these files for logical issues.
+Each file starts with a "=== FILE: <path> ===" marker.
 
-File: {file_path}
+Files: {file_path}
 Code:
 {code}
 
@@ -33,8 +32,8 @@ Look for:
 7. API contract violations
 8. Edge case handling
 
-Provide analysis in this format:
-## Logic Analysis for {file_path}
+Provide one section per file, in this format:
+## Logic Analysis for <file path exactly as given in its FILE marker>
 
 ### Issues Found:
 1. **Issue Type**: Description
@@ -46,21 +45,247 @@ Provide analysis in this format:
 - Suggestion 1
 - Suggestion 2
 
-If no issues found, state: "No logic issues detected."
+If a file has no issues, its section is only the header followed by: "No logic issues detected."
+Do not add suggestions to such a section.
 
 Response:""")
-        ])
+])
+
+# "## Logic Analysis for <path>" headers that start each file's section
+SECTION_HEADER = re.compile(r"^#+\s*Logic Analysis for\s+`?(.+?)`?\s*$", re.MULTILINE)
+# Verdict the prompt asks for on clean files
+NO_ISSUES = re.compile(r"no logic issues detected", re.IGNORECASE)
+NO_ISSUES_LENGTH = len("no logic issues detected")
+
+
+class LogicAgent:
+    # Bump whenever LOGIC_PROMPT changes so cached responses are not reused
+    PROMPT_VERSION = "logic-v2"
 
-    def _create_chain(self):
+    def __init__(self, provider: str = "gemini", llm=None, max_batch_tokens: int = 6000,
+                 max_concurrency: int = MAX_CONCURRENT_BATCHES,
+                 long_snippet_tokens: Optional[int] = LONG_SNIPPET_TOKENS):
+        self.provider = provider
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.long_snippet_tokens = long_snippet_tokens
+        if llm is not None:
+            self.llm = llm
+        else:
+            self.llm_provider = FreeLLMProvider(provider)
+            self.llm = self.llm_provider.get_llm("logic")
+
+        self.parser = StrOutputParser()
+        self.cache = llm_cache
+        self.rate_limiter = get_rate_limiter(self.llm)
+
+        self.prompt = LOGIC_PROMPT
+        self._chains = {}
+
+    def _create_chain(self, llm=None):
         """Create and return the prompt → LLM → parser chain."""
-        return (
-            RunnablePassthrough.assign(
-                file_path=lambda x: x["file_path"],
-                code=lambda x: x["code"]
+        llm = self.llm if llm is None else llm
+        chain = self.prompt | llm | self.parser
+        return chain.with_config(callbacks=[TokenUsageCallback("logic", self.provider, model_label(llm))])
+
+    def _chain_for(self, llm):
+        """The prompt → LLM → parser chain for ``llm``, built once per LLM."""
+        entry = self._chains.get(id(llm))
+        if entry is None or entry[0] is not llm:
+            entry = self._chains[id(llm)] = (llm, self._create_chain(llm))
+        return entry[1]
+
+    @property
+    def chain(self):
+        """The chain for ``llm``; rebuilt only if ``llm`` is replaced."""
+        return self._chain_for(self.llm)
+
+    @property
+    def llm_small(self):
+        """The provider's small model tier for long files; a custom LLM is used as is."""
+        provider = getattr(self, "llm_provider", None)
+        return provider.get_llm("logic", size="small") if provider is not None else self.llm
+
+    def _llm_for(self, batch: list):
+        """The model a batch is sent to; a lone long file goes to the small model."""
+        if (self.long_snippet_tokens is not None and len(batch) == 1
+                and estimate_tokens(batch[0].content) > self.long_snippet_tokens):
+            return self.llm_small
+        return self.llm
+
+    def _tier(self, batch: list) -> tuple:
+        """(chain, rate limiter) for the model a batch is sent to."""
+        llm = self._llm_for(batch)
+        if llm is self.llm:
+            return self.chain, self.rate_limiter
+        return self._chain_for(llm), get_rate_limiter(llm)
+
+    def _resolve_context(self, input) -> AnalysisContext:
+        """Return the AnalysisContext for a WorkflowState or AnalysisContext input."""
+        if isinstance(input, WorkflowState):
+            return input.context
+        elif isinstance(input, AnalysisContext):
+            return input
+        raise ValueError("Unsupported input type for logic analysis")
+
+    def _build_result(self, analysis: str, snippet) -> dict:
+        """Wrap a raw LLM analysis into the per-file result dict."""
+        code_blocks = parse_code_blocks(analysis)
+
+        return {
+            "file": snippet.file_path,
+            "analysis": analysis,
+            "suggestions": code_blocks,
+            "has_issues": NO_ISSUES.search(analysis) is None
+        }
+
+    def _split_response(self, response: str, batch: list) -> tuple:
+        """Split a batch response into per-file results.
+
+        Returns (results, missing), where ``missing`` holds the snippets the
+        model wrote no section for.
+        """
+        if len(batch) == 1:
+            return [self._build_result(response, batch[0])], []
+
+        headers = list(SECTION_HEADER.finditer(response))
+        sections = {}
+        for header, next_header in zip(headers, headers[1:] + [None]):
+            end = next_header.start() if next_header else len(response)
+            sections[header.group(1)] = response[header.start():end].strip()
+
+        results, missing = [], []
+        for snippet in batch:
+            section = sections.get(snippet.file_path)
+            if section is None:
+                missing.append(snippet)
+            else:
+                results.append(self._build_result(section, snippet))
+        return results, missing
+
+    def _is_settled(self, response: str, batch: list, new_text_start: int = 0) -> bool:
+        """Whether a partial response already decides every file in the batch.
+
+        That is the case once all files have a section and the last one is
+        clean: nothing generated after "No logic issues detected." changes
+        any result, so the stream can be cut there. Only a verdict that
+        overlaps the text from ``new_text_start`` on is looked for.
+        """
+        if NO_ISSUES.search(response, max(0, new_text_start - NO_ISSUES_LENGTH)) is None:
+            return False
+        if len(batch) == 1:
+            return True
+
+        headers = list(SECTION_HEADER.finditer(response))
+        answered = {header.group(1) for header in headers}
+        return (all(s.file_path in answered for s in batch)
+                and NO_ISSUES.search(response, headers[-1].end()) is not None)
+
+    def _stream(self, chain, payload: dict, batch: list) -> str:
+        """Stream the response for a batch, stopping as soon as it is settled."""
+        response = ""
+        stream = chain.stream(payload)
+        try:
+            for chunk in stream:
+                response += chunk
+                if self._is_settled(response, batch, len(response) - len(chunk)):
+                    break
+        finally:
+            stream.close()
+        return response
+
+    async def _astream(self, chain, payload: dict, batch: list) -> str:
+        """Async _stream."""
+        response = ""
+        stream = chain.astream(payload)
+        try:
+            async for chunk in stream:
+                response += chunk
+                if self._is_settled(response, batch, len(response) - len(chunk)):
+                    break
+        finally:
+            await stream.aclose()
+        return response
+
+    def _eligible(self, snippets: list, errors: list) -> tuple:
+        """Return (snippets to analyze, skipped file paths); empty snippets are reported in errors."""
+        non_empty = []
+        for snippet in snippets:
+            if not snippet or not snippet.content.strip():
+                errors.append(f"Error analyzing {getattr(snippet, 'file_path', 'unknown')}: Empty code snippet")
+            else:
+                non_empty.append(snippet)
+        return filter_snippets(non_empty)
+
+    def _lookup_cache(self, snippets: list) -> tuple:
+        """Return (cached per-file results, snippets that still need the LLM)."""
+        # Long files always go alone to the small model, so they are cached under it
+        small = {id(s) for s in snippets if s and self._llm_for([s]) is not self.llm}
+        cached, pending = lookup_snippets(
+            self.cache, self.PROMPT_VERSION, self.llm, [s for s in snippets if id(s) not in small]
+        )
+        if small:
+            cached_small, _ = lookup_snippets(
+                self.cache, self.PROMPT_VERSION, self.llm_small, [s for s in snippets if id(s) in small]
             )
-            | self.prompt
-            | self.llm
-            | self.parser
+            cached.update(cached_small)
+            pending = [s for s in snippets if not s or s.file_path not in cached]
+        return [dict(item) for items in cached.values() for item in items], pending
+
+    def _store_cache(self, batch: list, results: list):
+        # Only files the model answered for; left-out ones are retried, not cached as clean
+        analyzed = {r["file"] for r in results}
+        store_snippets(self.cache, self.PROMPT_VERSION, self._llm_for(batch),
+                       [s for s in batch if s.file_path in analyzed], results)
+
+    def _analyze_batch(self, batch: list, results: list, errors: list) -> list:
+        """Analyze one batch into results/errors, returning the snippets it left out."""
+        try:
+            payload = format_snippet_batch(batch, compress=True)
+            chain, rate_limiter = self._tier(batch)
+            response = rate_limiter.call(lambda: self._stream(chain, payload, batch),
+                                         tokens=estimate_tokens(payload["code"]))
+        except Exception as e:
+            file_paths = ", ".join(s.file_path for s in batch)
+            errors.append(f"Error analyzing {file_paths}: {str(e)}")
+            return []
+        batch_results, missing = self._split_response(response, batch)
+        results.extend(batch_results)
+        self._store_cache(batch, batch_results)
+        return missing
+
+    async def _aanalyze_batches(self, batches: list, results: list, errors: list) -> list:
+        """Analyze batches concurrently into results/errors, returning the snippets they left out."""
+        async def analyze_batch(batch):
+            payload = format_snippet_batch(batch, compress=True)
+            chain, rate_limiter = self._tier(batch)
+            response = await rate_limiter.acall(lambda: self._astream(chain, payload, batch),
+                                                tokens=estimate_tokens(payload["code"]))
+            return self._split_response(response, batch)
+
+        missing = []
+        outcomes = await gather_bounded(analyze_batch, batches, self.max_concurrency)
+        for batch, outcome in zip(batches, outcomes):
+            if isinstance(outcome, Exception):
+                file_paths = ", ".join(s.file_path for s in batch)
+                errors.append(f"Error analyzing {file_paths}: {str(outcome)}")
+            else:
+                results.extend(outcome[0])
+                missing.extend(outcome[1])
+                self._store_cache(batch, outcome[0])
+        return missing
+
+    def _build_response(self, context: AnalysisContext, results: list, errors: list,
+                        skipped: list = ()) -> AgentResponse:
+        return AgentResponse[dict](
+            success=(len(errors) == 0),
+            results=results,
+            errors=errors,
+            metadata={
+                "total_files": len(context.code_snippets),
+                "issues_found": len(results),
+                "skipped_files": list(skipped)
+            }
         )
 
     def analyze(self, input) -> AgentResponse:
@@ -68,50 +293,47 @@ Response:""")
         Accepts WorkflowState or AnalysisContext.
         """
         try:
-            # Determine context type
-            if isinstance(input, WorkflowState):
-                context = input.context
-            elif isinstance(input, AnalysisContext):
-                context = input
-            else:
-                raise ValueError("Unsupported input type for logic analysis")
+            context = self._resolve_context(input)
 
-            results = []
             errors = []
+            snippets, skipped = self._eligible(context.code_snippets, errors)
+            snippets, duplicates = dedupe_snippets(snippets)
+            results, pending = self._lookup_cache(snippets)
 
-            for snippet in context.code_snippets:
-                try:
-                    if not snippet or not snippet.content.strip():
-                        raise ValueError("Empty code snippet")
+            for batch in batch_snippets(pending, self.max_batch_tokens, self.long_snippet_tokens):
+                # Files left out of a multi-file answer are analyzed on their own
+                for snippet in self._analyze_batch(batch, results, errors):
+                    self._analyze_batch([snippet], results, errors)
 
-                    chain = self._create_chain()
-                    analysis = chain.invoke({
-                        "file_path": snippet.file_path,
-                        "code": snippet.content
-                    })
+            results.extend(copy_results(results, duplicates))
+            return self._build_response(context, results, errors, skipped)
 
-                    code_blocks = parse_code_blocks(analysis)
+        except Exception as e:
+            return AgentResponse(
+                success=False,
+                errors=[str(e)],
+                results=[],
+                metadata={}
+            )
 
-                    results.append({
-                        "file": snippet.file_path,
-                        "analysis": analysis,
-                        "suggestions": code_blocks,
-                        "has_issues": "no logic issues detected" not in analysis.lower()
-                    })
+    async def aanalyze(self, input) -> AgentResponse:
+        """Async variant of analyze() that sends up to ``max_concurrency`` batches at once."""
+        try:
+            context = self._resolve_context(input)
 
-                except Exception as e:
-                    file_path = getattr(snippet, "file_path", "unknown")
-                    errors.append(f"Error analyzing {file_path}: {str(e)}")
+            errors = []
+            snippets, skipped = self._eligible(context.code_snippets, errors)
+            snippets, duplicates = dedupe_snippets(snippets)
+            results, pending = self._lookup_cache(snippets)
 
-            return AgentResponse(
-                success=(len(errors) == 0),
-                results=results,
-                errors=errors,
-                metadata={
-                    "total_files": len(context.code_snippets),
-                    "issues_found": len(results)
-                }
+            missing = await self._aanalyze_batches(
+                batch_snippets(pending, self.max_batch_tokens, self.long_snippet_tokens), results, errors
             )
+            # Files left out of a multi-file answer are analyzed on their own
+            await self._aanalyze_batches([[snippet] for snippet in missing], results, errors)
+
+            results.extend(copy_results(results, duplicates))
+            return self._build_response(context, results, errors, skipped)
 
         except Exception as e:
             return AgentResponse(
@@ -0,0 +1,136 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 120)
+LABEL_NAMES = ("agent", "provider", "model")
+
+
+class Histogram:
+    """Thread-safe labelled histogram rendered in the Prometheus text format."""
+
+    def __init__(self, name: str, description: str, buckets=LATENCY_BUCKETS, labels=LABEL_NAMES):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.setdefault(
+                label_values, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            )
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def quantile(self, q: float, *label_values) -> float:
+        """Estimate a quantile as the upper bound of the bucket containing it."""
+        with self._lock:
+            series = self._series.get(label_values)
+            if not series or not series["count"]:
+                return 0.0
+            rank = q * series["count"]
+            seen = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                seen += count
+                if seen >= rank:
+                    return bound
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            keys = list(self._series)
+        result = {}
+        for key in keys:
+            series = self._series[key]
+            result["/".join(key)] = {
+                "count": series["count"],
+                "avg": round(series["sum"] / series["count"], 4),
+                "p50": self.quantile(0.5, *key),
+                "p95": self.quantile(0.95, *key)
+            }
+        return result
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in self._series.items():
+                labels = ",".join(f'{name}="{value}"' for name, value in zip(self.labels, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series['sum']}")
+                lines.append(f"{self.name}_count{{{labels}}} {series['count']}")
+        return "\n".join(lines)
+
+
+class Counter:
+    """Thread-safe labelled counter rendered in the Prometheus text format."""
+
+    def __init__(self, name: str, description: str, labels=LABEL_NAMES + ("direction",)):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"/".join(key): value for key, value in self._values.items()}
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                labels = ",".join(f'{name}="{value}"' for name, value in zip(self.labels, key))
+                lines.append(f"{self.name}{{{labels}}} {value}")
+        return "\n".join(lines)
+
+
+AGENT_LATENCY = Histogram("patchpilot_agent_latency_seconds", "Agent analysis latency in seconds")
+LLM_TOKENS = Counter("patchpilot_llm_tokens_total", "LLM tokens used, by direction (input/output)")
+
+
+def model_label(llm) -> str:
+    model = getattr(llm, "model", None) or getattr(llm, "model_name", None)
+    return model.removeprefix("models/") if isinstance(model, str) else "unknown"
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """Records the usage_metadata of every LLM response into LLM_TOKENS."""
+
+    def __init__(self, agent: str, provider: str, model: str):
+        self.label_values = (agent, provider, model)
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    LLM_TOKENS.inc(usage.get("input_tokens", 0), *self.label_values, "input")
+                    LLM_TOKENS.inc(usage.get("output_tokens", 0), *self.label_values, "output")
+
+
+def render_metrics() -> str:
+    """All agent metrics in the Prometheus text exposition format."""
+    return AGENT_LATENCY.render() + "\n" + LLM_TOKENS.render() + "\n"
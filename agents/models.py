@@ -1,6 +1,51 @@
-from typing import List, Dict, Any, Optional, Annotated
+from typing import List, Dict, Any, Optional, Annotated, Generic, TypeVar
 from pydantic import BaseModel, Field
+import logging
 import operator
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+
+class Severity(str, Enum):
+    """Issue severity. Members compare and hash equal to their lowercase string values."""
+    LOW = "low"
+    MEDIUM = "medium"
+    HIGH = "high"
+    CRITICAL = "critical"
+
+    __str__ = str.__str__
+    __format__ = str.__format__
+
+    @property
+    def level(self) -> int:
+        """Numeric rank (low=1 .. critical=4) for range checks."""
+        return _SEVERITY_LEVELS[self]
+
+    @classmethod
+    def _missing_(cls, value):
+        # LLMs are loose about case and vocabulary
+        if isinstance(value, str):
+            normalized = value.strip().lower()
+            member = cls._value2member_map_.get(normalized) or _SEVERITY_ALIASES.get(normalized)
+            if member is None:
+                # Dropping the finding over its label would hide it, so rate it medium
+                logger.warning("Unknown severity %r, treating it as medium", value)
+                member = cls.MEDIUM
+            return member
+        return None
+
+
+_SEVERITY_LEVELS = {Severity.LOW: 1, Severity.MEDIUM: 2, Severity.HIGH: 3, Severity.CRITICAL: 4}
+_SEVERITY_ALIASES = {
+    "info": Severity.LOW,
+    "informational": Severity.LOW,
+    "minor": Severity.LOW,
+    "moderate": Severity.MEDIUM,
+    "major": Severity.HIGH,
+    "severe": Severity.CRITICAL,
+    "blocker": Severity.CRITICAL
+}
 
 
 class CodeSnippet(BaseModel):
@@ -13,7 +58,7 @@ class CodeSnippet(BaseModel):
 class Vulnerability(BaseModel):
     """Represents a security issue detected in the code."""
     type: str
-    severity: str = "medium"  # low | medium | high | critical
+    severity: Severity = Severity.MEDIUM
     description: str
     line: int
     file: str
@@ -26,7 +71,7 @@ class QualityIssue(BaseModel):
     description: str
     line: int
     file: str
-    severity: str = "low"
+    severity: Severity = Severity.LOW
     rule_id: Optional[str] = None
 
 
@@ -41,10 +86,17 @@ class AnalysisContext(BaseModel):
     agent_memory: Dict[str, Any] = Field(default_factory=dict)
 
 
-class AgentResponse(BaseModel):
-    """Generic response wrapper returned by agents."""
+T = TypeVar("T")
+
+
+class AgentResponse(BaseModel, Generic[T]):
+    """Generic response wrapper returned by agents.
+
+    Agents parametrize it with their result type (``AgentResponse[Vulnerability]``);
+    the bare class accepts results of any type.
+    """
     success: bool
-    results: List[Any] = Field(default_factory=list)
+    results: List[T] = Field(default_factory=list)
     errors: List[str] = Field(default_factory=list)
     metadata: Dict[str, Any] = Field(default_factory=dict)
     next_steps: List[str] = Field(default_factory=list)
@@ -1,20 +1,24 @@
-import json
+import re
+from typing import Optional
+
+import orjson
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 
 from .models import QualityIssue, WorkflowState, AnalysisContext, AgentResponse
-from .tools import FreeLLMProvider
-
-class QualityAgent:
-    def __init__(self, provider: str = "gemini"):
-        self.llm_provider = FreeLLMProvider(provider)
-        self.llm = self.llm_provider.get_llm("quality")
-        self.parser = StrOutputParser()
+from .llm_cache import llm_cache, lookup_snippets, store_snippets
+from .metrics import TokenUsageCallback, model_label
+from .rate_limiter import get_rate_limiter
+from .tools import (
+    FreeLLMProvider, LONG_SNIPPET_TOKENS, MAX_CONCURRENT_BATCHES, batch_snippets, estimate_tokens, filter_snippets, format_snippet_batch,
+    copy_results, dedupe_snippets, gather_bounded, parse_json_array
+)
 
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("user", """You are a code quality expert. Review this code for quality issues:
+QUALITY_PROMPT = ChatPromptTemplate.from_messages([
+    ("user", """You are a code quality expert. Review these files for quality issues.
+Each file starts with a "=== FILE: <path> ===" marker.
 
-File: {file_path}
+Files: {file_path}
 Code:
 {code}
 
@@ -29,93 +33,252 @@ Check for:
 
 For each issue found, respond with JSON format:
 [
-    {
+    {{
         "type": "quality_issue_type",
         "description": "detailed description",
         "line": line_number,
-        "file": "filename",
+        "file": "file path exactly as given in its FILE marker",
         "severity": "low/medium/high",
         "rule_id": "optional_rule_id"
-    }
+    }}
 ]
 
-If no issues found, return: []
+Report the issues of every file in a single JSON array. If no issues found, return: []
 
 Response (JSON only):""")
-        ])
+])
+
+# Words that make an unparseable response still worth reporting
+QUALITY_HINT = re.compile(r"style|complexity|documentation|error", re.IGNORECASE)
+
+
+class QualityAgent:
+    # Bump whenever QUALITY_PROMPT changes so cached responses are not reused
+    PROMPT_VERSION = "quality-v1"
+
+    def __init__(self, provider: str = "gemini", max_batch_tokens: int = 6000,
+                 max_concurrency: int = MAX_CONCURRENT_BATCHES,
+                 long_snippet_tokens: Optional[int] = LONG_SNIPPET_TOKENS):
+        self.provider = provider
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.long_snippet_tokens = long_snippet_tokens
+        self.llm_provider = FreeLLMProvider(provider)
+        self.llm = self.llm_provider.get_llm("quality")
+        self.parser = StrOutputParser()
+        self.cache = llm_cache
+        self.rate_limiter = get_rate_limiter(self.llm)
+
+        self.prompt = QUALITY_PROMPT
+        self._chains = {}
+
+    def _create_chain(self, llm=None):
+        llm = self.llm if llm is None else llm
+        chain = self.prompt | llm | self.parser
+        return chain.with_config(callbacks=[TokenUsageCallback("quality", self.provider, model_label(llm))])
+
+    def _chain_for(self, llm):
+        """The prompt → LLM → parser chain for ``llm``, built once per LLM."""
+        entry = self._chains.get(id(llm))
+        if entry is None or entry[0] is not llm:
+            entry = self._chains[id(llm)] = (llm, self._create_chain(llm))
+        return entry[1]
+
+    @property
+    def chain(self):
+        """The chain for ``llm``; rebuilt only if ``llm`` is replaced."""
+        return self._chain_for(self.llm)
+
+    @property
+    def llm_small(self):
+        """The provider's small model tier, used for long files."""
+        return self.llm_provider.get_llm("quality", size="small")
+
+    def _llm_for(self, batch: list):
+        """The model a batch is sent to; a lone long file goes to the small model."""
+        if (self.long_snippet_tokens is not None and len(batch) == 1
+                and estimate_tokens(batch[0].content) > self.long_snippet_tokens):
+            return self.llm_small
+        return self.llm
+
+    def _tier(self, batch: list) -> tuple:
+        """(chain, rate limiter) for the model a batch is sent to."""
+        llm = self._llm_for(batch)
+        if llm is self.llm:
+            return self.chain, self.rate_limiter
+        return self._chain_for(llm), get_rate_limiter(llm)
+
+    def _resolve_context(self, input) -> AnalysisContext:
+        """Return the AnalysisContext for a WorkflowState or AnalysisContext input."""
+        if isinstance(input, WorkflowState):
+            return input.context
+        elif isinstance(input, AnalysisContext):
+            return input
+        raise ValueError("Unsupported input type for quality analysis")
+
+    def _parse_json(self, response: str, default_file: str) -> list:
+        """QualityIssues in the response's JSON array; raises orjson.JSONDecodeError without one."""
+        results = []
+        for item in parse_json_array(response):
+            if not isinstance(item, dict):
+                continue
+            # One malformed item must not drop the rest of the batch
+            try:
+                results.append(
+                    QualityIssue(
+                        type=item.get("type", "Quality Issue"),
+                        description=item.get("description", ""),
+                        line=item.get("line", 0),
+                        file=item.get("file", default_file),
+                        severity=item.get("severity", "low"),
+                        rule_id=item.get("rule_id")
+                    )
+                )
+            except ValueError:
+                continue
+        return results
+
+    def _parse_response(self, response: str, batch: list) -> list:
+        """Convert a raw LLM response for a batch of snippets into QualityIssue objects."""
+        default_file = batch[0].file_path if len(batch) == 1 else "unknown"
 
-    def _create_chain(self):
-        return self.prompt | self.llm | self.parser
+        try:
+            return self._parse_json(response, default_file)
+        except orjson.JSONDecodeError:
+            # fallback: capture at least some useful information
+            if not QUALITY_HINT.search(response):
+                return []
+            return [
+                QualityIssue(
+                    type="Code Quality Issue",
+                    description=response[:200] + "..." if len(response) > 200 else response,
+                    line=0,
+                    file=default_file,
+                    severity="low"
+                )
+            ]
+
+    def _split_response(self, response: str, batch: list) -> tuple:
+        """Split a batch response into (issues, snippets to re-send on their own).
+
+        A multi-file response without a JSON array cannot be attributed to
+        any file, so all of its files are retried one at a time.
+        """
+        if len(batch) == 1:
+            return self._parse_response(response, batch), []
+        try:
+            return self._parse_json(response, "unknown"), []
+        except orjson.JSONDecodeError:
+            return [], batch
+
+    def _lookup_cache(self, snippets: list) -> tuple:
+        """Return (cached QualityIssues, snippets that still need the LLM)."""
+        # Long files always go alone to the small model, so they are cached under it
+        small = {id(s) for s in snippets if s and self._llm_for([s]) is not self.llm}
+        cached, pending = lookup_snippets(
+            self.cache, self.PROMPT_VERSION, self.llm, [s for s in snippets if id(s) not in small]
+        )
+        if small:
+            cached_small, _ = lookup_snippets(
+                self.cache, self.PROMPT_VERSION, self.llm_small, [s for s in snippets if id(s) in small]
+            )
+            cached.update(cached_small)
+            pending = [s for s in snippets if not s or s.file_path not in cached]
+        # Cached items are model_dump()s of validated objects, so skip re-validating them
+        return [QualityIssue.model_construct(**item) for items in cached.values() for item in items], pending
+
+    def _store_cache(self, batch: list, results: list):
+        store_snippets(self.cache, self.PROMPT_VERSION, self._llm_for(batch), batch, [r.model_dump() for r in results])
+
+    def _build_response(self, context: AnalysisContext, results: list, errors: list,
+                        skipped: list = ()) -> AgentResponse:
+        return AgentResponse[QualityIssue](
+            success=(len(errors) == 0),
+            results=results,
+            errors=errors,
+            metadata={
+                "total_files": len(context.code_snippets),
+                "issues_found": len(results),
+                "skipped_files": list(skipped)
+            }
+        )
 
     def analyze(self, input) -> AgentResponse:
         """Analyze code snippets for quality issues. Accepts WorkflowState or AnalysisContext."""
         try:
-            # Determine context
-            if isinstance(input, WorkflowState):
-                context = input.context
-            elif isinstance(input, AnalysisContext):
-                context = input
-            else:
-                raise ValueError("Unsupported input type for quality analysis")
-
-            results = []
+            context = self._resolve_context(input)
+
+            snippets, skipped = filter_snippets(context.code_snippets)
+            snippets, duplicates = dedupe_snippets(snippets)
+            results, pending = self._lookup_cache(snippets)
             errors = []
 
-            for snippet in context.code_snippets:
+            def analyze_batch(batch):
+                payload = format_snippet_batch(batch)
+                chain, rate_limiter = self._tier(batch)
+                response = rate_limiter.call(lambda: chain.invoke(payload),
+                                             tokens=estimate_tokens(payload["code"]))
+                issues, retry = self._split_response(response, batch)
+                for snippet in retry:
+                    issues.extend(analyze_batch([snippet]))
+                return issues
+
+            for batch in batch_snippets(pending, self.max_batch_tokens, self.long_snippet_tokens):
                 try:
-                    chain = self._create_chain()
-                    response = chain.invoke({
-                        "file_path": snippet.file_path,
-                        "code": snippet.content
-                    })
-
-                    clean_response = response.strip()
-                    if clean_response.startswith("```json"):
-                        clean_response = clean_response[7:]
-                    if clean_response.endswith("```"):
-                        clean_response = clean_response[:-3]
-
-                    try:
-                        analysis = json.loads(clean_response.strip())
-                        for item in analysis:
-                            if isinstance(item, dict):
-                                results.append(
-                                    QualityIssue(
-                                        type=item.get("type", "Quality Issue"),
-                                        description=item.get("description", ""),
-                                        line=item.get("line", 0),
-                                        file=item.get("file", snippet.file_path),
-                                        severity=item.get("severity", "low"),
-                                        rule_id=item.get("rule_id")
-                                    )
-                                )
-                    except json.JSONDecodeError:
-                        # fallback: capture at least some useful information
-                        if any(word in response.lower() for word in ["style", "complexity", "documentation", "error"]):
-                            results.append(
-                                QualityIssue(
-                                    type="Code Quality Issue",
-                                    description=response[:200] + "..." if len(response) > 200 else response,
-                                    line=0,
-                                    file=snippet.file_path,
-                                    severity="low"
-                                )
-                            )
+                    batch_results = analyze_batch(batch)
 
                 except Exception as e:
-                    file_path = getattr(snippet, "file_path", "unknown")
-                    errors.append(f"Error analyzing {file_path}: {str(e)}")
+                    file_paths = ", ".join(s.file_path for s in batch)
+                    errors.append(f"Error analyzing {file_paths}: {str(e)}")
+                    continue
+
+                results.extend(batch_results)
+                self._store_cache(batch, batch_results)
+
+            results.extend(copy_results(results, duplicates))
+            return self._build_response(context, results, errors, skipped)
 
+        except Exception as e:
             return AgentResponse(
-                success=(len(errors) == 0),
-                results=results,
-                errors=errors,
-                metadata={
-                    "total_files": len(context.code_snippets),
-                    "issues_found": len(results)
-                }
+                success=False,
+                errors=[str(e)],
+                results=[],
+                metadata={}
             )
 
+    async def aanalyze(self, input) -> AgentResponse:
+        """Async variant of analyze() that sends up to ``max_concurrency`` batches at once."""
+        try:
+            context = self._resolve_context(input)
+
+            snippets, skipped = filter_snippets(context.code_snippets)
+            snippets, duplicates = dedupe_snippets(snippets)
+            results, pending = self._lookup_cache(snippets)
+            errors = []
+
+            async def analyze_batch(batch):
+                payload = format_snippet_batch(batch)
+                chain, rate_limiter = self._tier(batch)
+                response = await rate_limiter.acall(lambda: chain.ainvoke(payload),
+                                                    tokens=estimate_tokens(payload["code"]))
+                issues, retry = self._split_response(response, batch)
+                for snippet in retry:
+                    issues.extend(await analyze_batch([snippet]))
+                return issues
+
+            batches = batch_snippets(pending, self.max_batch_tokens, self.long_snippet_tokens)
+            outcomes = await gather_bounded(analyze_batch, batches, self.max_concurrency)
+            for batch, outcome in zip(batches, outcomes):
+                if isinstance(outcome, Exception):
+                    file_paths = ", ".join(s.file_path for s in batch)
+                    errors.append(f"Error analyzing {file_paths}: {str(outcome)}")
+                else:
+                    results.extend(outcome)
+                    self._store_cache(batch, outcome)
+
+            results.extend(copy_results(results, duplicates))
+            return self._build_response(context, results, errors, skipped)
+
         except Exception as e:
             return AgentResponse(
                 success=False,
@@ -0,0 +1,262 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+# (requests per minute, tokens per minute) per model; None means unlimited
+MODEL_RATE_LIMITS = {
+    "gemini-1.5-flash": (1000, None),
+    "gemini-1.5-flash-8b": (4000, None),
+    "gemini-1.5-pro": (360, None),
+    "llama3-70b-8192": (30, 6000),
+    "llama3-8b-8192": (30, 30000),
+}
+DEFAULT_RATE_LIMIT = (60, None)
+
+THROTTLE_FACTOR = 0.8
+THROTTLE_SECONDS = 60.0
+
+# Rate-limited LLM calls are retried this many times, backing off exponentially
+# from RATE_LIMIT_BACKOFF seconds plus up to a second of jitter
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF = 1.0
+
+
+class CircuitOpenError(Exception):
+    """Raised when a model's circuit breaker is rejecting calls."""
+
+
+def is_rate_limit_error(exc: Exception) -> bool:
+    """Best-effort detection of HTTP 429 errors across provider SDKs."""
+    response = getattr(exc, "response", None)
+    status = getattr(exc, "status_code", None) or getattr(response, "status_code", None)
+    if status == 429:
+        return True
+    message = str(exc).lower()
+    return "429" in message or "rate limit" in message or "resource exhausted" in message
+
+
+def retry_after_seconds(exc: Exception) -> Optional[float]:
+    """Read Retry-After / X-RateLimit-Reset from the error's HTTP response, if any."""
+    return retry_after_from_headers(getattr(getattr(exc, "response", None), "headers", None) or {})
+
+
+def retry_after_from_headers(headers) -> Optional[float]:
+    """Seconds to wait according to Retry-After / X-RateLimit-Reset response headers, if any."""
+    for header in ("retry-after", "x-ratelimit-reset", "x-ratelimit-reset-requests"):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            seconds = float(str(value).rstrip("s"))
+        except ValueError:
+            continue
+        # Some providers send an epoch timestamp instead of a delay
+        if seconds > 1e9:
+            seconds -= time.time()
+        return max(seconds, 0.0)
+    return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Seconds to wait before retry number ``attempt + 1`` of a rate-limited call."""
+    return RATE_LIMIT_BACKOFF * 2 ** attempt + random.random()
+
+
+def should_retry(exc: Exception, attempt: int) -> bool:
+    return attempt < RATE_LIMIT_RETRIES and is_rate_limit_error(exc)
+
+
+class TokenBucket:
+    """Thread-safe token bucket that never blocks; callers sleep for the returned delay.
+
+    Reservations may drive the balance negative so concurrent callers queue up
+    in arrival order instead of racing for the next refill.
+    """
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._throttled_until = 0.0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _rate(self, now: float) -> float:
+        if now < self._throttled_until:
+            return self.refill_rate * THROTTLE_FACTOR
+        return self.refill_rate
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self._rate(now))
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take ``amount`` tokens and return how long to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= amount
+            wait = -self._tokens / self._rate(now) if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def throttle(self, retry_after: Optional[float] = None):
+        """Cut the refill rate for a while, and pause entirely for ``retry_after`` seconds."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._throttled_until = now + THROTTLE_SECONDS
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` failures within ``window`` seconds."""
+
+    def __init__(self, failure_threshold: int = 5, window: float = 30.0, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self._failures = deque()
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return time.monotonic() < self._open_until
+
+    def record_success(self):
+        with self._lock:
+            self._failures.clear()
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            self._failures.append(now)
+            while self._failures and now - self._failures[0] > self.window:
+                self._failures.popleft()
+            if len(self._failures) >= self.failure_threshold:
+                self._open_until = now + self.reset_timeout
+                self._failures.clear()
+
+
+class RateLimiter:
+    """Per-model request/token budget with adaptive throttling and a circuit breaker.
+
+    Uses no asyncio primitives, so one instance can be shared by every agent
+    across threads and event loops.
+    """
+
+    def __init__(self, rpm: int, tpm: Optional[int] = None, name: str = "default"):
+        self.name = name
+        # Allow bursts of up to ten seconds' worth of requests
+        self.requests = TokenBucket(max(1.0, rpm / 6), rpm / 60)
+        # A single batch can be a large share of a low TPM limit, so the token
+        # bucket holds the provider's full minute instead of ten seconds of it
+        self.tokens = TokenBucket(tpm, tpm / 60) if tpm else None
+        self.breaker = CircuitBreaker()
+
+    def _delay(self, tokens: int) -> float:
+        delay = self.requests.reserve(1)
+        if self.tokens is not None and tokens:
+            # An estimate above the whole minute's budget would otherwise never fit
+            delay = max(delay, self.tokens.reserve(min(tokens, self.tokens.capacity)))
+        return delay
+
+    def record_failure(self, exc: Exception):
+        if is_rate_limit_error(exc):
+            retry_after = retry_after_seconds(exc)
+            self.requests.throttle(retry_after)
+            if self.tokens is not None:
+                self.tokens.throttle(retry_after)
+        self.breaker.record_failure()
+
+    def _check_breaker(self):
+        if self.breaker.is_open:
+            raise CircuitOpenError(f"Circuit open for {self.name}, rejecting call")
+
+    @asynccontextmanager
+    async def reserve(self, tokens: int = 0):
+        """Wait for budget for one request of ``tokens`` estimated tokens.
+
+        Raises CircuitOpenError without waiting when the breaker is open.
+        """
+        self._check_breaker()
+
+        delay = self._delay(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        try:
+            yield
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        else:
+            self.breaker.record_success()
+
+    @contextmanager
+    def reserve_sync(self, tokens: int = 0):
+        """Blocking variant of reserve() for synchronous callers."""
+        self._check_breaker()
+
+        delay = self._delay(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+        try:
+            yield
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        else:
+            self.breaker.record_success()
+
+    async def acall(self, func, tokens: int = 0):
+        """Await ``func()`` within budget, retrying it when the provider rate-limits it.
+
+        A Retry-After from the provider pauses the next reservation, so the
+        retry waits for whichever of it and the backoff is longer.
+        """
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                async with self.reserve(tokens):
+                    return await func()
+            except Exception as e:
+                if not should_retry(e, attempt):
+                    raise
+            await asyncio.sleep(backoff_delay(attempt))
+
+    def call(self, func, tokens: int = 0):
+        """Blocking variant of acall() for synchronous callers."""
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                with self.reserve_sync(tokens):
+                    return func()
+            except Exception as e:
+                if not should_retry(e, attempt):
+                    raise
+            time.sleep(backoff_delay(attempt))
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(llm) -> RateLimiter:
+    """Return the process-wide limiter for the model behind ``llm``."""
+    model = getattr(llm, "model", None) or getattr(llm, "model_name", None)
+    if not isinstance(model, str):
+        model = "default"
+    model = model.removeprefix("models/")
+
+    with _limiters_lock:
+        if model not in _limiters:
+            rpm, tpm = MODEL_RATE_LIMITS.get(model, DEFAULT_RATE_LIMIT)
+            _limiters[model] = RateLimiter(rpm, tpm, name=model)
+        return _limiters[model]
@@ -1,20 +1,28 @@
-import json
+import os
+import re
+import asyncio
+from typing import Optional
+
+import orjson
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from .models import Vulnerability, WorkflowState, AnalysisContext, AgentResponse
-from .tools import FreeLLMProvider
-
+from .llm_cache import llm_cache, lookup_snippets, store_snippets
+from .metrics import TokenUsageCallback, model_label
+from .rate_limiter import RATE_LIMIT_RETRIES, backoff_delay, get_rate_limiter, should_retry
+from .tools import (
+    FreeLLMProvider, JSONObjectStream, LONG_SNIPPET_TOKENS, MAX_CONCURRENT_BATCHES, batch_snippets, estimate_tokens,
+    copy_results, dedupe_snippets, filter_snippets, format_snippet_batch, gather_bounded, map_bounded,
+    parse_json_array
+)
 
-class SecurityAgent:
-    def __init__(self, provider: str = "gemini"):
-        self.llm_provider = FreeLLMProvider(provider)
-        self.llm = self.llm_provider.get_llm("security")
-        self.parser = StrOutputParser()
 
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("user", """You are a security expert. Analyze this code for security vulnerabilities:
+SECURITY_PROMPT = ChatPromptTemplate.from_messages([
+    ("user", """You are a security expert. Analyze these files for security vulnerabilities.
+Each file starts with a "=== FILE: <path> ===" marker. Files may end with static analyzer findings;
+treat those as confirmed issues and assess their severity.
 
-File: {file_path}
+Files: {file_path}
 Code:
 {code}
 
@@ -37,89 +45,337 @@ For each vulnerability found, respond with JSON format:
         "severity": "low/medium/high/critical",
         "description": "detailed description",
         "line": line_number,
-        "file": "filename",
+        "file": "file path exactly as given in its FILE marker",
         "confidence": confidence_score
     }}
 ]
 
-If no vulnerabilities found, return: []
+Report the issues of every file in a single JSON array. If no vulnerabilities found, return: []
 
 Response (JSON only):""")
-        ])
+])
+
+# Batches in flight at once, in analyze() as worker threads, which also
+# parallelizes providers whose SDK only has a blocking client
+SECURITY_CONCURRENCY = int(os.getenv("PATCHPILOT_SECURITY_CONCURRENCY", MAX_CONCURRENT_BATCHES))
+
+# Words that make an unparseable response still worth reporting
+SECURITY_HINT = re.compile(r"vulnerability|security", re.IGNORECASE)
+# Tokens behind every issue class SECURITY_PROMPT asks about; a file with none
+# of them skips the LLM. Deliberately broad: a false hit only costs a request.
+SUSPICIOUS_CODE = re.compile(
+    r"passw|secret|api[_-]?key|token|credential|private[_-]?key"
+    r"|select|insert|update|delete|execute|cursor|query|sql"
+    r"|innerhtml|outerhtml|document\.write|\|\s*safe|markup|render|template"
+    r"|open\(|path|file|upload|\.\./"
+    r"|auth|login|session|jwt|cookie|permission|admin"
+    r"|exec|eval|system|subprocess|popen|spawn|shell"
+    r"|random|md5|sha1|\bdes\b|crypt|cipher|hash|ssl|tls|verify"
+    r"|request|input|argv|environ|getenv|pickle|yaml\.load|marshal|serializ",
+    re.IGNORECASE
+)
+
+
+class SecurityAgent:
+    # Bump whenever SECURITY_PROMPT changes so cached responses are not reused
+    PROMPT_VERSION = "security-v2"
+
+    def __init__(self, provider: str = "gemini", max_batch_tokens: int = 6000,
+                 max_concurrency: int = SECURITY_CONCURRENCY,
+                 long_snippet_tokens: Optional[int] = LONG_SNIPPET_TOKENS, force_llm: bool = False):
+        self.provider = provider
+        # Send every file to the LLM, even those SUSPICIOUS_CODE finds nothing in
+        self.force_llm = force_llm
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.long_snippet_tokens = long_snippet_tokens
+        self.llm_provider = FreeLLMProvider(provider)
+        self.llm = self.llm_provider.get_llm("security")
+        self.parser = StrOutputParser()
+        self.cache = llm_cache
+        self.rate_limiter = get_rate_limiter(self.llm)
+
+        self.prompt = SECURITY_PROMPT
+        self._chains = {}
 
-    def _create_chain(self):
+    def _create_chain(self, llm=None):
         """Create the LangChain chain for processing."""
-        return self.prompt | self.llm | self.parser
+        llm = self.llm if llm is None else llm
+        chain = self.prompt | llm | self.parser
+        return chain.with_config(callbacks=[TokenUsageCallback("security", self.provider, model_label(llm))])
+
+    def _chain_for(self, llm):
+        """The prompt → LLM → parser chain for ``llm``, built once per LLM."""
+        entry = self._chains.get(id(llm))
+        if entry is None or entry[0] is not llm:
+            entry = self._chains[id(llm)] = (llm, self._create_chain(llm))
+        return entry[1]
+
+    @property
+    def chain(self):
+        """The chain for ``llm``; rebuilt only if ``llm`` is replaced."""
+        return self._chain_for(self.llm)
+
+    @property
+    def llm_small(self):
+        """The provider's small model tier, used for long files."""
+        return self.llm_provider.get_llm("security", size="small")
+
+    def _llm_for(self, batch: list):
+        """The model a batch is sent to; a lone long file goes to the small model."""
+        if (self.long_snippet_tokens is not None and len(batch) == 1
+                and estimate_tokens(batch[0].content) > self.long_snippet_tokens):
+            return self.llm_small
+        return self.llm
+
+    def _tier(self, batch: list) -> tuple:
+        """(chain, rate limiter) for the model a batch is sent to."""
+        llm = self._llm_for(batch)
+        if llm is self.llm:
+            return self.chain, self.rate_limiter
+        return self._chain_for(llm), get_rate_limiter(llm)
+
+    def _resolve_context(self, input) -> AnalysisContext:
+        """Return the AnalysisContext for a WorkflowState or AnalysisContext input."""
+        if isinstance(input, WorkflowState):
+            return input.context
+        elif isinstance(input, AnalysisContext):
+            return input
+        raise ValueError("Unsupported input type for security analysis")
+
+    def _to_vulnerability(self, item, default_file: str):
+        """Build a Vulnerability from one parsed JSON item, or None if it is malformed."""
+        if not isinstance(item, dict):
+            return None
+        # One malformed item must not drop the rest of the batch
+        try:
+            return Vulnerability(
+                type=item.get("type", "Unknown"),
+                severity=item.get("severity", "medium"),
+                description=item.get("description", ""),
+                line=item.get("line", 0),
+                file=item.get("file", default_file),
+                confidence=item.get("confidence", 0.8)
+            )
+        except ValueError:
+            return None
+
+    async def _astream_batch(self, batch: list, findings: dict = None):
+        """Stream the LLM response for a batch, yielding each Vulnerability once its JSON object closes."""
+        default_file = batch[0].file_path if len(batch) == 1 else "unknown"
+        payload = format_snippet_batch(batch, findings, compress=True)
+        stream = JSONObjectStream()
+        chunks = []
+
+        chain, rate_limiter = self._tier(batch)
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                async with rate_limiter.reserve(tokens=estimate_tokens(payload["code"])):
+                    async for chunk in chain.astream(payload):
+                        chunks.append(chunk)
+                        for item in stream.feed(chunk):
+                            vulnerability = self._to_vulnerability(item, default_file)
+                            if vulnerability is not None:
+                                yield vulnerability
+                break
+            except Exception as e:
+                # Findings already yielded cannot be taken back, so only an unanswered call is retried
+                if chunks or not should_retry(e, attempt):
+                    raise
+            await asyncio.sleep(backoff_delay(attempt))
+
+        if stream.objects_seen == 0:
+            # An empty array is a clean batch; free text falls back to the
+            # heuristics, or to asking about each file on its own
+            vulnerabilities, retry = self._split_response("".join(chunks), batch)
+            for vulnerability in vulnerabilities:
+                yield vulnerability
+            for snippet in retry:
+                async for vulnerability in self._astream_batch([snippet], findings):
+                    yield vulnerability
+
+    def _parse_json(self, response: str, default_file: str) -> list:
+        """Vulnerabilities in the response's JSON array; raises orjson.JSONDecodeError without one."""
+        vulnerabilities = (self._to_vulnerability(item, default_file) for item in parse_json_array(response))
+        return [vulnerability for vulnerability in vulnerabilities if vulnerability is not None]
+
+    def _parse_response(self, response: str, batch: list) -> list:
+        """Convert a raw LLM response for a batch of snippets into Vulnerability objects."""
+        default_file = batch[0].file_path if len(batch) == 1 else "unknown"
 
-    def analyze(self, input) -> AgentResponse:
-        """Handle both WorkflowState and direct AnalysisContext inputs."""
         try:
-            # Determine input type
-            if isinstance(input, WorkflowState):
-                context = input.context
-            elif isinstance(input, AnalysisContext):
-                context = input
+            return self._parse_json(response, default_file)
+        except orjson.JSONDecodeError:
+            if not SECURITY_HINT.search(response):
+                return []
+            return [
+                Vulnerability(
+                    type="Potential Security Issue",
+                    severity="medium",
+                    description=response[:200] + "..." if len(response) > 200 else response,
+                    line=0,
+                    file=default_file,
+                    confidence=0.6
+                )
+            ]
+
+    def _split_response(self, response: str, batch: list) -> tuple:
+        """Split a batch response into (vulnerabilities, snippets to re-send on their own).
+
+        A multi-file response without a JSON array cannot be attributed to
+        any file, so all of its files are retried one at a time.
+        """
+        if len(batch) == 1:
+            return self._parse_response(response, batch), []
+        try:
+            return self._parse_json(response, "unknown"), []
+        except orjson.JSONDecodeError:
+            return [], batch
+
+    def _eligible(self, snippets: list, static_findings: Optional[dict] = None) -> tuple:
+        """Return (snippets to analyze, skipped file paths).
+
+        Unless ``force_llm`` is set, files without a single security-relevant
+        token are skipped too, except those static analysis flagged.
+        """
+        to_analyze, skipped = filter_snippets(snippets)
+        if self.force_llm:
+            return to_analyze, skipped
+
+        suspicious = []
+        for snippet in to_analyze:
+            if SUSPICIOUS_CODE.search(snippet.content) or (static_findings and snippet.file_path in static_findings):
+                suspicious.append(snippet)
             else:
-                raise ValueError("Unsupported input type for security analysis")
+                skipped.append(snippet.file_path)
+        return suspicious, skipped
+
+    def _lookup_cache(self, snippets: list, static_findings: Optional[dict] = None) -> tuple:
+        """Return (cached Vulnerabilities, snippets that still need the LLM).
+
+        Static findings are part of the prompt, so they are part of each file's key.
+        """
+        # Long files always go alone to the small model, so they are cached under it
+        small = {id(s) for s in snippets if s and self._llm_for([s]) is not self.llm}
+        cached, pending = lookup_snippets(
+            self.cache, self.PROMPT_VERSION, self.llm, [s for s in snippets if id(s) not in small], static_findings
+        )
+        if small:
+            cached_small, _ = lookup_snippets(
+                self.cache, self.PROMPT_VERSION, self.llm_small, [s for s in snippets if id(s) in small],
+                static_findings
+            )
+            cached.update(cached_small)
+            pending = [s for s in snippets if not s or s.file_path not in cached]
+        # Cached items are model_dump()s of validated objects, so skip re-validating them
+        return [Vulnerability.model_construct(**item) for items in cached.values() for item in items], pending
+
+    def _store_cache(self, batch: list, results: list, static_findings: Optional[dict] = None):
+        store_snippets(self.cache, self.PROMPT_VERSION, self._llm_for(batch), batch, [r.model_dump() for r in results],
+                       static_findings)
+
+    def _build_response(self, context: AnalysisContext, results: list, errors: list,
+                        skipped: list = ()) -> AgentResponse:
+        return AgentResponse[Vulnerability](
+            success=len(errors) == 0,
+            results=results,
+            errors=errors,
+            metadata={
+                "total_files": len(context.code_snippets),
+                "issues_found": len(results),
+                "skipped_files": list(skipped)
+            }
+        )
+
+    def analyze(self, input) -> AgentResponse:
+        """Handle both WorkflowState and direct AnalysisContext inputs.
+
+        Up to ``max_concurrency`` batches are sent at once from worker threads.
+        """
+        try:
+            context = self._resolve_context(input)
 
-            results = []
+            static_findings = context.agent_memory.get("static_findings")
+            snippets, skipped = self._eligible(context.code_snippets, static_findings)
+            snippets, duplicates = dedupe_snippets(snippets)
+            results, pending = self._lookup_cache(snippets, static_findings)
             errors = []
 
-            for snippet in context.code_snippets:
-                try:
-                    chain = self._create_chain()
-                    response = chain.invoke({
-                        "file_path": snippet.file_path,
-                        "code": snippet.content
-                    })
-
-                    clean_response = response.strip()
-                    if clean_response.startswith("```json"):
-                        clean_response = clean_response[7:]
-                    if clean_response.endswith("```"):
-                        clean_response = clean_response[:-3]
-
-                    try:
-                        analysis = json.loads(clean_response.strip())
-                        for item in analysis:
-                            if isinstance(item, dict):
-                                results.append(
-                                    Vulnerability(
-                                        type=item.get("type", "Unknown"),
-                                        severity=item.get("severity", "medium"),
-                                        description=item.get("description", ""),
-                                        line=item.get("line", 0),
-                                        file=item.get("file", snippet.file_path),
-                                        confidence=item.get("confidence", 0.8)
-                                    )
-                                )
-                    except json.JSONDecodeError:
-                        if "vulnerability" in response.lower() or "security" in response.lower():
-                            results.append(
-                                Vulnerability(
-                                    type="Potential Security Issue",
-                                    severity="medium",
-                                    description=response[:200] + "..." if len(response) > 200 else response,
-                                    line=0,
-                                    file=snippet.file_path,
-                                    confidence=0.6
-                                )
-                            )
-
-                except Exception as e:
-                    file_path = getattr(snippet, "file_path", "unknown")
-                    errors.append(f"Error analyzing {file_path}: {str(e)}")
+            def analyze_batch(batch):
+                payload = format_snippet_batch(batch, static_findings, compress=True)
+                chain, rate_limiter = self._tier(batch)
+                response = rate_limiter.call(lambda: chain.invoke(payload),
+                                             tokens=estimate_tokens(payload["code"]))
+                vulnerabilities, retry = self._split_response(response, batch)
+                for snippet in retry:
+                    vulnerabilities.extend(analyze_batch([snippet]))
+                return vulnerabilities
 
+            batches = batch_snippets(pending, self.max_batch_tokens, self.long_snippet_tokens)
+            outcomes = map_bounded(analyze_batch, batches, self.max_concurrency)
+            for batch, outcome in zip(batches, outcomes):
+                if isinstance(outcome, Exception):
+                    file_paths = ", ".join(s.file_path for s in batch)
+                    errors.append(f"Error analyzing {file_paths}: {str(outcome)}")
+                else:
+                    results.extend(outcome)
+                    self._store_cache(batch, outcome, static_findings)
+
+            results.extend(copy_results(results, duplicates))
+            return self._build_response(context, results, errors, skipped)
+
+        except Exception as e:
             return AgentResponse(
-                success=len(errors) == 0,
-                results=results,
-                errors=errors,
-                metadata={
-                    "total_files": len(context.code_snippets),
-                    "issues_found": len(results)
-                }
+                success=False,
+                errors=[str(e)],
+                results=[],
+                metadata={}
             )
 
+    async def aanalyze(self, input, on_result=None) -> AgentResponse:
+        """Async variant of analyze() that streams the LLM output.
+
+        Up to ``max_concurrency`` batches are in flight at once. ``on_result``
+        is called with each Vulnerability as soon as it has been parsed,
+        before the rest of the response arrives.
+        """
+        try:
+            context = self._resolve_context(input)
+
+            static_findings = context.agent_memory.get("static_findings")
+            snippets, skipped = self._eligible(context.code_snippets, static_findings)
+            snippets, duplicates = dedupe_snippets(snippets)
+            results, pending = self._lookup_cache(snippets, static_findings)
+            if on_result:
+                for vulnerability in results:
+                    on_result(vulnerability)
+            errors = []
+
+            async def analyze_batch(batch):
+                vulnerabilities = []
+                async for vulnerability in self._astream_batch(batch, static_findings):
+                    vulnerabilities.append(vulnerability)
+                    if on_result:
+                        on_result(vulnerability)
+                return vulnerabilities
+
+            batches = batch_snippets(pending, self.max_batch_tokens, self.long_snippet_tokens)
+            outcomes = await gather_bounded(analyze_batch, batches, self.max_concurrency)
+            for batch, outcome in zip(batches, outcomes):
+                if isinstance(outcome, Exception):
+                    file_paths = ", ".join(s.file_path for s in batch)
+                    errors.append(f"Error analyzing {file_paths}: {str(outcome)}")
+                else:
+                    results.extend(outcome)
+                    self._store_cache(batch, outcome, static_findings)
+
+            copies = copy_results(results, duplicates)
+            if on_result:
+                for vulnerability in copies:
+                    on_result(vulnerability)
+            results.extend(copies)
+            return self._build_response(context, results, errors, skipped)
+
         except Exception as e:
             return AgentResponse(
                 success=False,
@@ -0,0 +1,109 @@
+import os
+import shutil
+import asyncio
+import logging
+from typing import Optional
+
+import orjson
+
+from .tools import gather_bounded
+
+logger = logging.getLogger(__name__)
+
+# flake8-bandit, bugbear and syntax errors; plain style rules are not a security prior
+RUFF_RULES = "S,B,E9"
+SCAN_TIMEOUT_SECONDS = 10
+# Snippets scanned at once; each runs a ruff and a bandit process
+SCAN_CONCURRENCY = os.cpu_count() or 4
+
+
+def is_scannable(snippet) -> bool:
+    return snippet.language.lower() == "python" or snippet.file_path.endswith(".py")
+
+
+async def _run(cmd: list, content: str) -> Optional[bytes]:
+    """Run a scanner with the snippet on stdin, returning stdout or None on failure."""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(content.encode()), SCAN_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return None
+    return stdout
+
+
+async def _ruff(snippet) -> Optional[list]:
+    stdout = await _run(
+        ["ruff", "check", "--isolated", f"--select={RUFF_RULES}", "--output-format=json",
+         "--stdin-filename", snippet.file_path, "-"],
+        snippet.content
+    )
+    if stdout is None:
+        return None
+    return [
+        {"tool": "ruff", "rule": item["code"], "line": item["location"]["row"], "message": item["message"]}
+        for item in orjson.loads(stdout)
+    ]
+
+
+async def _bandit(snippet) -> Optional[list]:
+    stdout = await _run(["bandit", "-f", "json", "-q", "-"], snippet.content)
+    if stdout is None:
+        return None
+    return [
+        {"tool": "bandit", "rule": item["test_id"], "line": item["line_number"], "message": item["issue_text"]}
+        for item in orjson.loads(stdout).get("results", [])
+    ]
+
+
+async def scan_snippet(snippet) -> Optional[list]:
+    """Return static findings for a snippet, or None when it could not be scanned."""
+    if not is_scannable(snippet):
+        return None
+
+    scanners = []
+    if shutil.which("ruff"):
+        scanners.append(_ruff(snippet))
+    if shutil.which("bandit"):
+        scanners.append(_bandit(snippet))
+    if not scanners:
+        return None
+
+    findings = []
+    for result in await asyncio.gather(*scanners, return_exceptions=True):
+        if result is None or isinstance(result, Exception):
+            # A scanner that failed proves nothing, so let the LLM look at it
+            if isinstance(result, Exception):
+                logger.warning("Static scan failed for %s: %s", snippet.file_path, result)
+            return None
+        findings.extend(result)
+    return sorted(findings, key=lambda f: f["line"])
+
+
+async def prefilter_snippets(snippets: list):
+    """Split snippets into (needs_llm, clean, findings_by_file) using ruff/bandit.
+
+    Snippets that could not be scanned (other languages, missing tools,
+    scanner errors) always need the LLM.
+    """
+    results = await gather_bounded(scan_snippet, snippets, max_concurrency=SCAN_CONCURRENCY)
+
+    needs_llm, clean, findings_by_file = [], [], {}
+    for snippet, findings in zip(snippets, results):
+        if isinstance(findings, Exception):
+            logger.warning("Static scan failed for %s: %s", snippet.file_path, findings)
+            needs_llm.append(snippet)
+            continue
+        if findings == []:
+            clean.append(snippet)
+            continue
+        needs_llm.append(snippet)
+        if findings:
+            findings_by_file[snippet.file_path] = findings
+    return needs_llm, clean, findings_by_file
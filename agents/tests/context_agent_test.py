@@ -3,14 +3,24 @@ import sys
 import time
 import tempfile
 import shutil
+import json
+import numpy as np
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+from huggingface_hub.errors import EntryNotFoundError
 from unittest.mock import Mock, patch, MagicMock
 from dotenv import load_dotenv
 
 # Add root to path so `agents` can be imported
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
+from agents.llm_cache import LRUDict
 from agents.models import AnalysisContext, CodeSnippet, Vulnerability, AgentResponse, WorkflowState
-from agents.context_agent import ContextAgent
+from agents.context_agent import (
+    ContextAgent, FP32_MODEL_FILE, ONNXEmbeddings, QUANTIZED_MODEL_FILE, WRITE_BATCH_SIZE,
+    _get_embedder
+)
 
 load_dotenv()
 
@@ -365,6 +375,249 @@ def test_memory_persistence():
         print("✓ Memory persistence operations completed")
 
 
+
+def test_embeddings_load_lazily_and_are_shared():
+    """Test the embedding model is only loaded on first use, once per process"""
+    print("\nTesting lazy embedding initialization...")
+
+    with patch('agents.context_agent.get_llm') as mock_get_llm, \
+         patch('agents.context_agent.ONNXEmbeddings') as mock_embeddings:
+
+        mock_get_llm.return_value = MockLLM()
+        mock_embeddings.return_value = MockEmbeddings()
+        _get_embedder.cache_clear()
+
+        first = ContextAgent(provider="gemini")
+        second = ContextAgent(provider="gemini")
+        mock_embeddings.assert_not_called()
+
+        assert first.embedding is second.embedding
+        mock_embeddings.assert_called_once_with(ContextAgent.embedding_model, device="cpu")
+
+        _get_embedder.cache_clear()
+
+        print("✓ Embedding model loaded lazily and shared")
+
+
+def test_history_reads_do_not_load_the_model():
+    """Test reading memory opens the vector store without loading embeddings"""
+    print("\nTesting history reads without the embedding model...")
+
+    with patch('agents.context_agent.get_llm') as mock_get_llm, \
+         patch('agents.context_agent._get_chroma_client') as mock_client, \
+         patch('agents.context_agent.ONNXEmbeddings') as mock_embeddings:
+
+        mock_get_llm.return_value = MockLLM()
+        mock_client.return_value = chromadb.EphemeralClient()
+        _get_embedder.cache_clear()
+
+        agent = ContextAgent(provider="gemini")
+        assert agent.load_history("pr-unseen") == []
+        mock_embeddings.assert_not_called()
+
+        mock_client.return_value.delete_collection("context_memory")
+        _get_embedder.cache_clear()
+
+        print("✓ History read without loading embeddings")
+
+
+def test_memory_writes_are_batched():
+    """Test memory records are buffered and written to the store in batches"""
+    print("\nTesting batched memory writes...")
+
+    with patch('agents.context_agent.get_llm') as mock_get_llm:
+        mock_get_llm.return_value = MockLLM()
+        agent = ContextAgent(provider="gemini")
+        agent.vector_store = Mock()
+
+        for i in range(WRITE_BATCH_SIZE - 1):
+            agent._queue_write(f"pr-{i}", "[]")
+        agent.vector_store.add_texts.assert_not_called()
+
+        agent._queue_write("pr-last", "[]")
+        agent.vector_store.add_texts.assert_called_once()
+        texts = agent.vector_store.add_texts.call_args[0][0]
+        assert len(texts) == WRITE_BATCH_SIZE
+
+        agent._queue_write("pr-extra", "[]")
+        agent.flush()
+        assert agent.vector_store.add_texts.call_count == 2
+        assert agent.vector_store.add_texts.call_args[1]["metadatas"][0]["context_key"] == "pr-extra"
+
+        print("✓ Memory writes batched")
+
+
+class FakeTokenizer:
+    """Whitespace tokenizer that pads with id 0 like a HF tokenizer."""
+    def __call__(self, texts, padding=True, truncation=True, return_tensors="np"):
+        ids = [[len(word) for word in text.split()] for text in texts]
+        width = max(len(row) for row in ids)
+        return {
+            "input_ids": np.array([row + [0] * (width - len(row)) for row in ids]),
+            "attention_mask": np.array([[1] * len(row) + [0] * (width - len(row)) for row in ids])
+        }
+
+
+class FakeSession:
+    """Returns each token id as a 2-d token embedding, counting forward passes."""
+    def __init__(self):
+        self.runs = 0
+
+    def run(self, output_names, inputs):
+        self.runs += 1
+        ids = inputs["input_ids"].astype(np.float32)
+        return [np.stack([ids, ids + 100 * (ids == 0)], axis=-1)]
+
+
+def create_fake_embeddings(batch_size=32):
+    embeddings = ONNXEmbeddings.__new__(ONNXEmbeddings)
+    embeddings.batch_size = batch_size
+    embeddings.tokenizer = FakeTokenizer()
+    embeddings.session = FakeSession()
+    embeddings.input_names = ["input_ids", "attention_mask"]
+    embeddings.output_names = ["last_hidden_state"]
+    embeddings.dim = None
+    embeddings._cache = LRUDict()
+    return embeddings
+
+
+def test_embed_documents_batches_forward_passes():
+    """Test documents are embedded batch_size at a time, ignoring padding"""
+    print("\nTesting batched embeddings...")
+
+    embeddings = create_fake_embeddings(batch_size=32)
+    texts = [f"text number {i}" for i in range(70)] + ["a much longer piece of text"]
+
+    vectors = embeddings.embed_documents(texts)
+
+    assert len(vectors) == 71
+    assert embeddings.session.runs == 3
+    # Padding in a batch must not change a text's embedding
+    assert np.allclose(vectors[0], embeddings.embed_query(texts[0]))
+    # Length-sorted batching must still return vectors in input order
+    assert np.allclose(vectors[-1], embeddings.embed_query(texts[-1]))
+    # Sentence embeddings are unit length
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+
+    print("✓ Embeddings computed in batches")
+
+
+def test_repeated_texts_skip_the_model():
+    """Test embeddings are cached by content so repeats skip the forward pass"""
+    embeddings = create_fake_embeddings()
+    first = embeddings.embed_documents(["same text", "other text"])
+    runs = embeddings.session.runs
+
+    second = embeddings.embed_documents(["other text", "same text"])
+
+    assert embeddings.session.runs == runs
+    assert second == [first[1], first[0]]
+    embeddings.embed_query("new text")
+    assert embeddings.session.runs == runs + 1
+
+
+def test_embeddings_truncate_to_matryoshka_dim():
+    """Test dim keeps the leading components and re-normalizes"""
+    full = create_fake_embeddings().embed_query("ab cde")
+    embeddings = create_fake_embeddings()
+    embeddings.dim = 1
+
+    truncated = embeddings.embed_query("ab cde")
+
+    assert len(full) == 2 and len(truncated) == 1
+    assert np.allclose(truncated, [1.0])
+
+
+def test_download_prefers_quantized_model():
+    """Test the INT8 export is used when published, with FP32 as the fallback"""
+    print("\nTesting quantized model download...")
+
+    embeddings = ONNXEmbeddings.__new__(ONNXEmbeddings)
+    embeddings.model_repo = "sentence-transformers/all-MiniLM-L6-v2"
+
+    with patch('agents.context_agent.hf_hub_download') as mock_download:
+        mock_download.side_effect = lambda **kwargs: kwargs["filename"]
+        assert embeddings._download_model() == QUANTIZED_MODEL_FILE
+        assert embeddings._download_model(quantized=False) == FP32_MODEL_FILE
+
+        def no_quantized_export(**kwargs):
+            if kwargs["filename"] == QUANTIZED_MODEL_FILE:
+                raise EntryNotFoundError("404")
+            return kwargs["filename"]
+
+        mock_download.side_effect = no_quantized_export
+        assert embeddings._download_model() == FP32_MODEL_FILE
+
+    print("✓ Quantized model preferred with FP32 fallback")
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic embeddings so a real Chroma collection can be used offline."""
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), float(sum(map(ord, text)) % 97), 1.0]
+
+
+def test_severity_history_round_trip():
+    """Test update_severity reads back the history it saved"""
+    print("\nTesting severity history round-trip...")
+
+    with patch('agents.context_agent.get_llm') as mock_get_llm:
+        mock_get_llm.return_value = MockLLM()
+        agent = ContextAgent(provider="gemini")
+        agent.persist_dir = tempfile.mkdtemp()
+        agent.vector_store = Chroma(
+            client=chromadb.EphemeralClient(),
+            collection_name=f"round_trip_{time.time_ns()}",
+            embedding_function=HashEmbeddings()
+        )
+
+        try:
+            agent._queue_write("pr-1", json.dumps([{"issues": [{"id": "sql-1", "severity": 2}]}]))
+            agent._queue_write("pr-2", json.dumps([{"issues": [{"id": "xss-1", "severity": 2}]}]))
+            assert agent.load_history("pr-1")[0]["issues"][0]["severity"] == 2
+
+            agent.flush()
+            agent.update_severity("pr-1", ["sql-1"], severity_adjust=1)
+            assert agent.load_history("pr-1")[0]["issues"][0]["severity"] == 3
+
+            agent.flush()
+            history = agent.load_history("pr-1")
+            assert history != []
+            assert history[0]["issues"][0]["severity"] == 3
+            assert agent.load_history("pr-2")[0]["issues"][0]["id"] == "xss-1"
+            assert agent.load_history("pr-unknown") == []
+        finally:
+            shutil.rmtree(agent.persist_dir)
+
+        print("✓ Severity history survives a save round-trip")
+
+
+def test_commit_history_counts_large_history():
+    """Test keyword counts over a large history, including commits without messages"""
+    print("\nTesting large commit history analysis...")
+
+    messages = [
+        "fix: security vulnerability in authentication",
+        "feat: add new user dashboard",
+        "Fix: Bug in password validation",
+        "feature: implement OAuth integration",
+        "chore: bump dependencies"
+    ]
+    history = [{"message": messages[i % len(messages)]} for i in range(505)]
+    history.append({})
+
+    agent = ContextAgent.__new__(ContextAgent)
+    result = agent._analyze_commit_history(history)
+
+    assert "security_fixes: 101 occurrences" in result
+    assert "bug_fixes: 101 occurrences" in result
+    assert "features: 202 occurrences" in result
+
+    print("✓ Large history counts correct")
+
 def run_performance_test():
     """Run performance test for context enrichment"""
     print("\nRunning performance test...")
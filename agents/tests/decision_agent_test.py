@@ -8,8 +8,8 @@ from dotenv import load_dotenv
 # Add root to path so `agents` can be imported
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
-from agents.models import AnalysisContext, CodeSnippet, Vulnerability, WorkflowState
-from agents.decision_agent import DecisionAgent
+from agents.models import AnalysisContext, CodeSnippet, Severity, Vulnerability, WorkflowState
+from agents.decision_agent import DECISION_TABLE, DecisionAgent
 
 load_dotenv()
 
@@ -342,6 +342,35 @@ def test_block_decision_too_many_high():
         print(f"✓ Summary: {result_state.decision['summary']}")
 
 
+def test_decision_table_covers_every_case():
+    """Test the decision policy table has an entry for every severity combination"""
+    assert set(DECISION_TABLE) == {(c, h) for c in (True, False) for h in (True, False)}
+    assert DECISION_TABLE[(True, False)].decision == "BLOCK"
+    assert DECISION_TABLE[(False, True)].decision == "REQUEST_CHANGES"
+    assert DECISION_TABLE[(False, False)].decision == "APPROVE"
+
+
+def test_severity_normalizes_llm_values():
+    """Test severities from LLM output normalize to enum members that still equal plain strings"""
+    def vuln(severity):
+        return Vulnerability(type="t", severity=severity, description="d", line=1, file="f.py")
+
+    assert vuln("CRITICAL").severity is Severity.CRITICAL
+    assert vuln(" High ").severity == "high"
+    assert vuln("moderate").severity is Severity.MEDIUM
+    assert vuln("high").severity.level > vuln("low").severity.level
+    assert vuln("high").model_dump(mode="json")["severity"] == "high"
+    assert f"{vuln('low').severity}" == "low"
+
+
+def test_unknown_severity_falls_back_to_medium():
+    """Test a finding with an unrecognised severity is kept as medium instead of failing validation"""
+    vuln = Vulnerability(type="t", severity="warning", description="d", line=1, file="f.py")
+
+    assert vuln.severity is Severity.MEDIUM
+    assert Severity("Unknown") is Severity.MEDIUM
+
+
 def test_decision_error_handling():
     """Test error handling in decision making"""
     print("\nTesting error handling in decision making...")
@@ -443,6 +472,17 @@ def test_parse_response_no_json():
         print("✓ Non-JSON response fallback works correctly")
 
 
+def test_parse_response_unfenced_json_with_prose():
+    """Test JSON surrounded by prose is found without a code fence"""
+    with patch('agents.decision_agent.get_llm') as mock_get_llm:
+        mock_get_llm.return_value = MockLLM()
+        agent = DecisionAgent(provider="gemini")
+
+        result = agent._parse_response('Here is my decision: {"decision": "APPROVE", "summary": "ok"} Thanks!')
+
+        assert result == {"decision": "APPROVE", "summary": "ok"}
+
+
 def test_decision_with_different_providers():
     """Test decision agent with different providers"""
     print("\nTesting different providers...")
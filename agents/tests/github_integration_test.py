@@ -0,0 +1,597 @@
+import os
+import sys
+import asyncio
+import json
+import re
+import threading
+from datetime import datetime, timedelta
+import time
+from unittest.mock import MagicMock, patch
+
+import httpx
+import pytest
+from github import GithubException
+
+# Add root to path so `agents` can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from agents.github_integration import (
+    CONDITIONAL_CACHE, FILE_CONTENT_CACHE, REPOSITORY_INFO_CACHE, GitHubIntegration, RateLimitedTransport,
+    _get_client
+)
+from agents.models import AnalysisContext, CodeSnippet
+from agents.tools import generate_patch
+
+
+def create_integration(repo):
+    """GitHubIntegration wired to a mock repository, without touching the network."""
+    FILE_CONTENT_CACHE.clear()
+    REPOSITORY_INFO_CACHE.clear()
+    CONDITIONAL_CACHE.clear()
+    integration = GitHubIntegration.__new__(GitHubIntegration)
+    integration.token = "test-token"
+    integration.client = MagicMock()
+    integration.client.get_repo.return_value = repo
+    integration._async_client = None
+    return integration
+
+
+def create_repo(files):
+    repo = MagicMock()
+    repo.get_git_ref.return_value.object.sha = "base-sha"
+    repo.get_git_commit.return_value.tree.sha = "root-tree"
+    trees = {
+        "root-tree": [
+            MagicMock(path="scripts", mode="040000", type="tree", sha="scripts-tree"),
+            MagicMock(path="app.py", mode="100644", type="blob", sha="app-blob")
+        ],
+        "scripts-tree": [MagicMock(path="run.sh", mode="100755", type="blob", sha="run-blob")]
+    }
+    repo.get_git_tree.side_effect = lambda sha, recursive=False: MagicMock(tree=trees[sha])
+    repo.create_git_commit.return_value.sha = "new-commit-sha"
+
+    def get_contents(path, ref=None):
+        if path not in files:
+            raise GithubException(404, {"message": "Not Found"}, None)
+        return MagicMock(decoded_content=files[path].encode())
+
+    repo.get_contents.side_effect = get_contents
+    return repo
+
+
+def test_commit_patches_makes_a_single_commit():
+    """Test all patched files land in one tree and one commit"""
+    repo = create_repo({"app.py": "a = 1\nb = 2", "scripts/run.sh": "echo hi"})
+    integration = create_integration(repo)
+
+    patches = [
+        {"file": "app.py", "patch": "@@ -1,2 +1,2 @@\n-a = 1\n+a = 3\n b = 2", "fix_description": "Fix a"},
+        {"file": "scripts/run.sh", "content": "echo fixed", "fix_description": "Fix script"},
+        {"file": "new.py", "content": "print('new')"}
+    ]
+    assert integration.commit_patches("owner/repo", "fixes", patches)
+
+    repo.update_file.assert_not_called()
+    repo.create_file.assert_not_called()
+    repo.create_git_tree.assert_called_once()
+    # _identity is the JSON PyGithub sends for each tree entry
+    elements = [e._identity for e in repo.create_git_tree.call_args[0][0]]
+    assert [e["path"] for e in elements] == ["app.py", "scripts/run.sh", "new.py"]
+    assert [e["mode"] for e in elements] == ["100644", "100755", "100644"]
+    # Only the directories on the patched paths are listed, never the whole tree recursively
+    assert [c.args for c in repo.get_git_tree.call_args_list] == [("root-tree",), ("scripts-tree",)]
+    assert elements[0]["content"] == "a = 3\nb = 2"
+
+    message = repo.create_git_commit.call_args[0][0]
+    assert message.startswith("Apply 3 patches")
+    repo.get_git_ref.return_value.edit.assert_called_once_with("new-commit-sha")
+
+
+def test_commit_patches_fails_without_committing_on_read_error():
+    """Test a failed file read aborts before anything is written"""
+    repo = create_repo({})
+    repo.get_contents.side_effect = GithubException(500, {"message": "Server Error"}, None)
+    integration = create_integration(repo)
+
+    assert not integration.commit_patches("owner/repo", "fixes", [{"file": "app.py", "patch": "@@ -1 +1 @@"}])
+    repo.create_git_commit.assert_not_called()
+
+
+def test_get_file_contents_fetches_concurrently():
+    """Test file reads overlap instead of running one after another"""
+    repo = create_repo({"a.py": "a", "b.py": "b", "c.py": "c"})
+    read = repo.get_contents.side_effect
+    # Every read waits until all three are in flight, so a serial loop would time out
+    barrier = threading.Barrier(3, timeout=5)
+
+    def concurrent_read(path, ref=None):
+        barrier.wait()
+        return read(path, ref=ref)
+
+    repo.get_contents.side_effect = concurrent_read
+    integration = create_integration(repo)
+
+    contents = integration.get_file_contents("owner/repo", ["c.py", "a.py", "b.py"], "head")
+
+    assert contents == {"c.py": "c", "a.py": "a", "b.py": "b"}
+    assert list(contents) == ["c.py", "a.py", "b.py"]
+
+
+def test_file_reads_are_cached_and_written_through():
+    """Test repeated reads skip the API and a commit refreshes the cached branch content"""
+    repo = create_repo({"app.py": "a = 1\nb = 2"})
+    integration = create_integration(repo)
+
+    assert integration.get_file_content("owner/repo", "app.py", "fixes") == "a = 1\nb = 2"
+    assert integration.get_file_content("owner/repo", "app.py", "fixes") == "a = 1\nb = 2"
+    assert integration.get_file_content("owner/repo", "missing.py", "fixes") is None
+    assert integration.get_file_content("owner/repo", "missing.py", "fixes") is None
+    assert repo.get_contents.call_count == 3
+
+    patch = {"file": "app.py", "patch": "@@ -1,2 +1,2 @@\n-a = 1\n+a = 3\n b = 2"}
+    assert integration.commit_patches("owner/repo", "fixes", [patch])
+    reads = repo.get_contents.call_count
+    assert integration.get_file_content("owner/repo", "app.py", "fixes") == "a = 3\nb = 2"
+    assert repo.get_contents.call_count == reads
+
+
+def test_get_pr_details_fetches_pages_concurrently():
+    """Test file and commit pages are requested together rather than one after another"""
+    repo = MagicMock()
+    pr = repo.get_pull.return_value
+    pr.changed_files, pr.commits = 350, 30
+    pr.requested_reviewers = pr.assignees = pr.labels = []
+    files = [MagicMock(filename=f"f{i}.py") for i in range(350)]
+    pr.get_files.return_value.get_page.side_effect = lambda page: files[page * 100:(page + 1) * 100]
+    pr.get_commits.return_value.get_page.side_effect = lambda page: [MagicMock(sha=f"c{i}") for i in range(30)]
+    pr.get_reviews.return_value = [MagicMock(id=1)]
+    integration = create_integration(repo)
+    integration.rate_limit_remaining = integration.rate_limit_reset = None
+
+    with patch.object(integration, "_parallel", wraps=integration._parallel) as parallel:
+        details = integration.get_pr_details("owner/repo", 7)
+
+    assert len(parallel.call_args[0]) == 6
+    assert [f["filename"] for f in details["files"]] == [f"f{i}.py" for i in range(350)]
+    assert len(details["commits_data"]) == 30
+    assert [r["id"] for r in details["reviews"]] == [1]
+    repo.compare.assert_not_called()
+
+
+def test_get_pr_details_reads_files_from_one_compare():
+    """Test PRs within the compare cap get their files from a single compare request"""
+    repo = MagicMock()
+    pr = repo.get_pull.return_value
+    pr.changed_files, pr.commits = 250, 1
+    pr.base.sha, pr.head.sha = "base", "head"
+    pr.requested_reviewers = pr.assignees = pr.labels = []
+    repo.compare.return_value.files = [MagicMock(filename=f"f{i}.py") for i in range(250)]
+    pr.get_commits.return_value.get_page.return_value = [MagicMock(sha="c1")]
+    pr.get_reviews.return_value = []
+    integration = create_integration(repo)
+    integration.rate_limit_remaining = integration.rate_limit_reset = None
+
+    details = integration.get_pr_details("owner/repo", 7)
+
+    assert len(details["files"]) == 250
+    repo.compare.assert_called_once_with("base", "head")
+    pr.get_files.return_value.get_page.assert_not_called()
+
+    # A compare that disagrees with the PR falls back to the PR's own file list
+    CONDITIONAL_CACHE.clear()
+    repo.compare.return_value.files = []
+    pr.get_files.return_value.get_page.side_effect = lambda page: [MagicMock(filename="x.py")] * min(100, 250 - page * 100)
+    assert len(integration.get_pr_details("owner/repo", 7)["files"]) == 250
+
+
+def test_get_pr_comments_merges_both_kinds_in_time_order():
+    """Test issue and review comment pages are fetched together and interleaved by creation time"""
+    repo = MagicMock()
+    pr = repo.get_pull.return_value
+    pr.comments, pr.review_comments = 2, 150
+    issue = [MagicMock(id=i, created_at=datetime(2024, 1, 1, 0, i * 30)) for i in range(2)]
+    review = [MagicMock(id=100 + i, created_at=datetime(2024, 1, 1, 0, 0, i % 60) + timedelta(minutes=i // 60 * 30))
+              for i in range(150)]
+    pr.get_issue_comments.return_value.get_page.side_effect = lambda page: issue[page * 100:(page + 1) * 100]
+    pr.get_review_comments.return_value.get_page.side_effect = lambda page: review[page * 100:(page + 1) * 100]
+    integration = create_integration(repo)
+
+    comments = integration.get_pr_comments("owner/repo", 7)
+
+    assert len(comments) == 152
+    assert [c["created_at"] for c in comments] == sorted(c["created_at"] for c in comments)
+    # The second issue comment (00:30) follows the 60 review comments from 00:00
+    assert [c["type"] for c in comments].index("issue_comment", 1) == 61
+
+
+def test_expired_reads_revalidate_with_conditional_requests():
+    """Test reads past the TTL revalidate the earlier object instead of fetching it again"""
+    repo = MagicMock()
+    file = repo.get_contents.return_value
+    file.decoded_content = b"a = 1"
+    pr = repo.get_pull.return_value
+    pr.changed_files = pr.commits = 0
+    pr.requested_reviewers = pr.assignees = pr.labels = []
+    integration = create_integration(repo)
+    integration.rate_limit_remaining = integration.rate_limit_reset = None
+
+    assert integration.get_file_content("owner/repo", "app.py") == "a = 1"
+    first = integration.get_pr_details("owner/repo", 7)
+    FILE_CONTENT_CACHE.clear()
+    # update() returning False is PyGithub's report of a 304 Not Modified
+    file.update.return_value = pr.update.return_value = False
+
+    assert integration.get_file_content("owner/repo", "app.py") == "a = 1"
+    assert integration.get_pr_details("owner/repo", 7) is first
+    repo.get_contents.assert_called_once()
+    repo.get_pull.assert_called_once()
+    file.update.assert_called_once()
+    pr.get_reviews.assert_called_once()
+
+
+def test_analyze_pr_changes_reads_only_files():
+    """Test the change analysis skips the commit and review listings"""
+    repo = MagicMock()
+    pr = repo.get_pull.return_value
+    pr.changed_files, pr.additions, pr.deletions, pr.commits = 3, 701, 10, 3
+    pr.get_files.return_value = [
+        MagicMock(filename="app.py", status="modified", additions=600, deletions=5, changes=605),
+        MagicMock(filename="old.js", status="removed", additions=0, deletions=5, changes=5),
+        MagicMock(filename="tools.v2/Makefile", status="modified", additions=1, deletions=0, changes=1)
+    ]
+    integration = create_integration(repo)
+
+    analysis = integration.analyze_pr_changes("owner/repo", 7)
+
+    assert analysis["files_by_type"]["py"] == {"count": 1, "additions": 600, "deletions": 5}
+    assert list(analysis["files_by_type"]) == ["py", "js", "no_extension"]
+    assert analysis["large_files"] == [{"filename": "app.py", "changes": 605}]
+    assert len(analysis["potential_issues"]) == 2
+    pr.get_commits.assert_not_called()
+    pr.get_reviews.assert_not_called()
+
+
+def test_blocking_calls_can_be_gathered():
+    """Test the async wrappers of PyGithub calls run concurrently off the event loop"""
+    repo = MagicMock()
+    barrier = threading.Barrier(3, timeout=5)
+    repo.create_git_ref.side_effect = lambda **kwargs: barrier.wait()
+    integration = create_integration(repo)
+
+    async def run():
+        return await asyncio.gather(*(
+            integration.acreate_branch("owner/repo", "main", f"fix-{i}") for i in range(3)
+        ))
+
+    assert asyncio.run(run()) == [True, True, True]
+
+
+def test_async_methods_share_one_client_and_use_graphql():
+    """Test the async path reads a PR with one GraphQL request and writes over the same client"""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.url.path == "/graphql":
+            return httpx.Response(200, json={"data": {"repository": {"pullRequest": {
+                "title": "Fix auth", "state": "OPEN", "author": {"login": "dev"},
+                "baseRefName": "main", "headRefName": "fix", "baseRefOid": "b1", "headRefOid": "h1",
+                "files": {"nodes": [
+                    {"path": "app.py", "additions": 3, "deletions": 1, "changeType": "MODIFIED"},
+                    {"path": "old.py", "additions": 0, "deletions": 9, "changeType": "DELETED"}
+                ]},
+                "reviews": {"nodes": []},
+                "comments": {"nodes": [{"author": None, "body": "hi", "createdAt": "2024-01-01T00:00:00Z"}]}
+            }}}})
+        return httpx.Response(201, json={})
+
+    integration = create_integration(MagicMock())
+    integration._async_client = httpx.AsyncClient(
+        base_url="https://api.github.com", transport=httpx.MockTransport(handler)
+    )
+
+    async def run():
+        overview = await integration.aget_pr_overview("owner/repo", 7)
+        commented = await integration.apost_comment("owner/repo", 7, "Found issues")
+        blocked = await integration.ablock_merge("owner/repo", 7, "Critical issue")
+        await integration.aclose()
+        return overview, commented, blocked
+
+    overview, commented, blocked = asyncio.run(run())
+
+    assert commented and blocked
+    assert [f["status"] for f in overview["files"]] == ["modified", "removed"]
+    assert overview["files"][0]["changes"] == 4
+    assert overview["comments"][0]["author"] is None
+    assert [r.url.path for r in requests] == [
+        "/graphql", "/repos/owner/repo/issues/7/comments", "/repos/owner/repo/pulls/7/reviews"
+    ]
+    assert integration._async_client is None
+
+
+def test_integrations_share_a_client_per_token():
+    """Test per-request integrations reuse one PyGithub client and its connections"""
+    _get_client.cache_clear()
+    with patch('agents.github_integration.Github') as mock_github:
+        mock_github.side_effect = lambda **kwargs: MagicMock()
+
+        first = GitHubIntegration("token-a")
+        second = GitHubIntegration("token-a")
+        other = GitHubIntegration("token-b")
+
+        assert first.client is second.client
+        assert other.client is not first.client
+        assert mock_github.call_count == 2
+        assert mock_github.call_args.kwargs["per_page"] == 100
+    _get_client.cache_clear()
+
+
+def test_repository_handles_are_lazy():
+    """Test methods don't spend a GET on the repository before their real request"""
+    repo = create_repo({"app.py": "a = 1"})
+    integration = create_integration(repo)
+
+    integration.get_file_content("owner/repo", "app.py")
+    integration.create_branch("owner/repo", "main", "fixes")
+
+    assert integration.client.get_repo.call_args_list == [(("owner/repo",), {"lazy": True})] * 2
+
+
+def test_get_pr_diff_reuses_the_shared_http_client():
+    """Test sync diff reads go through one keep-alive client per token"""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, text="diff --git a/app.py b/app.py")
+
+    client = httpx.Client(base_url="https://api.github.com", transport=httpx.MockTransport(handler))
+    with patch('agents.github_integration._get_http_client', return_value=client) as get_http_client:
+        first = create_integration(MagicMock()).get_pr_diff("o/r", 7)
+        second = create_integration(MagicMock()).get_pr_diff("o/r", 8)
+
+    assert first == second == "diff --git a/app.py b/app.py"
+    assert [r.url.path for r in requests] == ["/repos/o/r/pulls/7", "/repos/o/r/pulls/8"]
+    assert requests[0].headers["Accept"] == "application/vnd.github.diff"
+    get_http_client.assert_called_with("test-token")
+
+
+def test_apply_patch_multiple_hunks():
+    """Test hunks that replace, insert and delete lines all land at their original positions"""
+    integration = create_integration(MagicMock())
+    original = "\n".join(f"line {i}" for i in range(1, 21)) + "\n"
+    patch = (
+        "@@ -2,3 +2,3 @@\n line 2\n-line 3\n+LINE 3\n line 4\n"
+        "@@ -10,0 +11,2 @@\n+new a\n+new b\n"
+        "@@ -18,3 +20,2 @@\n line 18\n-line 19\n line 20"
+    )
+
+    lines = integration._apply_patch(original, patch).split("\n")
+
+    assert lines[:4] == ["line 1", "line 2", "LINE 3", "line 4"]
+    assert lines[9:13] == ["line 10", "new a", "new b", "line 11"]
+    assert lines[-3:] == ["line 18", "line 20", ""]
+    with pytest.raises(ValueError):
+        integration._apply_patch("keep", "not a diff")
+
+
+def test_apply_patch_accepts_generate_patch_output():
+    """Test a patch with its own ---/+++ headers, as generate_patch builds it, changes the file"""
+    integration = create_integration(MagicMock())
+    original = "import os\n\nAPI_KEY = 'sk-live-123'\nprint(API_KEY)\n"
+    context = AnalysisContext(code_snippets=[CodeSnippet(file_path="config.py", content=original, language="python")])
+
+    fix = generate_patch({"type": "Hardcoded Secret", "file": "config.py", "line": 3}, context)
+
+    assert integration._apply_patch(original, fix["patch"]) == (
+        "import os\n\nAPI_KEY = 'os.getenv('SECRET_KEY')'\nprint(API_KEY)\n"
+    )
+
+
+def graphql_page(nodes, cursor=None):
+    return {"totalCount": len(nodes), "pageInfo": {"hasNextPage": cursor is not None, "endCursor": cursor},
+            "nodes": nodes}
+
+
+def test_aget_pr_details_follows_page_cursors():
+    """Test async PR details come from one query plus follow-ups only for connections with more pages"""
+    queries = []
+    file_node = lambda path: {"path": path, "additions": 1, "deletions": 0, "changeType": "ADDED"}
+    commit_node = {"commit": {"oid": "c1", "message": "fix: bug", "url": "https://github.com/o/r/commit/c1",
+                              "author": {"name": "Dev", "date": "2024-01-02T03:04:05Z"}}}
+
+    def handler(request):
+        body = json.loads(request.content)
+        queries.append(body)
+        if "after" in body["variables"]:
+            page = graphql_page([file_node("b.py")])
+            return httpx.Response(200, json={"data": {"repository": {"pullRequest": {"files": page}}}})
+        return httpx.Response(200, json={"data": {"repository": {"pullRequest": {
+            "databaseId": 1, "number": 7, "title": "T", "body": "B", "state": "OPEN",
+            "url": "https://github.com/o/r/pull/7",
+            "createdAt": "2024-01-01T00:00:00Z", "updatedAt": "2024-01-01T00:00:00Z",
+            "closedAt": None, "mergedAt": None, "merged": False, "mergeCommit": None,
+            "author": {"login": "dev"}, "assignees": {"nodes": []},
+            "reviewRequests": {"nodes": [{"requestedReviewer": {"login": "lead"}}, {"requestedReviewer": {}}]},
+            "labels": {"nodes": [{"name": "security"}]}, "milestone": None,
+            "baseRefName": "main", "headRefName": "fix", "baseRefOid": "b1", "headRefOid": "h1",
+            "mergeable": "MERGEABLE", "mergeStateStatus": "CLEAN", "comments": {"totalCount": 2},
+            "additions": 2, "deletions": 0, "changedFiles": 2,
+            "files": graphql_page([file_node("a.py")], cursor="files-1"),
+            "commits": graphql_page([commit_node]),
+            "reviews": graphql_page([{"databaseId": 5, "author": None, "state": "COMMENTED", "body": "",
+                                      "submittedAt": "2024-01-01T00:00:00Z", "comments": {"totalCount": 3}}])
+        }}}})
+
+    integration = create_integration(MagicMock())
+    integration._async_client = httpx.AsyncClient(
+        base_url="https://api.github.com", transport=httpx.MockTransport(handler)
+    )
+
+    details = asyncio.run(integration.aget_pr_details("o/r", 7))
+
+    assert len(queries) == 2
+    assert queries[1]["variables"]["after"] == "files-1"
+    assert [f["filename"] for f in details["files"]] == ["a.py", "b.py"]
+    assert details["commits_data"][0]["date"].year == 2024
+    assert details["reviewers"] == ["lead"]
+    assert details["review_comments"] == 3
+    assert details["mergeable"] is True and details["state"] == "open"
+
+
+def test_aget_many_pr_details_batches_aliases():
+    """Test many PRs are read with one aliased query per MAX_PRS_PER_QUERY, keeping order"""
+    queries = []
+
+    def pr_node(number):
+        return {
+            "databaseId": number, "number": number, "title": f"PR {number}", "body": "", "state": "OPEN",
+            "url": f"https://github.com/o/r/pull/{number}",
+            "createdAt": "2024-01-01T00:00:00Z", "updatedAt": "2024-01-01T00:00:00Z",
+            "closedAt": None, "mergedAt": None, "merged": False, "mergeCommit": None,
+            "author": {"login": "dev"}, "assignees": {"nodes": []}, "reviewRequests": {"nodes": []},
+            "labels": {"nodes": []}, "milestone": None,
+            "baseRefName": "main", "headRefName": "fix", "baseRefOid": "b1", "headRefOid": "h1",
+            "mergeable": "UNKNOWN", "mergeStateStatus": "UNKNOWN", "comments": {"totalCount": 0},
+            "additions": 0, "deletions": 0, "changedFiles": 0,
+            "files": graphql_page([]), "commits": graphql_page([]), "reviews": graphql_page([])
+        }
+
+    def handler(request):
+        query = json.loads(request.content)["query"]
+        queries.append(query)
+        numbers = [int(n) for n in re.findall(r"pullRequest\(number: (\d+)\)", query)]
+        repository = {f"pr{i}": None if n == 404 else pr_node(n) for i, n in enumerate(numbers)}
+        errors = [{"type": "NOT_FOUND"}] if 404 in numbers else None
+        return httpx.Response(200, json={"data": {"repository": repository}, "errors": errors})
+
+    integration = create_integration(MagicMock())
+    integration._async_client = httpx.AsyncClient(
+        base_url="https://api.github.com", transport=httpx.MockTransport(handler)
+    )
+    pr_ids = list(range(1, 61)) + [404]
+
+    details = asyncio.run(integration.aget_many_pr_details("o/r", pr_ids))
+
+    assert len(queries) == 2
+    assert [d["number"] for d in details[:-1]] == pr_ids[:-1]
+    assert details[-1] is None
+
+
+def test_aget_many_pr_details_handles_missing_repository():
+    """Test a partial response with a null repository yields None for every PR instead of raising"""
+    def handler(request):
+        return httpx.Response(200, json={"data": {"repository": None}, "errors": [{"type": "NOT_FOUND"}]})
+
+    integration = create_integration(MagicMock())
+    integration._async_client = httpx.AsyncClient(
+        base_url="https://api.github.com", transport=httpx.MockTransport(handler)
+    )
+
+    assert asyncio.run(integration.aget_many_pr_details("o/gone", [1, 2])) == [None, None]
+
+
+def test_acommit_patches_writes_one_tree_and_commit():
+    """Test the async commit path reads files concurrently and writes a single commit"""
+    requests = []
+    files = {"app.py": "a = 1\nb = 2"}
+
+    def handler(request):
+        requests.append((request.method, request.url.path))
+        path = request.url.path
+        if path.endswith("/git/ref/heads/fixes"):
+            return httpx.Response(200, json={"object": {"sha": "base-sha"}})
+        if path.endswith("/git/commits/base-sha"):
+            return httpx.Response(200, json={"tree": {"sha": "base-tree"}})
+        if path.endswith("/git/trees/base-tree"):
+            return httpx.Response(200, json={"tree": [{"path": "app.py", "mode": "100755", "type": "blob"}]})
+        if "/contents/" in path:
+            name = path.split("/contents/", 1)[1]
+            return httpx.Response(200, text=files[name]) if name in files else httpx.Response(404)
+        if path.endswith("/git/trees"):
+            body = json.loads(request.content)
+            assert body["base_tree"] == "base-tree"
+            assert body["tree"] == [
+                {"path": "app.py", "mode": "100755", "type": "blob", "content": "a = 3\nb = 2"},
+                {"path": "new.py", "mode": "100644", "type": "blob", "content": "x = 1"}
+            ]
+            return httpx.Response(201, json={"sha": "new-tree"})
+        if path.endswith("/git/commits"):
+            assert json.loads(request.content)["parents"] == ["base-sha"]
+            return httpx.Response(201, json={"sha": "new-commit"})
+        if path.endswith("/git/refs/heads/fixes"):
+            assert json.loads(request.content) == {"sha": "new-commit"}
+            return httpx.Response(200, json={})
+        return httpx.Response(500)
+
+    integration = create_integration(MagicMock())
+    integration._async_client = httpx.AsyncClient(
+        base_url="https://api.github.com", transport=httpx.MockTransport(handler)
+    )
+    patches = [
+        {"file": "app.py", "patch": "@@ -1,2 +1,2 @@\n-a = 1\n+a = 3\n b = 2"},
+        {"file": "new.py", "content": "x = 1"}
+    ]
+
+    assert asyncio.run(integration.acommit_patches("o/r", "fixes", patches))
+    writes = [r for r in requests if r[0] != "GET"]
+    assert [method for method, _ in writes] == ["POST", "POST", "PATCH"]
+
+
+def test_astream_pr_diff_yields_chunks():
+    """Test the diff streams from the pulls endpoint in bounded chunks"""
+    diff = b"diff --git a/app.py b/app.py\n" + b"+x\n" * 50000
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.url.path.endswith("/pulls/404"):
+            return httpx.Response(404)
+        return httpx.Response(200, content=diff)
+
+    integration = create_integration(MagicMock())
+    integration._async_client = httpx.AsyncClient(
+        base_url="https://api.github.com", transport=httpx.MockTransport(handler)
+    )
+
+    async def run():
+        chunks = [chunk async for chunk in integration.astream_pr_diff("o/r", 7)]
+        return chunks, await integration.aget_pr_diff("o/r", 7), await integration.aget_pr_diff("o/r", 404)
+
+    chunks, text, missing = asyncio.run(run())
+
+    assert len(chunks) > 1 and max(map(len, chunks)) <= 64 * 1024
+    assert b"".join(chunks) == diff and text == diff.decode()
+    assert missing is None
+    assert requests[0].headers["Accept"] == "application/vnd.github.diff"
+
+
+def test_rate_limited_transport_retries_after_retry_after():
+    """Test a secondary rate limit is waited out and retried, while a plain 403 is returned as is"""
+    responses = [
+        httpx.Response(403, headers={"retry-after": "0"}),
+        httpx.Response(200, headers={"x-ratelimit-remaining": "4999", "x-ratelimit-reset": "0"}),
+        httpx.Response(403, json={"message": "Resource not accessible"})
+    ]
+    transport = RateLimitedTransport(httpx.MockTransport(lambda request: responses.pop(0)))
+
+    async def run():
+        async with httpx.AsyncClient(base_url="https://api.github.com", transport=transport) as client:
+            return await client.get("/repos/o/r"), await client.get("/repos/o/r")
+
+    retried, forbidden = asyncio.run(run())
+
+    assert retried.status_code == 200
+    assert forbidden.status_code == 403
+    assert responses == []
+
+
+def test_rate_limited_transport_paces_a_low_budget():
+    """Test requests are spread over the reset window once few remain"""
+    transport = RateLimitedTransport(httpx.MockTransport(lambda request: httpx.Response(200)))
+    reset = time.time() + 50
+    transport._observe(httpx.Response(200, headers={"x-ratelimit-remaining": "10", "x-ratelimit-reset": str(reset)}), 0)
+    assert 4.9 < transport._interval <= 5.0
+
+    transport._observe(httpx.Response(200, headers={"x-ratelimit-remaining": "4000", "x-ratelimit-reset": str(reset)}), 0)
+    assert transport._interval == 0.0
@@ -0,0 +1,117 @@
+import os
+import sys
+from unittest.mock import Mock, patch
+
+# Add root to path so `agents` can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from agents.models import CodeSnippet
+from agents.llm_cache import LLMCache, LRUDict, lookup_snippets, snippet_cache_key, store_snippets
+
+
+def make_llm(model="gemini-1.5-flash", temperature=0.2):
+    llm = Mock()
+    llm.model = model
+    llm.temperature = temperature
+    return llm
+
+
+def test_get_set_and_stats():
+    """Test cache hit/miss accounting"""
+    cache = LLMCache()
+    assert cache.get("missing") is None
+
+    cache.set("key", [{"type": "SQL Injection"}])
+    assert cache.get("key") == [{"type": "SQL Injection"}]
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+def test_lru_backend_eviction():
+    """Test the default backend stays bounded"""
+    backend = LRUDict(maxsize=2)
+    backend["a"] = 1
+    backend["b"] = 2
+    backend.get("a")
+    backend["c"] = 3
+
+    assert backend.get("a") == 1
+    assert backend.get("b") is None
+    assert len(backend) == 2
+
+
+def test_snippet_cache_key_is_deterministic():
+    """Test keys depend on prompt version, model and snippet content"""
+    snippet = CodeSnippet(file_path="app.py", content="x = 1", language="python")
+    changed = CodeSnippet(file_path="app.py", content="x = 2", language="python")
+
+    key = snippet_cache_key("security-v1", make_llm(), snippet)
+    assert key == snippet_cache_key("security-v1", make_llm(), snippet)
+    assert key != snippet_cache_key("quality-v1", make_llm(), snippet)
+    assert key != snippet_cache_key("security-v2", make_llm(), snippet)
+    assert key != snippet_cache_key("security-v1", make_llm(model="gemini-1.5-pro"), snippet)
+    assert key != snippet_cache_key("security-v1", make_llm(), changed)
+
+
+def test_snippet_cache_key_skips_unknown_models():
+    """Test stub LLMs without a model name are never cached"""
+    snippet = CodeSnippet(file_path="app.py", content="x = 1", language="python")
+    assert snippet_cache_key("security-v1", object(), snippet) is None
+
+
+def test_unchanged_files_are_served_from_cache():
+    """Test only changed files are pending after a batch was stored per file"""
+    cache = LLMCache()
+    llm = make_llm()
+    app = CodeSnippet(file_path="app.py", content="x = 1", language="python")
+    util = CodeSnippet(file_path="util.py", content="y = 2", language="python")
+    store_snippets(cache, "security-v1", llm, [app, util], [{"file": "app.py", "type": "SQL Injection"}])
+
+    changed = CodeSnippet(file_path="util.py", content="y = 3", language="python")
+    cached, pending = lookup_snippets(cache, "security-v1", llm, [app, changed])
+    assert cached == {"app.py": [{"file": "app.py", "type": "SQL Injection"}]}
+    assert pending == [changed]
+
+    cached, pending = lookup_snippets(cache, "security-v1", llm, [util])
+    assert cached == {"util.py": []}
+    assert pending == []
+
+
+def test_per_file_extras_are_part_of_the_key():
+    """Test an answer stored without a file's static findings is not reused once findings exist"""
+    cache = LLMCache()
+    llm = make_llm()
+    app = CodeSnippet(file_path="app.py", content="x = 1", language="python")
+    findings = {"app.py": [{"tool": "bandit", "rule": "B105", "line": 1, "message": "m"}]}
+    store_snippets(cache, "security-v2", llm, [app], [])
+
+    assert lookup_snippets(cache, "security-v2", llm, [app], findings) == ({}, [app])
+    assert lookup_snippets(cache, "security-v2", llm, [app]) == ({"app.py": []}, [])
+
+    store_snippets(cache, "security-v2", llm, [app], [{"file": "app.py", "type": "Hardcoded Secret"}], findings)
+    cached, _ = lookup_snippets(cache, "security-v2", llm, [app], findings)
+    assert cached == {"app.py": [{"file": "app.py", "type": "Hardcoded Secret"}]}
+
+
+def test_unattributable_batches_are_not_stored():
+    """Test a batch with results for an unknown file is not cached"""
+    cache = LLMCache()
+    app = CodeSnippet(file_path="app.py", content="x = 1", language="python")
+    store_snippets(cache, "quality-v1", make_llm(), [app], [{"file": "unknown", "type": "style"}])
+
+    assert lookup_snippets(cache, "quality-v1", make_llm(), [app]) == ({}, [app])
+
+
+def test_lru_backend_ttl_expiry():
+    """Test entries expire once their time to live has passed"""
+    backend = LRUDict(maxsize=2, ttl=60)
+    with patch('agents.llm_cache.time.monotonic', return_value=100):
+        backend["a"] = 1
+    with patch('agents.llm_cache.time.monotonic', return_value=159):
+        assert backend.get("a") == 1
+    with patch('agents.llm_cache.time.monotonic', return_value=160):
+        assert backend.get("a") is None
+    assert len(backend) == 0
@@ -631,6 +631,62 @@ def test_complex_analysis_scenarios():
         print("✓ Complex analysis scenarios work correctly")
 
 
+
+def test_analyze_batches_files_into_one_call():
+    """Test files share one LLM call and files missing from the answer are retried alone"""
+    from langchain_core.language_models import FakeListLLM
+
+    llm = FakeListLLM(responses=[
+        "## Logic Analysis for test_file.py\n\n1. **Null Pointer Exception**: user may be None\n\n"
+        "## Logic Analysis for clean_file.py\n\nNo logic issues detected.",
+        "## Logic Analysis for complex_file.py\n\n1. **Infinite Loop**: loop never ends",
+        "unused"
+    ])
+    agent = LogicAgent(llm=llm)
+    agent.cache = Mock(get=Mock(return_value=None))
+    context = create_test_state(3).context
+
+    response = agent.analyze(context)
+
+    assert response.success
+    assert [r["file"] for r in response.results] == ["test_file.py", "clean_file.py", "complex_file.py"]
+    assert [r["has_issues"] for r in response.results] == [True, False, True]
+    assert "clean_file.py" not in response.results[0]["analysis"]
+    assert llm.i == 2
+
+
+def test_chain_is_built_once_per_llm():
+    """Test the chain is reused across calls and rebuilt when the LLM is replaced"""
+    from langchain_core.language_models import FakeListLLM
+
+    agent = LogicAgent(llm=FakeListLLM(responses=["No logic issues detected."]))
+    chain = agent.chain
+    assert agent.chain is chain
+
+    agent.llm = FakeListLLM(responses=["No logic issues detected."])
+    assert agent.chain is not chain
+    assert agent.chain is agent.chain
+
+
+def test_stream_stops_once_every_file_is_settled():
+    """Test generation is cut after the last file's clean verdict, but not after an earlier one"""
+    from langchain_core.language_models import FakeStreamingListLLM
+
+    llm = FakeStreamingListLLM(responses=[
+        "## Logic Analysis for test_file.py\n\nNo logic issues detected.\n\n"
+        "## Logic Analysis for clean_file.py\n\n1. **Off By One**: range end is exclusive\n\n"
+        "## Logic Analysis for complex_file.py\n\nNo logic issues detected.\n\n### Suggestions:\n- Add tests"
+    ])
+    agent = LogicAgent(llm=llm)
+    agent.cache = Mock(get=Mock(return_value=None))
+
+    response = agent.analyze(create_test_state(3).context)
+
+    assert [r["has_issues"] for r in response.results] == [False, True, False]
+    assert "Off By One" in response.results[1]["analysis"]
+    assert "Suggestions" not in response.results[2]["analysis"]
+
+
 def main():
     """Run all Logic Agent tests"""
     print("=" * 60)
@@ -0,0 +1,47 @@
+import os
+import sys
+from types import SimpleNamespace
+
+# Add root to path so `agents` can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from agents.metrics import Counter, Histogram, TokenUsageCallback, LLM_TOKENS, model_label
+
+
+def test_histogram_quantiles_and_render():
+    """Test bucket counts, quantile estimates and Prometheus output"""
+    histogram = Histogram("test_latency_seconds", "Test latency")
+    for value in [0.05, 0.3, 0.3, 0.8, 4.0, 200.0]:
+        histogram.observe(value, "security", "gemini", "gemini-1.5-flash")
+
+    labels = ("security", "gemini", "gemini-1.5-flash")
+    assert histogram.quantile(0.5, *labels) == 0.5
+    assert histogram.quantile(0.95, *labels) == float("inf")
+    assert histogram.snapshot()["security/gemini/gemini-1.5-flash"]["count"] == 6
+
+    text = histogram.render()
+    assert 'test_latency_seconds_bucket{agent="security",provider="gemini",model="gemini-1.5-flash",le="0.5"} 3' in text
+    assert 'le="+Inf"} 6' in text
+
+
+def test_token_usage_callback_records_usage_metadata():
+    """Test usage_metadata on LLM responses is added to the token counter"""
+    callback = TokenUsageCallback("quality", "gemini", "test-model")
+    message = SimpleNamespace(usage_metadata={"input_tokens": 120, "output_tokens": 30})
+    callback.on_llm_end(SimpleNamespace(generations=[[SimpleNamespace(message=message)]]))
+
+    snapshot = LLM_TOKENS.snapshot()
+    assert snapshot["quality/gemini/test-model/input"] >= 120
+    assert snapshot["quality/gemini/test-model/output"] >= 30
+
+
+def test_counter_and_model_label():
+    """Test counter accumulation and model name normalisation"""
+    counter = Counter("test_total", "Test counter")
+    counter.inc(2, "logic", "groq", "llama3", "input")
+    counter.inc(3, "logic", "groq", "llama3", "input")
+    assert counter.snapshot() == {"logic/groq/llama3/input": 5}
+
+    assert model_label(SimpleNamespace(model="models/gemini-1.5-pro")) == "gemini-1.5-pro"
+    assert model_label(SimpleNamespace(model_name="llama3-8b-8192")) == "llama3-8b-8192"
+    assert model_label(None) == "unknown"
@@ -10,7 +10,8 @@ from dotenv import load_dotenv
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
 from agents.quality_agent import QualityAgent, QualityIssue
-from agents.models import AgentResponse, CodeSnippet, WorkflowState
+from agents.llm_cache import LLMCache, snippet_cache_key
+from agents.models import AgentResponse, AnalysisContext, CodeSnippet, WorkflowState
 
 load_dotenv()
 
@@ -678,6 +679,135 @@ class TestQualityAgentIntegration:
                 
                 print(f"✓ Performance test completed in {duration:.2f} seconds")
 
+    def test_aanalyze_sends_batches_concurrently(self):
+        """Test async analysis keeps every batch in flight at once and reports them in order"""
+        import asyncio
+        from agents.rate_limiter import RateLimiter
+
+        in_flight = []
+
+        async def ainvoke(payload):
+            # Only returns once all three batches are waiting together
+            in_flight.append(payload["file_path"])
+            for _ in range(500):
+                if len(in_flight) == 3:
+                    break
+                await asyncio.sleep(0.01)
+            else:
+                raise TimeoutError("batches were not sent concurrently")
+            return json.dumps([{"type": "style", "description": "d", "line": 1,
+                                "file": payload["file_path"], "severity": "low"}])
+
+        with patch("agents.quality_agent.FreeLLMProvider") as mock_provider:
+            mock_provider.return_value.get_llm.return_value = MagicMock()
+
+            mock_chain = MagicMock()
+            mock_chain.ainvoke = ainvoke
+
+            with patch.object(QualityAgent, '_create_chain', return_value=mock_chain):
+                agent = QualityAgent(max_batch_tokens=1)
+                agent.cache = Mock(get=Mock(return_value=None))
+                agent.rate_limiter = RateLimiter(rpm=6000)
+
+                snippets = [create_code_snippet(f"file_{i}.py", f"total_{i} = price * quantity\n") for i in range(3)]
+                response = asyncio.run(agent.aanalyze(AnalysisContext(code_snippets=snippets)))
+
+                assert response.errors == []
+                assert [issue.file for issue in response.results] == ["file_0.py", "file_1.py", "file_2.py"]
+
+    def test_long_files_go_to_the_small_model(self):
+        """Test a file over the long-snippet threshold is sent alone to the small model tier"""
+        with patch("agents.quality_agent.FreeLLMProvider") as mock_provider:
+            llm, small_llm = MagicMock(name="llm"), MagicMock(name="small_llm")
+            mock_provider.return_value.get_llm.side_effect = (
+                lambda agent_type, size="default": small_llm if size == "small" else llm
+            )
+            chains = {llm: MagicMock(), small_llm: MagicMock()}
+            for chain in chains.values():
+                chain.invoke.return_value = "[]"
+
+            with patch.object(QualityAgent, '_create_chain', side_effect=lambda model: chains[model]):
+                agent = QualityAgent(long_snippet_tokens=1000)
+                agent.cache = Mock(get=Mock(return_value=None))
+
+                long_file = create_code_snippet("generated_tables.py", "VALUE = compute(1)\n" * 300)
+                short_files = [create_code_snippet(f"file_{i}.py", "total = price * quantity\n") for i in range(2)]
+                response = agent.analyze(AnalysisContext(code_snippets=[short_files[0], long_file, short_files[1]]))
+
+                assert response.errors == []
+                assert chains[llm].invoke.call_count == 1
+                assert "generated_tables.py" not in chains[llm].invoke.call_args[0][0]["file_path"]
+                assert chains[small_llm].invoke.call_args[0][0]["file_path"] == "generated_tables.py"
+
+    def test_long_files_are_cached_under_the_small_model(self):
+        """Test a long file's answer is keyed on the small model that produced it"""
+        with patch("agents.quality_agent.FreeLLMProvider") as mock_provider:
+            llm, small_llm = MagicMock(model="gemini-1.5-pro"), MagicMock(model="gemini-1.5-flash")
+            mock_provider.return_value.get_llm.side_effect = (
+                lambda agent_type, size="default": small_llm if size == "small" else llm
+            )
+            chains = {llm: MagicMock(), small_llm: MagicMock()}
+            for chain in chains.values():
+                chain.invoke.return_value = "[]"
+
+            with patch.object(QualityAgent, '_create_chain', side_effect=lambda model: chains[model]):
+                agent = QualityAgent(long_snippet_tokens=1000)
+                agent.cache = LLMCache()
+
+                long_file = create_code_snippet("generated_tables.py", "VALUE = compute(1)\n" * 300)
+                agent.analyze(AnalysisContext(code_snippets=[long_file]))
+                agent.analyze(AnalysisContext(code_snippets=[long_file]))
+
+                assert chains[small_llm].invoke.call_count == 1
+                assert agent.cache.get(snippet_cache_key(QualityAgent.PROMPT_VERSION, small_llm, long_file)) == []
+                assert agent.cache.get(snippet_cache_key(QualityAgent.PROMPT_VERSION, llm, long_file)) is None
+
+    def test_unparseable_batch_is_retried_file_by_file(self):
+        """Test a multi-file answer without JSON is re-sent one file at a time instead of filed as 'unknown'"""
+        with patch("agents.quality_agent.FreeLLMProvider"), \
+                patch.object(QualityAgent, '_create_chain') as mock_create_chain:
+            mock_chain = MagicMock()
+            mock_chain.invoke.side_effect = [
+                "One of these files has poor naming and could be refactored.",
+                '[{"type": "naming", "severity": "low", "description": "Unclear name", "line": 1, "file": "a.py"}]',
+                "[]"
+            ]
+            mock_create_chain.return_value = mock_chain
+            agent = QualityAgent()
+            agent.cache = Mock(get=Mock(return_value=None))
+
+            response = agent.analyze(AnalysisContext(code_snippets=[
+                create_code_snippet("a.py", "def f(x):\n    return x * rate\n"),
+                create_code_snippet("b.py", "def g(y):\n    return y + offset\n")
+            ]))
+
+            assert mock_chain.invoke.call_count == 3
+            assert [issue.file for issue in response.results] == ["a.py"]
+
+    def test_identical_files_are_analyzed_once(self):
+        """Test byte-identical files reach the LLM once and share the findings"""
+        with patch("agents.quality_agent.FreeLLMProvider"), \
+                patch.object(QualityAgent, '_create_chain') as mock_create_chain:
+            mock_chain = MagicMock()
+            mock_chain.invoke.return_value = (
+                '[{"type": "naming", "severity": "low", "description": "Unclear name", '
+                '"line": 1, "file": "client/a.py", "suggestion": "Rename it"}]'
+            )
+            mock_create_chain.return_value = mock_chain
+            agent = QualityAgent()
+            agent.cache = Mock(get=Mock(return_value=None))
+
+            content = "def fetch_user(uid):\n    return session.get(uid)\n"
+            response = agent.analyze(AnalysisContext(code_snippets=[
+                create_code_snippet("client/a.py", content),
+                create_code_snippet("client/b.py", content)
+            ]))
+
+            assert mock_chain.invoke.call_count == 1
+            assert mock_chain.invoke.call_args[0][0]["file_path"] == "client/a.py"
+            assert sorted(issue.file for issue in response.results) == ["client/a.py", "client/b.py"]
+            assert response.metadata["issues_found"] == 2
+
 
 def run_all_tests():
     """Run all Quality Agent tests"""
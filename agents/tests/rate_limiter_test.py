@@ -0,0 +1,153 @@
+import os
+import sys
+import asyncio
+from unittest.mock import Mock, patch
+
+import pytest
+
+# Add root to path so `agents` can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from agents.rate_limiter import (
+    RATE_LIMIT_BACKOFF, RATE_LIMIT_RETRIES, CircuitBreaker, CircuitOpenError, RateLimiter, TokenBucket,
+    backoff_delay, get_rate_limiter, is_rate_limit_error, retry_after_seconds
+)
+
+
+class RateLimitError(Exception):
+    def __init__(self, retry_after="2"):
+        super().__init__("Error code: 429 - rate limit exceeded")
+        self.status_code = 429
+        self.response = Mock(status_code=429, headers={"retry-after": retry_after})
+
+
+def test_token_bucket_queues_callers_once_empty():
+    """Test reservations beyond capacity are told to wait"""
+    bucket = TokenBucket(capacity=2, refill_rate=1.0)
+    assert bucket.reserve(1) == 0
+    assert bucket.reserve(1) == 0
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+    assert bucket.reserve(1) == pytest.approx(2.0, abs=0.05)
+
+
+def test_throttle_reduces_rate_and_honours_retry_after():
+    """Test a 429 slows refills by 20% and pauses for Retry-After"""
+    bucket = TokenBucket(capacity=1, refill_rate=1.0)
+    bucket.reserve(1)
+    bucket.throttle(retry_after=3)
+    assert bucket.reserve(1) == pytest.approx(3.0, abs=0.05)
+
+    bucket = TokenBucket(capacity=1, refill_rate=1.0)
+    bucket.reserve(1)
+    bucket.throttle()
+    assert bucket.reserve(1) == pytest.approx(1.25, abs=0.05)
+
+
+def test_rate_limit_error_detection():
+    """Test 429 errors and their Retry-After header are recognised"""
+    error = RateLimitError(retry_after="2")
+    assert is_rate_limit_error(error)
+    assert retry_after_seconds(error) == 2.0
+    assert not is_rate_limit_error(ValueError("bad json"))
+    assert retry_after_seconds(ValueError("bad json")) is None
+
+
+def test_circuit_breaker_opens_after_repeated_failures():
+    """Test the breaker opens on the Nth failure and resets on success"""
+    breaker = CircuitBreaker(failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.is_open
+
+
+def test_reserve_rejects_fast_when_circuit_open():
+    """Test calls fail immediately once the model keeps failing"""
+    limiter = RateLimiter(rpm=6000)
+
+    async def call(exc):
+        async with limiter.reserve(tokens=10):
+            raise exc
+
+    async def run():
+        for _ in range(5):
+            with pytest.raises(RateLimitError):
+                await call(RateLimitError(retry_after="0"))
+        with pytest.raises(CircuitOpenError):
+            await call(RuntimeError("never reached"))
+
+    asyncio.run(run())
+
+
+def test_reserve_sync_waits_for_budget():
+    """Test synchronous callers sleep for the bucket delay instead of bursting"""
+    limiter = RateLimiter(rpm=60)
+    limiter.requests.reserve(limiter.requests.capacity)
+
+    with patch("agents.rate_limiter.time.sleep") as mock_sleep:
+        with limiter.reserve_sync(tokens=10):
+            pass
+
+    assert mock_sleep.call_args[0][0] == pytest.approx(1.0, abs=0.05)
+
+
+def test_large_batch_fits_a_low_tpm_budget():
+    """Test an idle limiter admits a batch far above a sixth of the TPM limit without waiting"""
+    limiter = RateLimiter(rpm=30, tpm=6000)
+
+    assert limiter._delay(5000) == 0
+    # The next batch waits only until enough of the budget has refilled
+    assert limiter._delay(6000) == pytest.approx(50.0, abs=0.1)
+    assert RateLimiter(rpm=30, tpm=6000)._delay(20000) == 0
+
+
+def test_acall_retries_rate_limited_calls_only():
+    """Test a 429 is retried with backoff while other errors fail at once"""
+    limiter = RateLimiter(rpm=6000)
+    attempts = []
+
+    async def flaky():
+        attempts.append(len(attempts))
+        if len(attempts) < 3:
+            raise RateLimitError(retry_after="0")
+        return "ok"
+
+    async def broken():
+        attempts.append(len(attempts))
+        raise ValueError("bad request")
+
+    with patch("agents.rate_limiter.backoff_delay", return_value=0) as mock_backoff:
+        assert asyncio.run(limiter.acall(flaky)) == "ok"
+        assert attempts == [0, 1, 2]
+        assert [c.args[0] for c in mock_backoff.call_args_list] == [0, 1]
+
+        attempts.clear()
+        with pytest.raises(ValueError):
+            asyncio.run(limiter.acall(broken))
+        assert attempts == [0]
+
+
+def test_call_gives_up_after_the_last_retry():
+    """Test the synchronous call re-raises once every retry was rate limited"""
+    limiter = RateLimiter(rpm=6000)
+    func = Mock(side_effect=RateLimitError(retry_after="0"))
+
+    with patch("agents.rate_limiter.time.sleep"):
+        with pytest.raises(RateLimitError):
+            limiter.call(func)
+
+    assert func.call_count == RATE_LIMIT_RETRIES + 1
+    assert backoff_delay(2) >= RATE_LIMIT_BACKOFF * 4
+
+
+def test_get_rate_limiter_is_shared_per_model():
+    """Test agents using the same model share one limiter"""
+    flash = Mock(model="models/gemini-1.5-flash")
+    assert get_rate_limiter(flash) is get_rate_limiter(Mock(model="gemini-1.5-flash"))
+    assert get_rate_limiter(flash) is not get_rate_limiter(Mock(model="gemini-1.5-pro"))
+    assert get_rate_limiter(flash).requests.refill_rate == pytest.approx(1000 / 60)
@@ -2,13 +2,15 @@ import os
 import sys
 import time
 import json
+import asyncio
 from unittest.mock import Mock, patch, MagicMock
 from dotenv import load_dotenv
 
 # Add root to path so `agents` can be imported
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
-from agents.models import AnalysisContext, CodeSnippet, AgentResponse, Vulnerability
+from agents.models import AnalysisContext, CodeSnippet, AgentResponse, Vulnerability, Severity
+from agents.llm_cache import LLMCache
 from agents.security_agent import SecurityAgent
 
 load_dotenv()
@@ -809,6 +811,216 @@ def test_vulnerability_model_validation():
     print("✓ Vulnerability model validation works correctly")
 
 
+def test_analyze_batches_snippets_into_one_call():
+    """Test that small snippets share a single LLM request"""
+    print("\nTesting snippet batching...")
+
+    with patch('agents.security_agent.FreeLLMProvider', MockFreeLLMProvider):
+        agent = SecurityAgent(provider="gemini")
+        agent.llm_provider.set_response_type("single_vulnerability")
+        agent.llm = agent.llm_provider.get_llm("security")
+        agent.llm.invoke = Mock(wraps=agent.llm.invoke)
+
+        context = AnalysisContext(
+            repo_name="test-security-repo",
+            pr_id="PR-790",
+            code_snippets=[
+                CodeSnippet(file_path=f"module_{i}.py", content=f"value_{i} = os.getenv('SETTING_{i}')", language="python")
+                for i in range(5)
+            ]
+        )
+
+        response = agent.analyze(context)
+
+        assert response.success
+        assert agent.llm.invoke.call_count == 1
+        prompt = agent.llm.invoke.call_args[0][0].to_string()
+        for i in range(5):
+            assert f"=== FILE: module_{i}.py ===" in prompt
+
+        # A tight budget splits the same snippets into several requests
+        agent.max_batch_tokens = 0
+        agent.llm.invoke.reset_mock()
+        agent.analyze(context)
+        assert agent.llm.invoke.call_count == 5
+
+        print("✓ Snippets batched into a single request")
+
+
+def test_analyze_sends_batches_concurrently():
+    """Test the synchronous analyze keeps several batches in flight at once"""
+    import threading
+
+    with patch('agents.security_agent.FreeLLMProvider', MockFreeLLMProvider):
+        agent = SecurityAgent(provider="gemini", max_batch_tokens=0)
+        agent.llm_provider.set_response_type("no_vulnerabilities")
+        agent.llm = agent.llm_provider.get_llm("security")
+
+        # Each call only returns once all three batches are waiting together
+        all_in_flight = threading.Barrier(3, timeout=5)
+        invoke = agent.llm.invoke
+
+        def blocking_invoke(*args, **kwargs):
+            all_in_flight.wait()
+            return invoke(*args, **kwargs)
+
+        agent.llm.invoke = blocking_invoke
+        response = agent.analyze(AnalysisContext(code_snippets=[
+            CodeSnippet(file_path=f"module_{i}.py", content=f"value_{i} = os.getenv('SETTING_{i}')", language="python")
+            for i in range(3)
+        ]))
+
+        assert response.errors == []
+        assert response.success
+
+
+def test_unparseable_batch_is_retried_file_by_file():
+    """Test a multi-file answer without JSON is not guessed at but re-sent one file at a time"""
+    with patch('agents.security_agent.FreeLLMProvider', MockFreeLLMProvider), \
+            patch.object(SecurityAgent, '_create_chain') as mock_create_chain:
+        mock_chain = MagicMock()
+        mock_chain.invoke.side_effect = [
+            "There is a security vulnerability in one of these files.",
+            '[{"type": "Command Injection", "severity": "high", "description": "d", "line": 1, "file": "run.py"}]',
+            "[]"
+        ]
+        mock_create_chain.return_value = mock_chain
+        agent = SecurityAgent(provider="gemini")
+        agent.cache = LLMCache()
+
+        response = agent.analyze(AnalysisContext(code_snippets=[
+            CodeSnippet(file_path="run.py", content="os.system('ls ' + user_input)", language="python"),
+            CodeSnippet(file_path="util.py", content="def read(path):\n    return open(path).read()\n", language="python")
+        ]))
+
+        assert mock_chain.invoke.call_count == 3
+        assert [v.file for v in response.results] == ["run.py"]
+        assert response.results[0].type == "Command Injection"
+
+
+def test_files_without_suspicious_code_skip_the_llm():
+    """Test plain arithmetic is never sent for security review unless force_llm is set"""
+    snippets = [
+        CodeSnippet(file_path="query.py", content="cursor.execute('SELECT * FROM t WHERE id=' + uid)", language="python"),
+        CodeSnippet(file_path="mathutil.py", content="def add(a, b):\n    return a + b\n", language="python"),
+        CodeSnippet(file_path="flagged.py", content="def mul(a, b):\n    return a * b\n", language="python")
+    ]
+    context = AnalysisContext(code_snippets=snippets, agent_memory={
+        "static_findings": {"flagged.py": [{"tool": "ruff", "rule": "B008", "line": 1, "message": "m"}]}
+    })
+
+    with patch('agents.security_agent.FreeLLMProvider', MockFreeLLMProvider), \
+            patch.object(SecurityAgent, '_create_chain') as mock_create_chain:
+        mock_chain = MagicMock()
+        mock_chain.invoke.return_value = "[]"
+        mock_create_chain.return_value = mock_chain
+
+        agent = SecurityAgent(provider="gemini")
+        agent.cache = LLMCache()
+        response = agent.analyze(context)
+
+        assert response.metadata["skipped_files"] == ["mathutil.py"]
+        sent = mock_chain.invoke.call_args[0][0]["file_path"]
+        assert "query.py" in sent and "flagged.py" in sent and "mathutil.py" not in sent
+
+        paranoid = SecurityAgent(provider="gemini", force_llm=True)
+        paranoid.cache = LLMCache()
+        assert paranoid.analyze(context).metadata["skipped_files"] == []
+
+
+
+class ChunkedSecurityLLM(MockSecurityLLM):
+    """Streams the mock response in small chunks, counting how many were sent."""
+
+    def __init__(self, response_type="vulnerabilities_found"):
+        super().__init__(response_type)
+        self.chunks_sent = 0
+
+    async def astream(self, input, config=None, **kwargs):
+        response = self.invoke(input, config, **kwargs)
+        for i in range(0, len(response), 16):
+            self.chunks_sent += 1
+            yield response[i:i + 16]
+
+
+def test_aanalyze_streams_vulnerabilities_before_response_completes():
+    """Test issues are reported while the LLM response is still streaming"""
+    print("\nTesting streamed security analysis...")
+
+    with patch('agents.security_agent.FreeLLMProvider', MockFreeLLMProvider):
+        agent = SecurityAgent(provider="gemini")
+        agent.llm = ChunkedSecurityLLM("vulnerabilities_found")
+
+        seen = []
+        response = asyncio.run(agent.aanalyze(
+            AnalysisContext(repo_name="test-security-repo", code_snippets=create_test_security_code_snippets()[:1]),
+            on_result=lambda vuln: seen.append((vuln.severity, agent.llm.chunks_sent))
+        ))
+
+        assert response.success
+        assert [severity for severity, _ in seen] == ["critical", "high"]
+        # The critical issue arrived before the last chunk was streamed
+        assert seen[0][1] < agent.llm.chunks_sent
+        assert [v.type for v in response.results] == ["SQL Injection", "Hardcoded Credentials"]
+
+        print("✓ Vulnerabilities yielded while streaming")
+
+
+def test_aanalyze_clean_batch_is_not_resent():
+    """Test an empty JSON array for a multi-file batch costs one call, not one per file"""
+    with patch('agents.security_agent.FreeLLMProvider', MockFreeLLMProvider):
+        agent = SecurityAgent(provider="gemini")
+        agent.llm = ChunkedSecurityLLM("no_vulnerabilities")
+        agent.llm.invoke = Mock(wraps=agent.llm.invoke)
+        agent.cache = LLMCache()
+
+        response = asyncio.run(agent.aanalyze(AnalysisContext(code_snippets=[
+            CodeSnippet(file_path=f"settings_{i}.py", content=f"value = os.getenv('SETTING_{i}')", language="python")
+            for i in range(3)
+        ])))
+
+        assert response.success
+        assert response.results == []
+        assert agent.llm.invoke.call_count == 1
+
+def test_cached_vulnerabilities_keep_their_types():
+    """Test a cache hit skips the LLM and rebuilds the same validated vulnerabilities"""
+    with patch('agents.security_agent.FreeLLMProvider', MockFreeLLMProvider):
+        agent = SecurityAgent(provider="gemini")
+        agent.llm = agent.llm_provider.get_llm("security")
+        agent.llm.model = "gemini-1.5-flash"
+        agent.llm.invoke = Mock(wraps=agent.llm.invoke)
+        agent.cache = LLMCache()
+
+        context = AnalysisContext(code_snippets=[
+            CodeSnippet(file_path="test_file.py", content="query = 'SELECT * FROM users WHERE id=' + uid",
+                        language="python")
+        ])
+        first = agent.analyze(context)
+        second = agent.analyze(context)
+
+        assert agent.llm.invoke.call_count == 1
+        assert second.results == first.results
+        assert second.results[0].severity is Severity.CRITICAL
+        assert agent.cache.stats()["hits"] == 1
+
+
+def test_security_response_is_typed():
+    """Test the agent returns AgentResponse[Vulnerability] and its results serialize as such"""
+    with patch('agents.security_agent.FreeLLMProvider', MockFreeLLMProvider):
+        agent = SecurityAgent(provider="gemini")
+        agent.llm = agent.llm_provider.get_llm("security")
+
+        response = agent.analyze(AnalysisContext(code_snippets=create_test_security_code_snippets()[:1]))
+
+    assert isinstance(response, AgentResponse[Vulnerability])
+    assert isinstance(response, AgentResponse)
+    assert response.model_dump()["results"][0]["severity"] == "critical"
+    assert AgentResponse[Vulnerability](success=True, results=[{
+        "type": "XSS", "severity": "High", "description": "d", "line": "3", "file": "a.py"
+    }]).results[0].line == 3
+
+
 def main():
     """Run all Security Agent tests"""
     print("=" * 60)
@@ -0,0 +1,66 @@
+import os
+import sys
+import shutil
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+# Add root to path so `agents` can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from agents.models import CodeSnippet
+from agents.static_analysis import prefilter_snippets, scan_snippet
+from agents.tools import format_snippet_batch
+
+
+def make_snippet(file_path, content, language="python"):
+    return CodeSnippet(file_path=file_path, content=content, language=language)
+
+
+def test_prefilter_partitions_snippets():
+    """Test clean files skip the LLM while flagged and unscannable ones do not"""
+    findings = {
+        "risky.py": [{"tool": "ruff", "rule": "S105", "line": 2, "message": "Possible hardcoded password"}],
+        "clean.py": [],
+        "app.js": None
+    }
+
+    async def fake_scan(snippet):
+        return findings[snippet.file_path]
+
+    snippets = [
+        make_snippet("risky.py", "password = 'x'"),
+        make_snippet("clean.py", "x = 1"),
+        make_snippet("app.js", "eval(x)", language="javascript")
+    ]
+    with patch('agents.static_analysis.scan_snippet', fake_scan):
+        needs_llm, clean, by_file = asyncio.run(prefilter_snippets(snippets))
+
+    assert [s.file_path for s in needs_llm] == ["risky.py", "app.js"]
+    assert [s.file_path for s in clean] == ["clean.py"]
+    assert list(by_file) == ["risky.py"]
+
+
+def test_findings_are_added_to_the_prompt():
+    """Test static findings follow the file they belong to"""
+    snippets = [make_snippet("risky.py", "password = 'x'"), make_snippet("other.py", "y = 2")]
+    payload = format_snippet_batch(snippets, {
+        "risky.py": [{"tool": "ruff", "rule": "S105", "line": 1, "message": "Possible hardcoded password"}]
+    })
+
+    risky, other = payload["code"].split("\n\n")
+    assert "line 1: [S105] Possible hardcoded password" in risky
+    assert "Static analyzer findings" not in other
+
+
+@pytest.mark.skipif(shutil.which("ruff") is None, reason="ruff not installed")
+def test_scan_snippet_with_ruff():
+    """Test a real ruff scan flags a hardcoded password and passes clean code"""
+    with patch('agents.static_analysis.shutil.which', lambda tool: tool if tool == "ruff" else None):
+        risky = asyncio.run(scan_snippet(make_snippet("risky.py", 'password = "hunter2"\n')))
+        clean = asyncio.run(scan_snippet(make_snippet("clean.py", "x = 1\n")))
+
+    assert any(f["rule"] == "S105" and f["line"] == 1 for f in risky)
+    assert clean == []
+    assert asyncio.run(scan_snippet(make_snippet("README.md", "# Docs", language="markdown"))) is None
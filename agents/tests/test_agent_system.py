@@ -1,6 +1,9 @@
 import os
 import sys
 import time
+import asyncio
+import threading
+from unittest.mock import patch
 from dotenv import load_dotenv
 
 # Add root to path so `agents` can be imported
@@ -11,6 +14,9 @@ from agents.models import (
     AgentResponse, WorkflowState
 )
 from agents.workflows import create_analysis_workflow
+from agents.agent_system import AgentSystem
+from agents.background import background_jobs
+from agents.metrics import AGENT_LATENCY
 
 load_dotenv()
 
@@ -131,6 +137,172 @@ class MockDecisionAgent:
         return {"decision": decision_data}
 
 
+class SlowAsyncAgent:
+    """Async agent stub that simulates a fixed LLM round-trip."""
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    async def aanalyze(self, state: WorkflowState, on_result=None) -> AgentResponse:
+        await asyncio.sleep(self.delay)
+        return AgentResponse(success=True, results=[])
+
+
+class CriticalSecurityAgent:
+    """Async security stub that reports a critical issue straight away."""
+    async def aanalyze(self, state: WorkflowState, on_result=None) -> AgentResponse:
+        vulnerability = Vulnerability(
+            type="Code Injection", severity="critical", description="eval() on user input",
+            line=1, file="app.py"
+        )
+        on_result(vulnerability)
+        await asyncio.sleep(0.1)
+        return AgentResponse(success=True, results=[vulnerability])
+
+
+class SlowContextAgent:
+    def enrich_context(self, state: WorkflowState) -> dict:
+        time.sleep(0.2)
+        return {"repo": state.context.repo_name}
+
+
+class StaticDecisionAgent:
+    def make_decision(self, state: WorkflowState) -> dict:
+        return {"decision": "APPROVE"}
+
+
+def test_analyze_pull_request_runs_agents_concurrently():
+    system = AgentSystem.__new__(AgentSystem)
+    system.provider = "gemini"
+    system.agents = {
+        "security": SlowAsyncAgent(0.2),
+        "quality": SlowAsyncAgent(0.2),
+        "logic": SlowAsyncAgent(0.2),
+        "context": SlowContextAgent(),
+        "decision": StaticDecisionAgent()
+    }
+
+    start = time.time()
+    result = asyncio.run(system.analyze_pull_request(AnalysisContext(repo_name="test-repo")))
+    duration = time.time() - start
+
+    assert result["decision"]["decision"] == "APPROVE"
+    # Three 0.2s agents run sequentially would take ~0.6s
+    assert duration < 0.5
+    assert AGENT_LATENCY.snapshot()["logic/gemini/unknown"]["count"] >= 1
+
+    # Context enrichment finishes in the background
+    assert result["context"]["status"] == "pending"
+    job = background_jobs.wait(result["context"]["job_id"], timeout=5)
+    assert job["status"] == "completed"
+    assert job["result"] == {"repo": "test-repo"}
+
+
+def test_critical_security_issue_cancels_remaining_agents():
+    system = AgentSystem.__new__(AgentSystem)
+    system.provider = "gemini"
+    system.agents = {
+        "security": CriticalSecurityAgent(),
+        "quality": SlowAsyncAgent(5),
+        "logic": SlowAsyncAgent(5),
+        "context": SlowContextAgent(),
+        "decision": StaticDecisionAgent()
+    }
+
+    start = time.time()
+    result = asyncio.run(system.analyze_pull_request(AnalysisContext(repo_name="test-repo")))
+    duration = time.time() - start
+
+    assert duration < 1
+    assert len(result["security_issues"]) == 1
+    assert result["quality_issues"] == []
+    assert result["errors"]["quality"] == ["Skipped: critical security issue found"]
+    assert result["errors"]["logic"] == ["Skipped: critical security issue found"]
+
+
+class RecordingSecurityAgent:
+    """Async security stub that records which snippets it was asked to review."""
+    def __init__(self):
+        self.reviewed = None
+
+    async def aanalyze(self, state: WorkflowState, on_result=None) -> AgentResponse:
+        self.reviewed = [s.file_path for s in state.context.code_snippets]
+        return AgentResponse(success=True, results=[])
+
+
+def test_clean_snippets_skip_security_llm():
+    security = RecordingSecurityAgent()
+    system = AgentSystem.__new__(AgentSystem)
+    system.provider = "gemini"
+    system.agents = {
+        "security": security,
+        "quality": SlowAsyncAgent(0),
+        "logic": SlowAsyncAgent(0),
+        "context": SlowContextAgent(),
+        "decision": StaticDecisionAgent()
+    }
+
+    async def fake_scan(snippet):
+        return [] if snippet.file_path == "clean.py" else None
+
+    context = AnalysisContext(code_snippets=[
+        CodeSnippet(file_path="clean.py", content="x = 1", language="python")
+    ])
+    with patch("agents.static_analysis.scan_snippet", fake_scan):
+        result = asyncio.run(system.analyze_pull_request(context))
+        assert security.reviewed is None
+        assert result["security_issues"] == []
+
+        context.code_snippets.append(CodeSnippet(file_path="app.js", content="eval(x)", language="javascript"))
+        asyncio.run(system.analyze_pull_request(context))
+        assert security.reviewed == ["app.js"]
+
+
+def test_record_feedback_returns_before_writing():
+    system = AgentSystem.__new__(AgentSystem)
+    written = threading.Event()
+    release = threading.Event()
+
+    def slow_write(pr_id, feedback):
+        release.wait(5)
+        written.set()
+
+    system._write_feedback = slow_write
+
+    job_id = system.record_feedback("PR-1", {"accepted_issues": []})
+    assert not written.is_set()
+    assert AgentSystem.get_context_job(job_id)["status"] == "pending"
+
+    release.set()
+    assert background_jobs.wait(job_id, timeout=5)["status"] == "completed"
+    assert written.is_set()
+
+
+def test_analyze_pull_request_sync_times_out_in_worker_thread():
+    system = AgentSystem.__new__(AgentSystem)
+    system.provider = "gemini"
+    system.agents = {
+        "security": SlowAsyncAgent(5),
+        "quality": SlowAsyncAgent(0),
+        "logic": SlowAsyncAgent(0),
+        "context": SlowContextAgent(),
+        "decision": StaticDecisionAgent()
+    }
+
+    results = []
+    with patch("agents.agent_system.ANALYSIS_TIMEOUT_SECONDS", 0.3):
+        # SIGALRM-based timeouts could not be installed off the main thread
+        worker = threading.Thread(
+            target=lambda: results.append(system.analyze_pull_request_sync(AnalysisContext()))
+        )
+        start = time.time()
+        worker.start()
+        worker.join()
+        duration = time.time() - start
+
+    assert "timed out" in results[0]["error"]
+    assert duration < 2
+
+
 def main():
     print("Starting Mock Agent System Test")
 
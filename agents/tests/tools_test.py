@@ -0,0 +1,128 @@
+import os
+import sys
+from unittest.mock import patch
+
+import orjson
+import pytest
+
+# Add root to path so `agents` can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from agents.models import CodeSnippet
+from agents.tools import (
+    DEFAULT_MAX_OUTPUT_TOKENS, MAX_OUTPUT_TOKENS, FreeLLMProvider, _create_llm, compress_code, copy_results,
+    dedupe_snippets, filter_snippets, get_llm, get_provider, parse_json_array
+)
+
+
+def test_get_llm_is_memoized_per_model():
+    """Test agents asking for the same model share one client"""
+    _create_llm.cache_clear()
+    with patch('agents.tools.ChatGoogleGenerativeAI') as mock_chat:
+        mock_chat.side_effect = lambda **kwargs: object()
+
+        security = get_llm("security")
+        quality = FreeLLMProvider("gemini").get_llm("quality")
+        decision = get_llm("decision")
+
+        assert security is quality
+        assert security is not decision
+        assert get_llm("security", temperature=0.7) is not security
+        assert mock_chat.call_count == 3
+    _create_llm.cache_clear()
+
+
+def test_analysis_agents_get_capped_output():
+    """Test the analysis agents' clients are built with their output token ceiling"""
+    _create_llm.cache_clear()
+    with patch('agents.tools.ChatGoogleGenerativeAI') as mock_chat:
+        get_llm("logic")
+        get_llm("security")
+        get_llm("decision")
+
+        caps = [c.kwargs["max_tokens"] for c in mock_chat.call_args_list]
+        assert caps == [MAX_OUTPUT_TOKENS["logic"], MAX_OUTPUT_TOKENS["security"], DEFAULT_MAX_OUTPUT_TOKENS]
+        assert caps[0] < caps[2] and caps[1] < caps[2]
+    _create_llm.cache_clear()
+
+
+def test_get_provider_is_shared():
+    """Test every caller of a provider name gets the same FreeLLMProvider"""
+    assert get_provider("groq") is get_provider("groq")
+    assert get_provider("groq") is not get_provider("gemini")
+    assert get_provider("groq").provider == "groq"
+
+
+def test_filter_snippets_skips_trivial_files():
+    """Test short, generated, vendored, minified and binary files never reach the LLM"""
+    code = "def total(items):\n    return sum(item.price for item in items)\n"
+    snippets = [
+        CodeSnippet(file_path="app/orders.py", content=code, language="python"),
+        CodeSnippet(file_path="app/__init__.py", content="\n\n", language="python"),
+        CodeSnippet(file_path="app/version.py", content="VERSION = '1.0'", language="python"),
+        CodeSnippet(file_path="api/pb.go", content="// Code generated by protoc-gen-go. DO NOT EDIT.\n" + code, language="go"),
+        CodeSnippet(file_path="web/node_modules/lib/index.js", content=code, language="javascript"),
+        CodeSnippet(file_path="static/app.min.js", content=code, language="javascript"),
+        CodeSnippet(file_path="assets/logo.py", content="\x00\x01" + code, language="python")
+    ]
+
+    to_analyze, skipped = filter_snippets(snippets)
+
+    assert [s.file_path for s in to_analyze] == ["app/orders.py"]
+    assert skipped == [s.file_path for s in snippets[1:]]
+
+
+def test_compress_code_keeps_line_numbers():
+    """Test compression shortens indentation but never adds or removes lines"""
+    code = (
+        "def total(items):   \n"
+        "    result = sum(item.price\n"
+        "                  for item in items)\n"
+        "\n"
+        "    if result:\n"
+        "        return result\n"
+    )
+
+    compressed = compress_code(code)
+
+    assert compressed.split("\n") == [
+        "def total(items):",
+        "\tresult = sum(item.price",
+        "                  for item in items)",
+        "",
+        "\tif result:",
+        "\t\treturn result",
+        ""
+    ]
+    assert len(compressed) < len(code)
+    assert compress_code("x = 1\n") == "x = 1\n"
+
+
+def test_parse_json_array_ignores_fences_and_prose():
+    """Test the JSON array is found whether fenced, bare or surrounded by prose"""
+    issues = [{"type": "style", "line": 3, "tags": ["pep8"]}]
+    encoded = orjson.dumps(issues).decode()
+
+    assert parse_json_array(f"```json\n{encoded}\n```") == issues
+    assert parse_json_array(f"Here are the issues:\n```\n{encoded}\n```\nLet me know!") == issues
+    assert parse_json_array(f"Found these: {encoded}") == issues
+    assert parse_json_array("[]") == []
+    with pytest.raises(orjson.JSONDecodeError):
+        parse_json_array("The code looks fine.")
+
+
+def test_dedupe_snippets_and_copy_results():
+    """Test identical files are analyzed once and their results copied to each duplicate"""
+    snippets = [
+        CodeSnippet(file_path="gen/a.py", content="x = fetch()", language="python"),
+        CodeSnippet(file_path="gen/b.py", content="x = fetch()", language="python"),
+        CodeSnippet(file_path="other.py", content="y = fetch()", language="python"),
+        CodeSnippet(file_path="gen/c.py", content="x = fetch()", language="python")
+    ]
+
+    unique, duplicates = dedupe_snippets(snippets)
+
+    assert [s.file_path for s in unique] == ["gen/a.py", "other.py"]
+    assert duplicates == {"gen/a.py": ["gen/b.py", "gen/c.py"]}
+    copies = copy_results([{"file": "gen/a.py", "line": 1}, {"file": "other.py", "line": 2}], duplicates)
+    assert copies == [{"file": "gen/b.py", "line": 1}, {"file": "gen/c.py", "line": 1}]
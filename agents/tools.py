@@ -1,12 +1,79 @@
 import os
 import re
+import asyncio
 import difflib
 import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Optional
+import httpx
+import orjson
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_groq import ChatGroq
 from langchain_huggingface import HuggingFaceEndpoint
 from langchain_core.output_parsers import JsonOutputParser
 
+try:
+    import h2  # noqa: F401 - enables HTTP/2 support in httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# LLM requests an agent keeps in flight at once; provider quotas still apply on top
+MAX_CONCURRENT_BATCHES = 10
+
+# Snippets above this many estimated tokens are sent on their own to the small model tier
+LONG_SNIPPET_TOKENS = 4000
+
+# Snippets no agent sends to the LLM (see should_analyze)
+MIN_SNIPPET_CHARS = 20
+GENERATED_HEADER_CHARS = 512
+GENERATED_MARKERS = ("autogenerated", "auto-generated", "code generated by", "@generated")
+VENDORED_DIRS = ("node_modules/", "vendor/", "third_party/")
+MINIFIED_SUFFIXES = (".min.js", ".min.css")
+
+# A JSON array, taken from inside a ```json fence when the response has one
+JSON_ARRAY = re.compile(r"```(?:json)?\s*(\[.*?\])\s*```|(\[.*\])", re.DOTALL)
+
+# Connection pools handed to LLM clients built inside shared_http_clients()
+_shared_http_clients = contextvars.ContextVar("shared_http_clients", default=None)
+
+
+def create_http_clients() -> tuple:
+    """Create a keep-alive (sync, async) httpx client pair for LLM traffic."""
+    return (
+        httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT, http2=HTTP2_AVAILABLE),
+        httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT, http2=HTTP2_AVAILABLE)
+    )
+
+
+@contextmanager
+def shared_http_clients(http_client: httpx.Client, http_async_client: httpx.AsyncClient):
+    """Make every LLM client created inside the block reuse the given connection pools."""
+    token = _shared_http_clients.set((http_client, http_async_client))
+    try:
+        yield
+    finally:
+        _shared_http_clients.reset(token)
+
+
+# Output token ceiling per agent; the analysis agents answer a whole batch in
+# one response, and "[]" / "No logic issues detected." keep clean files short
+MAX_OUTPUT_TOKENS = {"security": 2048, "quality": 2048, "logic": 1536}
+DEFAULT_MAX_OUTPUT_TOKENS = 4096
+
+# Fastest model per provider, used for files too long to be worth the regular tier
+SMALL_MODELS = {
+    "gemini": "gemini-1.5-flash-8b",
+    "groq": "llama3-8b-8192",
+    "huggingface": "microsoft/DialoGPT-medium"
+}
+
 
 class FreeLLMProvider:
     def __init__(self, provider="gemini"):
@@ -38,37 +105,67 @@ class FreeLLMProvider:
             }
         }
 
-    def get_llm(self, agent_type: str, temperature: float = 0.2):
-        model_name = self.models[self.provider][agent_type]
+    def get_llm(self, agent_type: str, temperature: float = 0.2, size: str = "default"):
+        """Return the LLM for an agent; ``size="small"`` picks the provider's fastest tier instead."""
+        model_name = SMALL_MODELS[self.provider] if size == "small" else self.models[self.provider][agent_type]
+        # Only Groq clients take the shared connection pools, so only they are keyed on them
+        http_clients = _shared_http_clients.get() if self.provider == "groq" else None
+        max_tokens = MAX_OUTPUT_TOKENS.get(agent_type, DEFAULT_MAX_OUTPUT_TOKENS)
+        return _create_llm(self.provider, model_name, temperature, http_clients, max_tokens)
 
-        if self.provider == "gemini":
-            return ChatGoogleGenerativeAI(
-                google_api_key=os.getenv("GOOGLE_API_KEY"),
-                model=model_name,
-                temperature=temperature,
-                max_tokens=4096,
-                convert_system_message_to_human=True
-            )
-        elif self.provider == "groq":
-            return ChatGroq(
-                groq_api_key=os.getenv("GROQ_API_KEY"),
-                model_name=model_name,
-                temperature=temperature,
-                max_tokens=4096
-            )
-        elif self.provider == "huggingface":
-            return HuggingFaceEndpoint(
-                huggingfacehub_api_token=os.getenv("HUGGINGFACE_API_TOKEN"),
-                repo_id=model_name,
-                temperature=temperature,
-                max_length=2048
-            )
-        else:
-            raise ValueError(f"Unsupported provider: {self.provider}")
+
+@lru_cache(maxsize=32)
+def _create_llm(provider: str, model_name: str, temperature: float, http_clients=None,
+                max_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS):
+    """Build an LLM client; agents asking for the same model and settings share one instance."""
+    if provider == "gemini":
+        return ChatGoogleGenerativeAI(
+            google_api_key=os.getenv("GOOGLE_API_KEY"),
+            model=model_name,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            convert_system_message_to_human=True
+        )
+    elif provider == "groq":
+        http_client, http_async_client = http_clients or (None, None)
+        return ChatGroq(
+            groq_api_key=os.getenv("GROQ_API_KEY"),
+            model_name=model_name,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            http_client=http_client,
+            http_async_client=http_async_client
+        )
+    elif provider == "huggingface":
+        return HuggingFaceEndpoint(
+            huggingfacehub_api_token=os.getenv("HUGGINGFACE_API_TOKEN"),
+            repo_id=model_name,
+            temperature=temperature,
+            max_length=2048
+        )
+    else:
+        raise ValueError(f"Unsupported provider: {provider}")
+
+
+@lru_cache(maxsize=8)
+def get_provider(name: str = "gemini") -> FreeLLMProvider:
+    """Return the process-wide FreeLLMProvider for a provider name."""
+    return FreeLLMProvider(name)
 
 
 def get_llm(agent_type: str, provider: str = "gemini", temperature: float = 0.2):
-    return FreeLLMProvider(provider).get_llm(agent_type, temperature=temperature)
+    return get_provider(provider).get_llm(agent_type, temperature=temperature)
+
+
+def parse_json_array(response: str):
+    """Parse the JSON array in an LLM response, ignoring fences and surrounding prose.
+
+    Raises orjson.JSONDecodeError when there is no valid array.
+    """
+    match = JSON_ARRAY.search(response)
+    if match is None:
+        raise orjson.JSONDecodeError("No JSON array in response", response, 0)
+    return orjson.loads(match.group(1) or match.group(2))
 
 
 def parse_code_blocks(response: str) -> list:
@@ -77,9 +174,216 @@ def parse_code_blocks(response: str) -> list:
     return re.findall(pattern, response, re.DOTALL)
 
 
+def estimate_tokens(text: str) -> int:
+    """Rough token count estimate (~4 characters per token)."""
+    return len(text) // 4
+
+
+def should_analyze(snippet) -> bool:
+    """Whether a snippet is worth an LLM request.
+
+    Trivially short, generated, vendored, minified and binary files are not.
+    """
+    content = snippet.content
+    if len(content.strip()) < MIN_SNIPPET_CHARS or "\x00" in content:
+        return False
+
+    path = snippet.file_path.lower()
+    if path.endswith(MINIFIED_SUFFIXES) or any(path.startswith(d) or f"/{d}" in path for d in VENDORED_DIRS):
+        return False
+
+    head = content[:GENERATED_HEADER_CHARS].lower()
+    return not any(marker in head for marker in GENERATED_MARKERS)
+
+
+def filter_snippets(snippets: list) -> tuple:
+    """Split snippets into (to_analyze, skipped_paths) using should_analyze."""
+    to_analyze, skipped = [], []
+    for snippet in snippets:
+        if should_analyze(snippet):
+            to_analyze.append(snippet)
+        else:
+            skipped.append(snippet.file_path)
+    return to_analyze, skipped
+
+
+def dedupe_snippets(snippets: list) -> tuple:
+    """Split snippets into (unique, duplicates) by content.
+
+    ``duplicates`` maps the file path of each kept snippet to the paths of
+    byte-identical copies, which never reach the LLM.
+    """
+    first_by_hash = {}
+    unique, duplicates = [], {}
+    for snippet in snippets:
+        digest = hash_content(snippet.content)
+        original = first_by_hash.get(digest)
+        if original is None:
+            first_by_hash[digest] = snippet
+            unique.append(snippet)
+        else:
+            duplicates.setdefault(original.file_path, []).append(snippet.file_path)
+    return unique, duplicates
+
+
+def copy_results(results: list, duplicates: dict) -> list:
+    """Results of each deduplicated file, re-labelled for every one of its copies."""
+    copies = []
+    for result in results:
+        is_dict = isinstance(result, dict)
+        file_path = result.get("file") if is_dict else result.file
+        for alias in duplicates.get(file_path, ()):
+            copies.append({**result, "file": alias} if is_dict else result.model_copy(update={"file": alias}))
+    return copies
+
+
+def batch_snippets(snippets: list, max_batch_tokens: int = 6000, solo_tokens: Optional[int] = None) -> list:
+    """Greedily pack code snippets into batches that fit a token budget.
+
+    A snippet larger than the budget, or than ``solo_tokens``, gets a batch
+    of its own.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for snippet in snippets:
+        tokens = estimate_tokens(snippet.content)
+        if solo_tokens is not None and tokens > solo_tokens:
+            batches.append([snippet])
+            continue
+        if current and current_tokens + tokens > max_batch_tokens:
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(snippet)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def gather_bounded(func, items: list, max_concurrency: int = MAX_CONCURRENT_BATCHES) -> list:
+    """Await ``func(item)`` for every item, at most ``max_concurrency`` at a time.
+
+    Outcomes come back in input order; an exception raised for one item is
+    returned in its place instead of cancelling the others.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(item):
+        async with semaphore:
+            return await func(item)
+
+    return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+
+def map_bounded(func, items: list, max_concurrency: int = MAX_CONCURRENT_BATCHES) -> list:
+    """Thread-pool counterpart of gather_bounded for synchronous callers."""
+    def run(item):
+        try:
+            return func(item)
+        except Exception as e:
+            return e
+
+    if len(items) <= 1:
+        return [run(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(items))) as pool:
+        return list(pool.map(run, items))
+
+
+def compress_code(content: str) -> str:
+    """Shrink code for a prompt without moving any line.
+
+    Trailing whitespace is dropped and space indentation is rewritten as one
+    tab per level, so line numbers in the LLM's answer still match the file.
+    """
+    lines = [line.rstrip() for line in content.split("\n")]
+    indents = [len(line) - len(line.lstrip(" ")) for line in lines if line.startswith(" ")]
+    unit = min(indents, default=0)
+    if unit < 2:
+        return "\n".join(lines)
+
+    for i, line in enumerate(lines):
+        indent = len(line) - len(line.lstrip(" "))
+        # Continuation lines aligned to something other than a level are left alone
+        if indent and indent % unit == 0:
+            lines[i] = "\t" * (indent // unit) + line[indent:]
+    return "\n".join(lines)
+
+
+def format_snippet_batch(snippets: list, findings: dict = None, compress: bool = False) -> dict:
+    """Build the prompt inputs for a batch, delimiting each file with a marker.
+
+    ``findings`` maps file paths to static analyzer findings, which are
+    appended after the file's code. ``compress`` sends each file through
+    compress_code.
+    """
+    findings = findings or {}
+    blocks = []
+    for s in snippets:
+        block = f"=== FILE: {s.file_path} ===\n{compress_code(s.content) if compress else s.content}"
+        if findings.get(s.file_path):
+            block += "\n--- Static analyzer findings ---\n" + "\n".join(
+                f"line {f['line']}: [{f['rule']}] {f['message']}" for f in findings[s.file_path]
+            )
+        blocks.append(block)
+    return {
+        "file_path": ", ".join(s.file_path for s in snippets),
+        "code": "\n\n".join(blocks)
+    }
+
+
+
+class JSONObjectStream:
+    """Incrementally extract top-level JSON objects from a streamed array.
+
+    Feed text chunks as they arrive; every object whose closing brace has been
+    seen is returned immediately. Text outside objects (brackets, commas,
+    markdown fences) is ignored.
+    """
+
+    def __init__(self):
+        self.objects_seen = 0
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> list:
+        objects = []
+        for char in chunk:
+            if self._depth == 0:
+                if char == "{":
+                    self._buffer = [char]
+                    self._depth = 1
+                continue
+
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        objects.append(orjson.loads("".join(self._buffer)))
+                        self.objects_seen += 1
+                    except orjson.JSONDecodeError:
+                        pass
+        return objects
+
+
 def hash_content(content: str) -> str:
-    """Hash content string using SHA-256."""
-    return hashlib.sha256(content.encode()).hexdigest()
+    """Hash content string using 128-bit BLAKE2b (stable across processes)."""
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
 
 
 def create_parser(model):
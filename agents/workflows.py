@@ -1,11 +1,11 @@
 from langgraph.graph import StateGraph, END, START
-from .models import WorkflowState
+from .models import Severity, WorkflowState
 
 
 
 def route_based_on_severity(state: WorkflowState) -> str:
     """Route to decision making if critical issues are found, otherwise enrich context."""
-    critical = any(issue.severity == "critical" for issue in state.security_results)
+    critical = any(issue.severity is Severity.CRITICAL for issue in state.security_results)
     return "make_decision" if critical else "enrich_context"
 
 
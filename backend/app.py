@@ -14,7 +14,9 @@ import sys
 import traceback
 from dotenv import load_dotenv
 import json
+import asyncio
 import logging
+from collections import Counter
 from werkzeug.serving import is_running_from_reloader
 
 # Disable noisy logging
@@ -38,13 +40,18 @@ if project_root not in sys.path:
 AGENT_SYSTEM_AVAILABLE = False
 try:
     from agents.agent_system import AgentSystem
+    from agents.background import background_jobs
     from agents.models import AnalysisContext, CodeSnippet, Vulnerability, QualityIssue
     from agents.github_integration import GitHubIntegration
     from agents.security_agent import SecurityAgent
     from agents.quality_agent import QualityAgent
     from agents.logic_agent import LogicAgent
     from agents.decision_agent import DecisionAgent
+    from agents.metrics import render_metrics
+    from agents.log_config import configure_logging
     
+    # Agent log output is written by a background listener thread
+    configure_logging(level=logging.INFO, json_format=os.getenv("LOG_FORMAT") == "json")
     AGENT_SYSTEM_AVAILABLE = True
     print("Agent system successfully imported")
     
@@ -52,6 +59,7 @@ except ImportError as e:
     print(f"Warning: Could not import agent system: {e}")
     print("Running without agent system - some features will be limited")
     AgentSystem = None
+    background_jobs = None
     AnalysisContext = None
     CodeSnippet = None
     GitHubIntegration = None
@@ -84,6 +92,9 @@ analysis_queue = []
 # Thread lock for thread-safe operations
 thread_lock = threading.Lock()
 
+# Seconds to wait for a PR's context enrichment before flushing its memory
+CONTEXT_JOB_TIMEOUT = 300
+
 # Add this function to save/load tasks from disk
 def load_tasks():
     global pull_requests, analysis_history
@@ -171,7 +182,9 @@ def api_info():
             "POST /api/analysis/pr - Analyze pull request",
             "POST /api/analysis/security - Security analysis",
             "GET /api/analytics - Get analytics data",
-            "GET /api/agents/status - Agent status"
+            "GET /api/agents/status - Agent status",
+            "GET /api/context/<job_id> - Context enrichment job status",
+            "GET /metrics - Prometheus agent latency and token metrics"
         ]
     })
 
@@ -272,9 +285,11 @@ def process_security_analysis(task_id):
                 security_issues.extend(issues)
         
         # Generate decision based on actual results
-        critical_count = sum(1 for i in security_issues if i.get("severity") == "critical")
-        high_count = sum(1 for i in security_issues if i.get("severity") == "high")
-        medium_count = sum(1 for i in security_issues if i.get("severity") == "medium")
+        severity_counts = Counter(i.get("severity") for i in security_issues)
+        critical_count = severity_counts["critical"]
+        high_count = severity_counts["high"]
+        medium_count = severity_counts["medium"]
+        total_issues = len(security_issues)
         
         if critical_count > 0:
             decision = {
@@ -308,12 +323,12 @@ def process_security_analysis(task_id):
         # Generate results
         results = {
             "security_issues": security_issues,
-            "total_issues": len(security_issues),
+            "total_issues": total_issues,
             "severity_breakdown": {
                 "critical": critical_count,
                 "high": high_count,
                 "medium": medium_count,
-                "low": len(security_issues) - critical_count - high_count - medium_count
+                "low": total_issues - critical_count - high_count - medium_count
             },
             "decision": decision,
             "errors": errors,
@@ -332,7 +347,7 @@ def process_security_analysis(task_id):
             analysis_history.append(task.copy())
             save_tasks()  # Save after modification
         
-        print(f"Security analysis task {task_id} completed successfully with {len(security_issues)} issues")
+        print(f"Security analysis task {task_id} completed successfully with {total_issues} issues")
         
     except Exception as e:
         error_msg = f"Error processing security analysis task {task_id}: {str(e)}"
@@ -431,6 +446,13 @@ def get_metrics():
         }
     })
 
+# Prometheus scrape endpoint for per-agent latency and token metrics
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if not AGENT_SYSTEM_AVAILABLE:
+        return "", 200, {"Content-Type": "text/plain; version=0.0.4"}
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
 # Agent status endpoint
 @app.route('/api/agents/status', methods=['GET'])
 def get_agent_status():
@@ -535,6 +557,15 @@ def analyze_pr():
         "pr_url": pr_url
     }), 202
 
+def close_agent_system(agent_system, context_job_id=None):
+    """Flush an analysis' buffered context memory once enrichment is done, then close its HTTP pools"""
+    try:
+        if context_job_id:
+            background_jobs.wait(context_job_id, timeout=CONTEXT_JOB_TIMEOUT)
+        asyncio.run(agent_system.aclose())
+    except Exception as e:
+        print(f"Error closing agent system: {str(e)}")
+
 def process_analysis_task(task_id):
     try:
         # Wait a bit to ensure task is in dictionary
@@ -552,6 +583,8 @@ def process_analysis_task(task_id):
 
         results = {}
         errors = []
+        agent_system = None
+        context_job_id = None
         
         if AGENT_SYSTEM_AVAILABLE and agents:
             try:
@@ -579,14 +612,13 @@ def process_analysis_task(task_id):
                 if not pr_details:
                     raise Exception("Failed to get PR details from GitHub")
                 
-                # Get code snippets
+                # Get code snippets, skipping removed files
+                file_paths = [f['filename'] for f in pr_details['files'] if f['status'] != 'removed']
+                contents = github.get_file_contents(full_repo_name, file_paths, pr_details['head_sha'])
+
                 code_snippets = []
                 for file_info in pr_details['files']:
-                    # Skip removed files
-                    if file_info['status'] == 'removed':
-                        continue
-                        
-                    content = github.get_file_content(full_repo_name, file_info['filename'], pr_details['head_sha'])
+                    content = contents.get(file_info['filename'])
                     if content:
                         snippet = CodeSnippet(
                             file_path=file_info['filename'],
@@ -615,8 +647,9 @@ def process_analysis_task(task_id):
                 
                 # Run analysis
                 start_time = time.time()
-                analysis_results = agent_system.analyze_pull_request(context)
+                analysis_results = agent_system.analyze_pull_request_sync(context)
                 duration = time.time() - start_time
+                context_job_id = (analysis_results.get("context") or {}).get("job_id")
                 
                 print(f"Analysis completed in {duration:.2f} seconds")
                 print(f"Security issues: {len(analysis_results.get('security_issues', []))}")
@@ -634,6 +667,7 @@ def process_analysis_task(task_id):
                     "quality_issues": [issue.model_dump() for issue in quality_issues],
                     "logic_issues": logic_issues,  # Already dictionaries from LogicAgent
                     "decision": analysis_results.get("decision", {}),
+                    "context": analysis_results.get("context", {}),
                     "pr_details": pr_details,
                     "analysis_duration": duration,
                     "total_issues": len(security_issues) + len(quality_issues) + len(logic_issues)
@@ -647,6 +681,11 @@ def process_analysis_task(task_id):
                 traceback.print_exc()
                 errors.append(error_msg)
                 results = {"error": error_msg, "errors": errors}
+            finally:
+                # Context memory is buffered until flushed, so close once enrichment
+                # has written it, without holding up the task result
+                if agent_system is not None:
+                    threading.Thread(target=close_agent_system, args=(agent_system, context_job_id)).start()
         else:
             # Agent system not available
             error_msg = "Agent system not available - cannot perform full PR analysis"
@@ -847,6 +886,16 @@ def get_task_status(task_id):
     
     return jsonify({"error": "Task not found"}), 404
 
+@app.route('/api/context/<job_id>', methods=['GET'])
+def get_context_job(job_id):
+    if not AGENT_SYSTEM_AVAILABLE:
+        return jsonify({"error": "Agent system not available"}), 503
+
+    job = AgentSystem.get_context_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
 def background_processor():
     """Continuously process tasks in the background"""
     print("Background processor started")